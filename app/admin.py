@@ -1,15 +1,21 @@
 from django.contrib import admin
+from django.db import transaction
+from django.utils import timezone
 from django.utils.html import format_html
-from .models import Product, Category, Currency, City, BannerPost
+from .models import Product, Category, Currency, City, BannerPost, ModerationTerm
+from . import facets, moderation
+from .caching import bump_catalog_version
 
 class ProductAdmin(admin.ModelAdmin):
-    list_display = ('title', 'category', 'price_with_currency', 'city', 'status_badge', 'author', 'created_at', 'view_count')
+    list_display = ('title', 'category', 'price_with_currency', 'city', 'status_badge', 'author', 'created_at', 'view_count', 'favorite_count')
     list_filter = ('status', 'category', 'city', 'currency', 'created_at')
     search_fields = ('title', 'description', 'author__username')
-    readonly_fields = ('created_at', 'updated_at', 'get_image_preview')
+    readonly_fields = ('created_at', 'updated_at', 'get_image_preview', 'view_count', 'favorite_count',
+                       'queued_at', 'moderated_at', 'time_in_queue')
     date_hierarchy = 'created_at'
     list_per_page = 20
-    actions = ['approve_products', 'publish_products', 'reject_products', 'archive_products']
+    list_select_related = ('category', 'city', 'currency', 'author')
+    actions = ['approve_products', 'publish_products', 'reject_products', 'archive_products', 'requeue_products']
     
     fieldsets = (
         ('Основная информация', {
@@ -22,7 +28,8 @@ class ProductAdmin(admin.ModelAdmin):
             'fields': ('price', 'currency', 'city')
         }),
         ('Статус и даты', {
-            'fields': ('status', 'created_at', 'updated_at')
+            'fields': ('status', 'created_at', 'updated_at', 'queued_at', 'moderated_at', 'time_in_queue',
+                       'view_count', 'favorite_count')
         }),
     )
     
@@ -32,6 +39,14 @@ class ProductAdmin(admin.ModelAdmin):
         return "Нет изображения"
     get_image_preview.short_description = 'Предпросмотр изображения'
     
+    def time_in_queue(self, obj):
+        if obj.queued_at is None:
+            return '-'
+        waited = (obj.moderated_at or timezone.now()) - obj.queued_at
+        minutes = int(waited.total_seconds() // 60)
+        return f"{minutes // 60} ч {minutes % 60} мин" if minutes >= 60 else f"{minutes} мин"
+    time_in_queue.short_description = 'Время в очереди'
+
     def price_with_currency(self, obj):
         return f"{obj.price} {obj.currency}"
     price_with_currency.short_description = 'Цена'
@@ -42,14 +57,16 @@ class ProductAdmin(admin.ModelAdmin):
             1: 'info',     # Одобрено
             2: 'danger',   # Отклонено
             3: 'success',  # Опубликовано
-            4: 'secondary' # Архив
+            4: 'secondary', # Архив
+            5: 'warning',  # Ручная проверка
         }
         status_names = {
             0: 'На модерации',
             1: 'Одобрено',
             2: 'Отклонено',
             3: 'Опубликовано',
-            4: 'В архиве'
+            4: 'В архиве',
+            5: 'Ручная проверка',
         }
         color = status_colors.get(obj.status, 'primary')
         name = status_names.get(obj.status, 'Неизвестно')
@@ -59,35 +76,55 @@ class ProductAdmin(admin.ModelAdmin):
                           name)
     status_badge.short_description = 'Статус'
     
-    def view_count(self, obj):
-        return obj.get_view_count()
-    view_count.short_description = 'Просмотры'
-    
     # Массовые действия
+    def _update_status(self, queryset, status):
+        """
+        Массово меняет статус, пересчитывает счётчики фильтров затронутых
+        категорий и сбрасывает их кэш — .update() обходит сигналы.
+        """
+        category_ids = set(queryset.values_list('category_id', flat=True))
+        now = timezone.now()
+        # Время в очереди модерации: вход и выход из неё
+        if status == 0:
+            queryset.exclude(status__in=(0, 5)).update(queued_at=now, moderation_due=now, moderated_at=None)
+        elif status != 5:
+            queryset.filter(status__in=(0, 5)).update(moderated_at=now)
+        updated = queryset.update(status=status)
+        facets.rebuild(category_ids)
+        transaction.on_commit(lambda: bump_catalog_version(category_ids))
+        return updated
+    
     def approve_products(self, request, queryset):
         """Одобрить выбранные объявления (статус 1)"""
-        updated = queryset.update(status=1)
+        updated = self._update_status(queryset, 1)
         self.message_user(request, f'Одобрено {updated} объявлений.')
     approve_products.short_description = "Одобрить выбранные объявления"
     
     def publish_products(self, request, queryset):
         """Опубликовать выбранные объявления (статус 3)"""
-        updated = queryset.update(status=3)
+        updated = self._update_status(queryset, 3)
         self.message_user(request, f'Опубликовано {updated} объявлений.')
     publish_products.short_description = "Опубликовать выбранные объявления"
     
     def reject_products(self, request, queryset):
         """Отклонить выбранные объявления (статус 2)"""
-        updated = queryset.update(status=2)
+        updated = self._update_status(queryset, 2)
         self.message_user(request, f'Отклонено {updated} объявлений.')
     reject_products.short_description = "Отклонить выбранные объявления"
     
     def archive_products(self, request, queryset):
         """Архивировать выбранные объявления (статус 4)"""
-        updated = queryset.update(status=4)
+        updated = self._update_status(queryset, 4)
         self.message_user(request, f'Архивировано {updated} объявлений.')
     archive_products.short_description = "Архивировать выбранные объявления"
 
+    def requeue_products(self, request, queryset):
+        """Вернуть выбранные объявления на автоматическую модерацию (статус 0)"""
+        updated = self._update_status(queryset, 0)
+        moderation.schedule()
+        self.message_user(request, f'На модерацию отправлено {updated} объявлений.')
+    requeue_products.short_description = "Отправить на автоматическую модерацию"
+
 class CategoryAdmin(admin.ModelAdmin):
     list_display = ('name', 'slug', 'order', 'get_image_preview')
     list_editable = ('order',)
@@ -116,11 +153,18 @@ class ProductViewAdmin(admin.ModelAdmin):
     date_hierarchy = 'created_at'
     readonly_fields = ('product', 'user', 'ip_address', 'session_key', 'created_at')
 
+class ModerationTermAdmin(admin.ModelAdmin):
+    list_display = ('term', 'kind', 'is_active', 'updated_at')
+    list_editable = ('is_active',)
+    list_filter = ('kind', 'is_active')
+    search_fields = ('term',)
+
 # Регистрация моделей с кастомными админ-классами
 admin.site.register(Product, ProductAdmin)
 admin.site.register(Category, CategoryAdmin)
 admin.site.register(Currency, CurrencyAdmin)
 admin.site.register(City, CityAdmin)
+admin.site.register(ModerationTerm, ModerationTermAdmin)
 
 
 admin.site.register(BannerPost)
\ No newline at end of file
@@ -0,0 +1,297 @@
+import os
+import pickle
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from django.core.cache import caches
+from django.core.cache.backends.base import BaseCache, DEFAULT_TIMEOUT
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.functional import cached_property
+
+from .caching import is_atomic
+
+
+# Журнал инвалидаций в общем кэше: счётчик сообщений и кольцо из RING_SIZE
+# записей, сообщение n лежит в ячейке n % RING_SIZE
+INVALIDATION_HEAD = 'l1_invalidation_head'
+INVALIDATION_ENTRY = 'l1_invalidation_{}'
+RING_SIZE = 1024
+# Сколько ждать запись, номер которой уже выдан, прежде чем считать её потерянной
+GAP_TIMEOUT = 2
+CLEAR_ALL = '*'
+
+
+class TwoTierCache(BaseCache):
+    """
+    Двухуровневый кэш: небольшой LRU в памяти процесса (L1) перед общим для
+    всех воркеров хранилищем (L2 — другой алиас из CACHES, Redis или
+    Memcached; LocMemCache годится для одного процесса).
+
+    В L2 значение хранится вместе со сроком истечения, чтобы L1 не держал
+    его дольше, чем L2. Записи и удаления идут в L2 и публикуются в журнал
+    инвалидаций в том же L2: номер сообщения выдаёт атомарный incr, запись
+    ложится в ячейку кольца фиксированного размера, поэтому журнал не растёт.
+    Каждый воркер не чаще раза в CHECK_INTERVAL секунд дочитывает журнал
+    одним get_many и выбрасывает изменённые ключи из своего L1. Если кольцо
+    успело обернуться или запись пропала, L1 очищается целиком. L1_TIMEOUT
+    ограничивает срок жизни записи в L1 на случай потерянного сообщения.
+
+    OPTIONS:
+        L2           — алиас общего кэша (обязательно)
+        MAX_BYTES    — бюджет L1 в байтах сериализованных значений
+        L1_TIMEOUT   — максимальное время жизни записи в L1, секунды
+        CHECK_INTERVAL — период чтения журнала инвалидаций, секунды
+    """
+
+    def __init__(self, location, params):
+        options = params.get('OPTIONS', {})
+        super().__init__(params)
+        self._l2_alias = options['L2']
+        self.max_bytes = options.get('MAX_BYTES', 16 * 1024 * 1024)
+        self.l1_timeout = options.get('L1_TIMEOUT', 60)
+        self.check_interval = options.get('CHECK_INTERVAL', 0.5)
+        self._l1 = OrderedDict()
+        self._l1_bytes = 0
+        self._lock = threading.RLock()
+        self._sync_lock = threading.Lock()
+        self._node = f'{os.getpid()}-{uuid.uuid4().hex[:8]}'
+        self._seen = None
+        self._gap_since = None
+        self._checked_at = 0.0
+
+    @cached_property
+    def l2(self):
+        store = caches[self._l2_alias]
+        # Без атомарных add и incr два воркера получат один номер сообщения,
+        # и инвалидация потеряется
+        if not (is_atomic(store) or isinstance(store, LocMemCache)):
+            raise ImproperlyConfigured(
+                f"TwoTierCache: L2 '{self._l2_alias}' должен быть Redis или Memcached, "
+                f"а не {type(store).__name__}"
+            )
+        return store
+
+    # --- L1 ---
+
+    def _l1_get(self, key):
+        with self._lock:
+            entry = self._l1.get(key)
+            if entry is None:
+                return None
+            data, expires_at = entry
+            if expires_at <= time.monotonic():
+                self._l1_delete(key)
+                return None
+            self._l1.move_to_end(key)
+            return data
+
+    def _l1_set(self, key, value, timeout):
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        if len(data) > self.max_bytes // 4:
+            # Крупные значения держим только в L2, чтобы не вытеснять весь L1
+            self._l1_delete(key)
+            return
+        ttl = self.l1_timeout if timeout is None else min(max(timeout, 0), self.l1_timeout)
+        with self._lock:
+            self._l1_delete(key)
+            self._l1[key] = (data, time.monotonic() + ttl)
+            self._l1_bytes += len(data)
+            while self._l1_bytes > self.max_bytes:
+                _, (evicted, _) = self._l1.popitem(last=False)
+                self._l1_bytes -= len(evicted)
+
+    def _l1_delete(self, key):
+        with self._lock:
+            entry = self._l1.pop(key, None)
+            if entry is not None:
+                self._l1_bytes -= len(entry[0])
+
+    def _l1_clear(self):
+        with self._lock:
+            self._l1.clear()
+            self._l1_bytes = 0
+
+    # --- журнал инвалидаций ---
+
+    def _publish(self, keys):
+        """Сообщает остальным воркерам, что ключи изменились."""
+        l2 = self.l2
+        try:
+            seq = l2.incr(INVALIDATION_HEAD)
+        except ValueError:
+            # Счётчика ещё нет или общий кэш очищен
+            l2.add(INVALIDATION_HEAD, 0, None)
+            seq = l2.incr(INVALIDATION_HEAD)
+        l2.set(INVALIDATION_ENTRY.format(seq % RING_SIZE), (seq, self._node, keys), None)
+
+    def _sync(self):
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return
+        if not self._sync_lock.acquire(blocking=False):
+            # Журнал уже дочитывает другой поток
+            return
+        try:
+            self._checked_at = now
+            l2 = self.l2
+            head = l2.get(INVALIDATION_HEAD) or 0
+            if self._seen is None or head < self._seen or head - self._seen > RING_SIZE:
+                # Первый запуск, общий кэш очищен или кольцо обернулось: L1
+                # ничего не знает о пропущенных изменениях
+                self._l1_clear()
+                self._seen = head
+                self._gap_since = None
+                return
+            positions = range(self._seen + 1, head + 1)
+            entries = l2.get_many([INVALIDATION_ENTRY.format(seq % RING_SIZE) for seq in positions])
+            seq = self._seen
+            for expected in positions:
+                entry = entries.get(INVALIDATION_ENTRY.format(expected % RING_SIZE))
+                if entry is None or entry[0] < expected:
+                    # Номер выдан, но запись ещё не сделана: дочитаем в следующий
+                    # раз. Если она так и не появилась, сообщение потеряно
+                    if self._gap_since is None:
+                        self._gap_since = now
+                    elif now - self._gap_since > GAP_TIMEOUT:
+                        self._l1_clear()
+                        seq = head
+                        self._gap_since = None
+                    break
+                self._gap_since = None
+                if entry[0] > expected:
+                    # Ячейку уже перезаписало более новое сообщение
+                    self._l1_clear()
+                    seq = head
+                    break
+                seq = expected
+                _, node, keys = entry
+                if node == self._node:
+                    continue
+                if CLEAR_ALL in keys:
+                    self._l1_clear()
+                else:
+                    for key in keys:
+                        self._l1_delete(key)
+            self._seen = seq
+        finally:
+            self._sync_lock.release()
+
+    # --- API BaseCache ---
+
+    def _timeout(self, timeout):
+        return self.default_timeout if timeout is DEFAULT_TIMEOUT else timeout
+
+    def _store(self, method, key, value, timeout, version):
+        """Записывает значение в L2 (set или add) и в L1 своего процесса."""
+        timeout = self._timeout(timeout)
+        expires_at = None if timeout is None else time.time() + timeout
+        l1_key = self.make_and_validate_key(key, version=version)
+        if method == 'add':
+            # Удачный add значит, что живой записи не было ни в L2, ни в чужих
+            # L1 (они не переживают L2, удаления опубликованы) — сообщать незачем
+            if not self.l2.add(key, (expires_at, value), timeout, version=version):
+                return False
+        else:
+            self.l2.set(key, (expires_at, value), timeout, version=version)
+            self._publish([l1_key])
+        self._l1_set(l1_key, value, timeout)
+        return True
+
+    def _from_l2(self, l1_key, entry):
+        """Значение из записи L2; копия остаётся в L1 не дольше, чем в L2."""
+        expires_at, value = entry
+        timeout = None if expires_at is None else expires_at - time.time()
+        if timeout is None or timeout > 0:
+            self._l1_set(l1_key, value, timeout)
+        return value
+
+    def get(self, key, default=None, version=None):
+        self._sync()
+        l1_key = self.make_and_validate_key(key, version=version)
+        data = self._l1_get(l1_key)
+        if data is not None:
+            return pickle.loads(data)
+        entry = self.l2.get(key, version=version)
+        if entry is None:
+            return default
+        return self._from_l2(l1_key, entry)
+
+    def get_many(self, keys, version=None):
+        # Чего нет в L1, читается из L2 одним запросом
+        self._sync()
+        result, missing = {}, {}
+        for key in keys:
+            l1_key = self.make_and_validate_key(key, version=version)
+            data = self._l1_get(l1_key)
+            if data is not None:
+                result[key] = pickle.loads(data)
+            else:
+                missing[key] = l1_key
+        if missing:
+            for key, entry in self.l2.get_many(list(missing), version=version).items():
+                result[key] = self._from_l2(missing[key], entry)
+        return result
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self._store('set', key, value, timeout, version)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        return self._store('add', key, value, timeout, version)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        # Одна запись в журнал инвалидаций на весь пакет
+        timeout = self._timeout(timeout)
+        expires_at = None if timeout is None else time.time() + timeout
+        self.l2.set_many(
+            {key: (expires_at, value) for key, value in data.items()}, timeout, version=version
+        )
+        l1_keys = {self.make_and_validate_key(key, version=version): value for key, value in data.items()}
+        if l1_keys:
+            self._publish(list(l1_keys))
+        for l1_key, value in l1_keys.items():
+            self._l1_set(l1_key, value, timeout)
+        return []
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        entry = self.l2.get(key, version=version)
+        if entry is None:
+            return False
+        self.set(key, entry[1], timeout, version=version)
+        return True
+
+    def delete(self, key, version=None):
+        l1_key = self.make_and_validate_key(key, version=version)
+        self._l1_delete(l1_key)
+        deleted = self.l2.delete(key, version=version)
+        self._publish([l1_key])
+        return deleted
+
+    def delete_many(self, keys, version=None):
+        l1_keys = [self.make_and_validate_key(key, version=version) for key in keys]
+        for l1_key in l1_keys:
+            self._l1_delete(l1_key)
+        self.l2.delete_many(keys, version=version)
+        if l1_keys:
+            self._publish(l1_keys)
+
+    def has_key(self, key, version=None):
+        self._sync()
+        if self._l1_get(self.make_and_validate_key(key, version=version)) is not None:
+            return True
+        return self.l2.has_key(key, version=version)
+
+    def clear(self):
+        self._l1_clear()
+        self.l2.clear()
+        self._seen = None
+        self._publish([CLEAR_ALL])
+
+    def close(self, **kwargs):
+        self.l2.close(**kwargs)
+
+    def l1_stats(self):
+        with self._lock:
+            return {'entries': len(self._l1), 'bytes': self._l1_bytes, 'max_bytes': self.max_bytes}
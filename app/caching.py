@@ -0,0 +1,240 @@
+import logging
+import math
+import random
+import threading
+import time
+from collections import Counter
+from functools import wraps
+
+from django.core.cache import cache, caches
+from django.core.cache.backends.memcached import BaseMemcachedCache
+from django.core.cache.backends.redis import RedisCache
+from django.db import connection
+from django.views.decorators.cache import cache_page
+
+logger = logging.getLogger(__name__)
+
+
+# Helper to cache reference lists
+CACHE_TTL = 60 * 60  # 1 hour
+
+# TTL списков объявлений: актуальность обеспечивают версии каталога, а не время жизни
+LISTING_CACHE_TTL = 60 * 60 * 6
+
+# Отдельный кэш для версий, общий для всех воркеров (см. CACHES['versions'])
+VERSION_CACHE = 'versions'
+GLOBAL_VERSION_KEY = 'catalog_version'
+
+# Параметр XFetch: чем больше, тем раньше начинается досрочное обновление
+XFETCH_BETA = 1.0
+# Сколько держится блокировка пересчёта и сколько ждут значение без неё
+LOCK_TIMEOUT = 30
+LOCK_WAIT = 5
+LOCK_POLL = 0.05
+
+# Счётчики кэша текущего процесса (см. cache_stats)
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def _count(event):
+    with _stats_lock:
+        _stats[event] += 1
+
+
+def cache_stats():
+    """Счётчики попаданий, промахов и обновлений кэша в текущем процессе."""
+    with _stats_lock:
+        return dict(_stats)
+
+
+def is_atomic(store):
+    """add и incr атомарны для всех процессов: Redis или Memcached (в том числе как L2)."""
+    store = getattr(store, 'l2', store)
+    return isinstance(store, (RedisCache, BaseMemcachedCache))
+
+
+class LocalLocks:
+    """
+    Блокировки с интерфейсом cache.add/delete в памяти процесса. Защищают
+    только от потоков своего процесса — замена для кэша без атомарного add.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._held = {}
+
+    def add(self, key, value, timeout):
+        now = time.monotonic()
+        with self._lock:
+            if self._held.get(key, 0) > now:
+                return False
+            self._held[key] = now + timeout
+            return True
+
+    def delete(self, key):
+        with self._lock:
+            self._held.pop(key, None)
+
+
+_local_locks = LocalLocks()
+
+
+def lock_store():
+    """
+    Где брать блокировки пересчёта. Блокировка через add работает между
+    процессами только в кэше с атомарным add (Redis). В файловом кэше add —
+    это проверка и запись без блокировки, и её могут взять несколько воркеров
+    сразу, поэтому без Redis блокировка держится в памяти процесса.
+    У двухуровневого кэша блокировки берутся прямо в L2: им не нужны ни L1,
+    ни журнал инвалидаций.
+    """
+    return getattr(cache, 'l2', cache) if is_atomic(cache) else _local_locks
+
+
+def _compute_and_store(key, compute, ttl, stale_ttl):
+    started = time.monotonic()
+    value = compute()
+    delta = time.monotonic() - started
+    # Вместе со значением хранятся срок актуальности и время пересчёта для XFetch
+    cache.set(key, (value, time.time() + ttl, delta), ttl + stale_ttl)
+    return value
+
+
+def _refresh_in_background(key, compute, ttl, stale_ttl):
+    try:
+        _compute_and_store(key, compute, ttl, stale_ttl)
+    except Exception as e:
+        logger.error(f"Ошибка обновления кэша {key}: {e}")
+    finally:
+        lock_store().delete(f'{key}:lock')
+        connection.close()
+
+
+def cache_fetch(key, compute, ttl, stale_ttl=None, beta=XFETCH_BETA):
+    """
+    Возвращает значение из кэша, пересчитывая его не более чем в одном потоке.
+
+    Незадолго до истечения значение с вероятностью, растущей по мере
+    приближения срока (XFetch), обновляется в фоне. После истечения ещё
+    stale_ttl секунд отдаётся устаревшее значение, пока его обновляет фоновый
+    поток. При полном промахе считает тот, кто взял блокировку, остальные
+    ждут результат до LOCK_WAIT секунд. Блокировка общая для всех воркеров
+    только с Redis, иначе — на процесс (см. lock_store).
+    """
+    if stale_ttl is None:
+        stale_ttl = ttl
+    lock_key = f'{key}:lock'
+    locks = lock_store()
+    entry = cache.get(key)
+
+    if entry is not None:
+        value, expires_at, delta = entry
+        now = time.time()
+        if now - delta * beta * math.log(1.0 - random.random()) < expires_at:
+            _count('hit')
+            return value
+        _count('stale' if now >= expires_at else 'early')
+        if locks.add(lock_key, 1, LOCK_TIMEOUT):
+            _count('refresh')
+            threading.Thread(
+                target=_refresh_in_background, args=(key, compute, ttl, stale_ttl), daemon=True
+            ).start()
+        return value
+
+    _count('miss')
+    deadline = time.monotonic() + LOCK_WAIT
+    while not locks.add(lock_key, 1, LOCK_TIMEOUT):
+        if time.monotonic() >= deadline:
+            _count('lock_timeout')
+            return compute()
+        time.sleep(LOCK_POLL)
+        entry = cache.get(key)
+        if entry is not None:
+            _count('wait')
+            return entry[0]
+    try:
+        _count('refresh')
+        return _compute_and_store(key, compute, ttl, stale_ttl)
+    finally:
+        locks.delete(lock_key)
+
+
+def get_cached(key, queryset, ttl=CACHE_TTL):
+    return cache_fetch(key, lambda: list(queryset), ttl)
+
+
+def _version_key(category_id=None):
+    if category_id is None:
+        return GLOBAL_VERSION_KEY
+    return f'{GLOBAL_VERSION_KEY}_{category_id}'
+
+
+def _fresh_version():
+    # Новая версия после потери ключа не должна совпасть ни с одной из прежних
+    return int(time.time() * 1000)
+
+
+def get_version(key):
+    """Текущее значение счётчика версий key в общем кэше версий."""
+    store = caches[VERSION_CACHE]
+    version = store.get(key)
+    if version is None:
+        store.add(key, _fresh_version(), None)
+        version = store.get(key)
+    return version
+
+
+def bump_version(key):
+    store = caches[VERSION_CACHE]
+    try:
+        store.incr(key)
+    except ValueError:
+        store.set(key, _fresh_version(), None)
+
+
+def catalog_version(category_id=None):
+    """Текущая версия каталога: глобальная или отдельной категории."""
+    return get_version(_version_key(category_id))
+
+
+def bump_catalog_version(category_ids=()):
+    """
+    Сдвигает глобальную версию каталога и версии указанных категорий.
+    Все ключи кэша, в которые входит версия, сразу становятся неактуальными.
+    """
+    for key in [_version_key()] + [_version_key(category_id) for category_id in set(category_ids)]:
+        bump_version(key)
+
+
+def versioned_key(name, category_id=None):
+    """Ключ кэша списка объявлений с версией каталога (или категории)."""
+    return f'{name}:v{catalog_version(category_id)}'
+
+
+def category_id_for_slug(slug):
+    from .models import Category
+
+    for category in get_cached('all_categories', Category.objects.all()):
+        if category.slug == slug:
+            return category.pk
+    return None
+
+
+def versioned_cache_page(timeout, category_kwarg=None):
+    """
+    Аналог cache_page, у которого в префикс ключа входит версия каталога
+    (или категории из именованного аргумента category_kwarg URL).
+    """
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            category_id = None
+            if category_kwarg is not None:
+                category_id = category_id_for_slug(kwargs.get(category_kwarg))
+            prefix = f'page_v{catalog_version(category_id)}'
+            if category_id is not None:
+                prefix = f'category_{category_id}_{prefix}'
+            return cache_page(timeout, key_prefix=prefix)(view_func)(request, *args, **kwargs)
+        return wrapper
+    return decorator
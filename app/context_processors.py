@@ -1,38 +1,22 @@
 
-from django.core.cache import cache
-from .models import Category, City, Currency, Favorite
+from .models import Category, City, Currency
+from .caching import get_cached
 
 def favorites_processor(request):
     """
     Добавляет список избранных объявлений в контекст всех шаблонов
     """
-    if request.user.is_authenticated:
-        favorite_ids = Favorite.objects.filter(user=request.user).values_list('product_id', flat=True)
-        return {'favorite_products': favorite_ids}
-    return {'favorite_products': []}
+    return {'favorite_products': request.favorite_ids}
 
 
 def common_data(request):
     """
     Контекстный процессор для добавления общих данных в шаблоны.
     """
-    # Кэшируем категории на 1 час
-    categories = cache.get('all_categories')
-    if categories is None:
-        categories = Category.objects.all()
-        cache.set('all_categories', categories, 60 * 60)
-    
-    # Кэшируем города на 1 час
-    cities = cache.get('all_cities')
-    if cities is None:
-        cities = City.objects.all()
-        cache.set('all_cities', cities, 60 * 60)
-    
-    # Кэшируем валюты на 1 час
-    currencies = cache.get('all_currencies')
-    if currencies is None:
-        currencies = Currency.objects.all()
-        cache.set('all_currencies', currencies, 60 * 60)
+    # Справочники кэшируются на 1 час, ключи общие с представлениями
+    categories = get_cached('all_categories', Category.objects.all())
+    cities = get_cached('all_cities', City.objects.all())
+    currencies = get_cached('all_currencies', Currency.objects.all())
     
     return {
         'categories': categories,
@@ -0,0 +1,75 @@
+from django.db.models import Count, F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce, Greatest
+
+from . import sketches
+
+
+def _count_subquery(model):
+    return Coalesce(
+        Subquery(
+            model.objects.filter(product=OuterRef('pk')).order_by()
+            .values('product').annotate(total=Count('pk')).values('total')
+        ),
+        0,
+    )
+
+
+def recount_views(product_ids):
+    """
+    Обновляет счётчик просмотров после записи пачки. bulk_create с
+    ignore_conflicts не сообщает, какие строки вставлены, поэтому счётчик
+    затронутых объявлений пересчитывается атомарно, а не увеличивается.
+    """
+    from .models import Product, ProductView
+
+    Product.objects.filter(pk__in=list(product_ids)).update(view_count=_count_subquery(ProductView))
+
+
+def change_favorite_count(product_id, delta):
+    from .models import Product
+
+    Product.objects.filter(pk=product_id).update(
+        favorite_count=Greatest(F('favorite_count') + delta, 0)
+    )
+
+
+def _actual_views():
+    """Фактические просмотры: строки ProductView или скетч за всё время."""
+    from .models import ProductView, ProductViewSketch
+
+    if sketches.enabled():
+        # Объявления без скетча за всё время пока учитываются по строкам
+        return Coalesce(
+            Subquery(
+                ProductViewSketch.objects.filter(product=OuterRef('pk'), day__isnull=True).values('estimate')[:1]
+            ),
+            _count_subquery(ProductView),
+        )
+    return _count_subquery(ProductView)
+
+
+def drifted_ids():
+    """id объявлений, у которых счётчики разошлись с фактическими данными."""
+    from .models import Product, Favorite
+
+    return list(
+        Product.objects.annotate(
+            actual_views=_actual_views(),
+            actual_favorites=_count_subquery(Favorite),
+        ).filter(
+            ~Q(view_count=F('actual_views')) | ~Q(favorite_count=F('actual_favorites'))
+        ).values_list('pk', flat=True)
+    )
+
+
+def reconcile():
+    """Исправляет разошедшиеся счётчики, возвращает число исправленных объявлений."""
+    from .models import Product, Favorite
+
+    ids = drifted_ids()
+    if ids:
+        Product.objects.filter(pk__in=ids).update(
+            view_count=_actual_views(),
+            favorite_count=_count_subquery(Favorite),
+        )
+    return len(ids)
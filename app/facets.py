@@ -0,0 +1,171 @@
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import F
+
+from .caching import cache_fetch, versioned_key
+
+
+# Ценовые диапазоны фильтра: (нижняя граница включительно, верхняя граница не включительно)
+PRICE_BUCKETS = (
+    (0, 1000),
+    (1000, 10000),
+    (10000, 50000),
+    (50000, 100000),
+    (100000, 500000),
+    (500000, None),
+)
+
+FACETS_CACHE_TTL = 60 * 60 * 24
+
+
+def price_bucket(price):
+    for index, (low, high) in enumerate(PRICE_BUCKETS):
+        if price >= low and (high is None or price < high):
+            return index
+    return 0
+
+
+def price_bucket_label(index):
+    low, high = PRICE_BUCKETS[index]
+    if high is None:
+        return f"от {low:,}".replace(',', ' ')
+    if low == 0:
+        return f"до {high:,}".replace(',', ' ')
+    return f"{low:,} – {high:,}".replace(',', ' ')
+
+
+def price_bucket_filter(index):
+    """Условия фильтра queryset для ценового диапазона."""
+    low, high = PRICE_BUCKETS[index]
+    conditions = {'price__gte': low}
+    if high is not None:
+        conditions['price__lt'] = high
+    return conditions
+
+
+def facet_values(product):
+    """
+    Набор (категория, фильтр, значение), в которые объявление вносит вклад.
+    Учитываются только опубликованные объявления.
+    """
+    if product is None or product.status != 3:
+        return set()
+    values = {(product.category_id, 'price', price_bucket(product.price))}
+    if product.city_id is not None:
+        values.add((product.category_id, 'city', product.city_id))
+    if product.currency_id is not None:
+        values.add((product.category_id, 'currency', product.currency_id))
+    return values
+
+
+def apply_change(before, after):
+    """
+    Применяет к счётчикам разницу между состоянием объявления до и после
+    изменения. before/after — результаты facet_values.
+    """
+    deltas = Counter()
+    for key in before - after:
+        deltas[key] -= 1
+    for key in after - before:
+        deltas[key] += 1
+    apply_deltas(deltas)
+
+
+def add_published(products):
+    """
+    Учитывает объявления, опубликованные массовым .update() (он обходит
+    сигналы), — без пересчёта категорий целиком. products — уже
+    опубликованные объявления.
+    """
+    deltas = Counter()
+    for product in products:
+        deltas.update(facet_values(product))
+    apply_deltas(deltas)
+
+
+def apply_deltas(deltas):
+    """Прибавляет приращения {(категория, фильтр, значение): n} к счётчикам."""
+    from .models import FacetCount
+
+    deltas = {key: delta for key, delta in deltas.items() if delta}
+    if not deltas:
+        return
+
+    with transaction.atomic():
+        for (category_id, facet, value), delta in deltas.items():
+            counter, _ = FacetCount.objects.get_or_create(category_id=category_id, facet=facet, value=value)
+            FacetCount.objects.filter(pk=counter.pk).update(count=F('count') + delta)
+
+
+def compute_counts(product_model, category_ids=None):
+    """Считает счётчики по опубликованным объявлениям заново."""
+    qs = product_model.objects.filter(status=3).order_by()
+    if category_ids is not None:
+        qs = qs.filter(category_id__in=category_ids)
+    counts = Counter()
+    for category_id, city_id, currency_id, price in qs.values_list(
+        'category_id', 'city_id', 'currency_id', 'price'
+    ).iterator(chunk_size=2000):
+        counts[(category_id, 'price', price_bucket(price))] += 1
+        if city_id is not None:
+            counts[(category_id, 'city', city_id)] += 1
+        if currency_id is not None:
+            counts[(category_id, 'currency', currency_id)] += 1
+    return counts
+
+
+def store_counts(facet_model, counts, category_ids=None):
+    qs = facet_model.objects.all()
+    if category_ids is not None:
+        qs = qs.filter(category_id__in=category_ids)
+    qs.delete()
+    facet_model.objects.bulk_create([
+        facet_model(category_id=category_id, facet=facet, value=value, count=count)
+        for (category_id, facet, value), count in counts.items()
+    ])
+
+
+def rebuild(category_ids=None):
+    """
+    Пересчитывает счётчики для указанных категорий (или всех).
+    Используется после массовых .update(), которые обходят сигналы.
+    Кэш счётчиков сбрасывается сменой версии каталога на стороне вызывающего кода.
+    """
+    from .models import Product, FacetCount
+
+    if category_ids is not None:
+        category_ids = list(category_ids)
+    with transaction.atomic():
+        store_counts(FacetCount, compute_counts(Product, category_ids), category_ids)
+
+
+def get_category_facets(category_id):
+    """
+    Возвращает счётчики категории {'city': {id: n}, 'currency': {id: n}, 'price': {index: n}}.
+    В установившемся режиме берутся из кэша без запросов к БД.
+    """
+    from .models import FacetCount
+
+    def load():
+        facets = {'city': {}, 'currency': {}, 'price': {}}
+        for facet, value, count in FacetCount.objects.filter(
+            category_id=category_id, count__gt=0
+        ).values_list('facet', 'value', 'count'):
+            facets[facet][value] = count
+        return facets
+
+    return cache_fetch(versioned_key(f'category_facets_{category_id}', category_id), load, FACETS_CACHE_TTL)
+
+
+def filter_options(category_id, cities, currencies):
+    """Опции выпадающих списков фильтров со счётчиками."""
+    facets = get_category_facets(category_id)
+    return {
+        'city_options': [(city, facets['city'].get(city.pk, 0)) for city in cities],
+        'currency_options': [(currency, facets['currency'].get(currency.pk, 0)) for currency in currencies],
+        'price_options': [
+            (index, price_bucket_label(index), facets['price'].get(index, 0))
+            for index in range(len(PRICE_BUCKETS))
+        ],
+    }
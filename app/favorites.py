@@ -0,0 +1,47 @@
+from array import array
+
+from django.core.cache import cache
+from django.db import transaction
+
+
+FAVORITES_CACHE_TTL = 60 * 60 * 24
+
+
+def _cache_key(user_id):
+    return f'favorites_{user_id}'
+
+
+def _pack(ids):
+    # Компактное хранение: массив 64-битных чисел вместо pickle множества
+    return array('q', sorted(ids)).tobytes()
+
+
+def _unpack(data):
+    ids = array('q')
+    ids.frombytes(data)
+    return frozenset(ids)
+
+
+def get_favorite_ids(user):
+    """Множество id избранных объявлений пользователя."""
+    if not user.is_authenticated:
+        return frozenset()
+    from .models import Favorite
+
+    data = cache.get(_cache_key(user.pk))
+    if data is not None:
+        return _unpack(data)
+    ids = frozenset(Favorite.objects.filter(user_id=user.pk).values_list('product_id', flat=True))
+    cache.set(_cache_key(user.pk), _pack(ids), FAVORITES_CACHE_TTL)
+    return ids
+
+
+def favorites_changed(user_id):
+    """
+    Сбрасывает закэшированное множество после добавления или удаления
+    избранного, его загрузит следующее чтение. Сброс, а не правка на месте:
+    два одновременных чтения-изменения-записи теряли бы одно из изменений.
+    Сбрасывается после фиксации транзакции, чтобы чтение не успело
+    закэшировать состояние до неё.
+    """
+    transaction.on_commit(lambda: cache.delete(_cache_key(user_id)))
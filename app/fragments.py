@@ -0,0 +1,79 @@
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from .caching import bump_version, get_version
+
+
+CARD_TEMPLATE = 'app/includes/product_card.html'
+CARD_CACHE_TTL = 60 * 60 * 24
+
+# Версия справочников, которые выводятся в карточке (города, валюты):
+# сдвигается при их правке, и все карточки перерисовываются
+CARDS_VERSION_KEY = 'product_cards_version'
+
+# Метки в закэшированной карточке, вместо которых подставляется состояние избранного
+FAVORITE_MARKER = '__card_favorite__'
+HEART_MARKER = '__card_heart__'
+
+
+def cards_version():
+    return get_version(CARDS_VERSION_KEY)
+
+
+def references_changed():
+    bump_version(CARDS_VERSION_KEY)
+
+
+def card_key(product, variant, version):
+    """
+    Ключ карточки. updated_at меняется при каждом save(), статус входит в ключ
+    отдельно, потому что массовые .update() статуса не трогают updated_at.
+    version — cards_version(): названия городов и валют меняются без
+    изменения объявления.
+    """
+    updated = int(product.updated_at.timestamp() * 1000000)
+    return f'product_card:v{version}:{product.pk}:{updated}:{product.status}:{variant}'
+
+
+def render_card(product, variant):
+    """HTML карточки без учёта пользователя."""
+    return render_to_string(CARD_TEMPLATE, {
+        'product': product,
+        'lazy': variant == 'lazy',
+        'favorite': FAVORITE_MARKER,
+        'heart_icon': HEART_MARKER,
+    })
+
+
+def apply_favorite(html, is_favorite):
+    return html.replace(
+        FAVORITE_MARKER, 'true' if is_favorite else 'false'
+    ).replace(
+        HEART_MARKER, 'bi-heart-fill' if is_favorite else 'bi-heart'
+    )
+
+
+def render_cards(products, favorite_ids, eager_first=True):
+    """
+    Карточки объявлений одним get_many к кэшу. Отсутствующие в кэше
+    рендерятся и сохраняются одним set_many. Первая карточка страницы
+    загружает изображение сразу, остальные — лениво.
+    """
+    products = list(products)
+    version = cards_version()
+    keys = [
+        card_key(product, 'eager' if index == 0 and eager_first else 'lazy', version)
+        for index, product in enumerate(products)
+    ]
+    fragments = cache.get_many(keys)
+    missing = {}
+    for product, key in zip(products, keys):
+        if key not in fragments:
+            missing[key] = fragments[key] = render_card(product, key.rsplit(':', 1)[1])
+    if missing:
+        cache.set_many(missing, CARD_CACHE_TTL)
+    return [
+        mark_safe(apply_favorite(fragments[key], product.pk in favorite_ids))
+        for product, key in zip(products, keys)
+    ]
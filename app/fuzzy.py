@@ -0,0 +1,175 @@
+import heapq
+import itertools
+import re
+from collections import Counter, defaultdict
+
+from slugify import slugify
+
+from .indexes import ProductMemoryIndex
+
+
+# Минимальная доля совпавших триграмм запроса, при которой объявление считается кандидатом
+MIN_SIMILARITY = 0.4
+
+# Слова запроса сверх этого числа не учитываются в нечётком поиске
+MAX_QUERY_WORDS = 4
+
+# Правила сведения похожих по звучанию буквосочетаний после транслитерации,
+# чтобы «айфон» и «iphone» давали близкие триграммы
+PHONETIC_RULES = (
+    ('ph', 'f'), ('kh', 'h'), ('ck', 'k'), ('qu', 'k'), ('w', 'v'), ('x', 'ks'),
+    ('y', 'i'), ('ai', 'i'), ('ei', 'i'), ('ou', 'u'), ('c', 'k'), ('z', 's'), ('h', ''),
+)
+
+REPEATED_RE = re.compile(r'(.)\1+')
+
+
+def fold(text):
+    """Транслитерирует текст в латиницу и нормализует написание."""
+    text = slugify(text or '', separator=' ')
+    for src, dst in PHONETIC_RULES:
+        text = text.replace(src, dst)
+    return REPEATED_RE.sub(r'\1', text)
+
+
+def word_trigrams(word):
+    padded = f'  {word} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def text_trigrams(text):
+    result = set()
+    for word in fold(text).split():
+        result |= word_trigrams(word)
+    return result
+
+
+class TrigramIndex(ProductMemoryIndex):
+    """
+    Триграммный индекс заголовков опубликованных объявлений в памяти процесса.
+
+    Индекс двухуровневый: триграммы указывают на слова словаря, слова — на
+    объявления. Нечёткое сравнение идёт только по словарю, который намного
+    меньше каталога, поэтому поиск занимает единицы миллисекунд.
+    Кандидаты всегда дополнительно фильтруются запросом к БД, поэтому устаревшая
+    запись индекса может лишь ненадолго снизить полноту, но не показать лишнее.
+    """
+
+    state_attrs = ('_gram_words', '_word_docs', '_word_sizes', '_doc_words')
+
+    def _reset(self):
+        self._gram_words = defaultdict(set)
+        self._word_docs = defaultdict(set)
+        self._word_sizes = {}
+        self._doc_words = {}
+
+    def size(self):
+        return len(self._doc_words)
+
+    def _insert(self, pk, title):
+        words = set(fold(title).split())
+        self._doc_words[pk] = words
+        for word in words:
+            if word not in self._word_sizes:
+                grams = word_trigrams(word)
+                self._word_sizes[word] = len(grams)
+                for gram in grams:
+                    self._gram_words[gram].add(word)
+            self._word_docs[word].add(pk)
+
+    def _discard(self, pk):
+        for word in self._doc_words.pop(pk, ()):
+            docs = self._word_docs.get(word)
+            if docs is None:
+                continue
+            docs.discard(pk)
+            if not docs:
+                del self._word_docs[word]
+                del self._word_sizes[word]
+                for gram in word_trigrams(word):
+                    words = self._gram_words.get(gram)
+                    if words is not None:
+                        words.discard(word)
+                        if not words:
+                            del self._gram_words[gram]
+
+    def stats(self):
+        data = super().stats()
+        data.update({'words': len(self._word_sizes), 'trigrams': len(self._gram_words)})
+        return data
+
+    def _similar_words(self, query_word):
+        """Слова словаря, похожие на слово запроса, со значением сходства."""
+        query_grams = word_trigrams(query_word)
+        hits = Counter()
+        for gram in query_grams:
+            hits.update(self._gram_words.get(gram, ()))
+        matches = {}
+        for word, hit in hits.items():
+            similarity = hit / max(len(query_grams), self._word_sizes[word])
+            if similarity >= MIN_SIMILARITY:
+                matches[word] = round(similarity, 1)
+        return matches
+
+    def _buckets(self, query_word):
+        """
+        Разбивает объявления, подходящие под слово запроса, на непересекающиеся
+        группы по лучшему сходству: [(сходство, множество id)] по убыванию.
+        """
+        by_similarity = defaultdict(list)
+        for word, similarity in self._similar_words(query_word).items():
+            by_similarity[similarity].append(self._word_docs[word])
+        buckets = []
+        covered = set()
+        for similarity in sorted(by_similarity, reverse=True):
+            # Всегда новое множество: после снятия блокировки индекс могут
+            # менять другие потоки, а поиск продолжает работать с группами
+            docs = set().union(*by_similarity[similarity])
+            if covered:
+                docs -= covered
+            covered = covered | docs
+            buckets.append((similarity, docs))
+        return buckets
+
+    def search(self, query, limit=100):
+        """
+        Возвращает список (id, сходство) кандидатов, отсортированный по убыванию
+        сходства. Сходство — среднее по словам запроса лучшее сходство слова
+        запроса со словами заголовка.
+
+        Сочетания групп перебираются по убыванию итоговой оценки, а объявления
+        внутри сочетания находятся пересечением множеств, поэтому перебор
+        останавливается, как только набрано limit кандидатов.
+        """
+        self.ensure_fresh()
+        query_words = fold(query).split()[:MAX_QUERY_WORDS]
+        if not query_words:
+            return []
+        # Группы копируются под блокировкой, дальше индекс не читается
+        with self._lock:
+            per_word = [self._buckets(word) + [(0.0, None)] for word in query_words]
+        total = len(query_words)
+
+        combinations = []
+        for combination in itertools.product(*per_word):
+            score = sum(similarity for similarity, _ in combination) / total
+            if score >= MIN_SIMILARITY:
+                combinations.append((score, [docs for _, docs in combination if docs is not None]))
+        combinations.sort(key=lambda item: item[0], reverse=True)
+
+        result = []
+        taken = set()
+        for score, sets in combinations:
+            docs = sets[0] if len(sets) == 1 else set.intersection(*sets)
+            if taken:
+                docs = docs - taken
+            taken |= docs
+            # При равной оценке выше новые объявления (больший id)
+            score = round(score, 4)
+            result.extend((pk, score) for pk in heapq.nlargest(limit - len(result), docs))
+            if len(result) >= limit:
+                break
+        return result
+
+
+product_index = TrigramIndex()
@@ -0,0 +1,47 @@
+import hashlib
+import math
+
+
+# 2^9 = 512 регистров по байту: стандартная ошибка оценки около 4.6%
+PRECISION = 9
+REGISTERS = 1 << PRECISION
+_ALPHA = 0.7213 / (1 + 1.079 / REGISTERS)
+
+
+def hash64(value):
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), 'big')
+
+
+class HyperLogLog:
+    """
+    Скетч HyperLogLog для оценки числа уникальных элементов.
+    Хранится как 512 байт, скетчи объединяются поэлементным максимумом.
+    """
+
+    __slots__ = ('registers',)
+
+    def __init__(self, data=None):
+        self.registers = bytearray(data) if data else bytearray(REGISTERS)
+
+    def add(self, value):
+        h = hash64(value)
+        index = h >> (64 - PRECISION)
+        rest = h & ((1 << (64 - PRECISION)) - 1)
+        rank = (64 - PRECISION) - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+
+    def count(self):
+        estimate = _ALPHA * REGISTERS * REGISTERS / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * REGISTERS and zeros:
+            # Малые мощности: линейный подсчёт точнее
+            estimate = REGISTERS * math.log(REGISTERS / zeros)
+        return int(round(estimate))
+
+    def to_bytes(self):
+        return bytes(self.registers)
@@ -0,0 +1,154 @@
+import datetime
+import logging
+import threading
+import time
+
+from django.db import connection
+from django.utils import timezone
+
+from .caching import bump_version, get_version
+
+logger = logging.getLogger(__name__)
+
+# Версия в общем кэше версий, которая сдвигается после массовой публикации
+# (.update() обходит сигналы, модерация идёт в другом процессе). По её смене
+# индексы догружают объявления, опубликованные с прошлой синхронизации.
+PUBLISHED_VERSION_KEY = 'published_products_version'
+# Запас на задержку фиксации транзакции: повторное добавление безвредно
+CATCH_UP_SLACK = datetime.timedelta(seconds=30)
+
+
+def products_published():
+    """Сообщает индексам всех воркеров о массовой публикации объявлений."""
+    bump_version(PUBLISHED_VERSION_KEY)
+
+
+class ProductMemoryIndex:
+    """
+    Базовый класс индексов опубликованных объявлений в памяти процесса.
+
+    Первый запрос строит индекс синхронно, дальше изменения в текущем процессе
+    применяются сразу через сигналы, объявления, опубликованные модерацией,
+    догружаются по products_published не реже раза в check_interval секунд,
+    а остальные изменения из других воркеров подхватываются фоновой
+    перестройкой раз в rebuild_interval секунд. Подклассы хранят состояние
+    в атрибутах из state_attrs и реализуют _reset, _insert и _discard.
+    """
+
+    rebuild_interval = 60 * 5
+    check_interval = 5
+    state_attrs = ()
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset()
+        self._built_at = None
+        self._rebuilding = False
+        self._published_version = None
+        self._synced_at = None
+        self._checked_at = 0.0
+        self.build_seconds = None
+
+    def _reset(self):
+        raise NotImplementedError
+
+    def _insert(self, pk, title):
+        raise NotImplementedError
+
+    def _discard(self, pk):
+        raise NotImplementedError
+
+    def _populate(self):
+        from .models import Product
+
+        rows = Product.objects.filter(status=3).order_by().values_list('pk', 'title')
+        for pk, title in rows.iterator(chunk_size=2000):
+            self._insert(pk, title)
+
+    def size(self):
+        raise NotImplementedError
+
+    def build(self):
+        """Полностью перестраивает индекс из БД и атомарно подменяет текущий."""
+        started = time.monotonic()
+        version = get_version(PUBLISHED_VERSION_KEY)
+        synced_at = timezone.now()
+        fresh = type(self).__new__(type(self))
+        fresh._reset()
+        fresh._populate()
+        with self._lock:
+            for name in self.state_attrs:
+                setattr(self, name, getattr(fresh, name))
+            self._published_version = version
+            self._synced_at = synced_at
+            self._built_at = time.monotonic()
+            self.build_seconds = self._built_at - started
+        logger.info(f"{type(self).__name__}: {self.size()} записей за {self.build_seconds:.3f} с")
+        return self.size()
+
+    def _rebuild_in_background(self):
+        try:
+            self.build()
+        except Exception as e:
+            logger.error(f"Ошибка перестройки индекса {type(self).__name__}: {e}")
+        finally:
+            self._rebuilding = False
+            connection.close()
+
+    def _catch_up(self):
+        """Добавляет объявления, опубликованные модерацией после прошлой синхронизации."""
+        from .models import Product
+
+        version = get_version(PUBLISHED_VERSION_KEY)
+        if version == self._published_version:
+            return
+        synced_at = timezone.now()
+        rows = list(Product.objects.filter(
+            status=3, moderated_at__gte=self._synced_at - CATCH_UP_SLACK
+        ).values_list('pk', 'title'))
+        with self._lock:
+            for pk, title in rows:
+                self._discard(pk)
+                self._insert(pk, title)
+            self._published_version = version
+            self._synced_at = synced_at
+
+    def ensure_fresh(self):
+        if self._built_at is None:
+            self.build()
+            return
+        now = time.monotonic()
+        if now - self._built_at > self.rebuild_interval and not self._rebuilding:
+            self._rebuilding = True
+            threading.Thread(target=self._rebuild_in_background, daemon=True).start()
+        elif now - self._checked_at >= self.check_interval:
+            self._checked_at = now
+            try:
+                self._catch_up()
+            except Exception as e:
+                logger.error(f"Ошибка обновления индекса {type(self).__name__}: {e}")
+
+    def add(self, pk, title):
+        with self._lock:
+            self._discard(pk)
+            self._insert(pk, title)
+
+    def remove(self, pk):
+        with self._lock:
+            self._discard(pk)
+
+    def update_product(self, product):
+        """Синхронизирует объявление с индексом в зависимости от его статуса."""
+        if self._built_at is None:
+            return
+        if product.status == 3:
+            self.add(product.pk, product.title)
+        else:
+            self.remove(product.pk)
+
+    def stats(self):
+        return {
+            'size': self.size(),
+            'build_seconds': round(self.build_seconds, 4) if self.build_seconds is not None else None,
+            'age_seconds': round(time.monotonic() - self._built_at) if self._built_at is not None else None,
+        }
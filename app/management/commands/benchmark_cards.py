@@ -0,0 +1,64 @@
+import time
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.template import Context, Template
+
+from app.fragments import card_key, cards_version, render_cards
+from app.models import Product
+
+
+# Прежний способ: include шаблона карточки на каждое объявление. Как и в
+# шаблонах страниц, первая карточка грузит изображение сразу, остальные
+# лениво: counter0 ложен только у первой (not в with не поддерживается)
+INCLUDE_LOOP = Template(
+    "{% for product in products %}"
+    "{% include 'app/includes/product_card.html' with product=product lazy=forloop.counter0"
+    " favorite='false' heart_icon='bi-heart' %}"
+    "{% endfor %}"
+)
+
+
+class Command(BaseCommand):
+    help = 'Compares product card rendering per page: template includes vs fragment cache'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pages', type=int, default=50, help='Number of pages to render')
+        parser.add_argument('--size', type=int, default=16, help='Cards per page')
+
+    def handle(self, *args, **options):
+        pages, size = options['pages'], options['size']
+        products = list(
+            Product.objects.filter(status=3)
+            .select_related('currency', 'city')
+            .order_by('-created_at', '-pk')[:size]
+        )
+        if not products:
+            self.stdout.write(self.style.WARNING('No published products to render'))
+            return
+
+        def per_page(render, before=None):
+            elapsed = 0.0
+            for _ in range(pages):
+                if before:
+                    before()
+                started = time.perf_counter()
+                render()
+                elapsed += time.perf_counter() - started
+            return elapsed / pages * 1000
+
+        def drop_cached():
+            version = cards_version()
+            cache.delete_many([
+                card_key(product, variant, version) for product in products for variant in ('eager', 'lazy')
+            ])
+
+        includes = per_page(lambda: INCLUDE_LOOP.render(Context({'products': products})))
+        cold = per_page(lambda: ''.join(render_cards(products, set())), before=drop_cached)
+        warm = per_page(lambda: ''.join(render_cards(products, set())))
+
+        self.stdout.write(f'{len(products)} cards per page, {pages} pages')
+        self.stdout.write(f'  includes:         {includes:.2f} ms/page')
+        self.stdout.write(f'  fragments (cold): {cold:.2f} ms/page')
+        self.stdout.write(f'  fragments (warm): {warm:.2f} ms/page')
+        self.stdout.write(self.style.SUCCESS(f'Warm fragment cache is {includes / warm:.1f}x faster than includes'))
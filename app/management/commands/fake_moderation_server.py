@@ -0,0 +1,85 @@
+import json
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.core.management.base import BaseCommand
+
+# Категории ответа Mistral moderation
+CATEGORIES = [
+    'sexual', 'hate_and_discrimination', 'violence_and_threats', 'dangerous_and_criminal_content',
+    'selfharm', 'health', 'financial', 'law', 'pii',
+]
+
+
+def _scores(messages, blocked):
+    text = ' '.join(message.get('content', '') for message in messages).lower()
+    flagged = any(word in text for word in blocked)
+    scores = {category: 0.01 for category in CATEGORIES}
+    if flagged:
+        scores['dangerous_and_criminal_content'] = 0.95
+    return {
+        'categories': {category: score > 0.5 for category, score in scores.items()},
+        'category_scores': scores,
+    }
+
+
+def make_handler(blocked, delay):
+    class Handler(BaseHTTPRequestHandler):
+        # Keep-alive, чтобы клиент переиспользовал соединение, как с настоящим API
+        protocol_version = 'HTTP/1.1'
+
+        def do_POST(self):
+            if self.path.rstrip('/') != '/v1/chat/moderations':
+                self._reply(404, {'detail': 'Not found'})
+                return
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            inputs = body.get('input') or []
+            # Одна переписка или список переписок
+            if inputs and isinstance(inputs[0], dict):
+                inputs = [inputs]
+            if delay:
+                time.sleep(delay)
+            self._reply(200, {
+                'id': uuid.uuid4().hex,
+                'model': body.get('model', 'mistral-moderation-latest'),
+                'results': [_scores(messages, blocked) for messages in inputs],
+            })
+
+        def _reply(self, status, payload):
+            data = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+class Command(BaseCommand):
+    help = ('Runs a local stand-in for the Mistral moderation API. Texts containing a blocked word are '
+            'flagged, everything else passes. Point MISTRAL_SERVER_URL at it for local runs and tests')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--delay', type=float, default=0.05, help='Simulated latency per request, seconds')
+        parser.add_argument('--block', action='append', default=None,
+                            help='Word that makes a text flagged (repeatable)')
+
+    def handle(self, *args, **options):
+        blocked = [word.lower() for word in (options['block'] or ['запрещено', 'forbidden'])]
+        server = ThreadingHTTPServer((options['host'], options['port']), make_handler(blocked, options['delay']))
+        self.stdout.write(self.style.SUCCESS(
+            f"Fake moderation server on http://{options['host']}:{options['port']}, blocked words: {', '.join(blocked)}"
+        ))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
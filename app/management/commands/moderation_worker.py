@@ -0,0 +1,40 @@
+import asyncio
+import signal
+
+from django.core.management.base import BaseCommand
+
+from app.moderation_worker import from_settings
+
+
+class Command(BaseCommand):
+    help = ('Runs the asyncio moderation worker: checks pending listings concurrently under a rate limit, '
+            'retries with backoff and pauses while the API is failing; listings it sent to manual review '
+            'go back to the queue once the API recovers. '
+            'Set MODERATION_WORKER=True so that views stop queueing django-q moderation tasks')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, help='Requests in flight, MODERATION_CONCURRENCY by default')
+        parser.add_argument('--rate', dest='rate_limit', type=float,
+                            help='Requests per second, MODERATION_RATE_LIMIT by default')
+        parser.add_argument('--batch-size', type=int, help='Listings per request')
+        parser.add_argument('--poll-interval', type=float, help='Seconds between queue polls when it is empty')
+
+    def handle(self, *args, **options):
+        worker = from_settings(
+            concurrency=options['concurrency'],
+            rate_limit=options['rate_limit'],
+            batch_size=options['batch_size'],
+            poll_interval=options['poll_interval'],
+        )
+        self.stdout.write(
+            f'Moderation worker: concurrency {worker.concurrency}, {worker.bucket.rate} requests/s, '
+            f'batches of {worker.batch_size}'
+        )
+        asyncio.run(self._run(worker))
+        self.stdout.write(self.style.SUCCESS('Moderation worker stopped'))
+
+    async def _run(self, worker):
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, worker.stop)
+        await worker.run()
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from app import facets
+from app.caching import bump_catalog_version
+from app.models import Category
+
+
+class Command(BaseCommand):
+    help = 'Recounts category filter facets for published products'
+
+    def handle(self, *args, **options):
+        self.stdout.write('Rebuilding facet counts...')
+        facets.rebuild()
+        bump_catalog_version(Category.objects.values_list('pk', flat=True))
+        self.stdout.write(self.style.SUCCESS('Successfully rebuilt facet counts'))
@@ -0,0 +1,18 @@
+import time
+
+from django.core.management.base import BaseCommand
+from app import search
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the full-text search index for products'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        self.stdout.write('Rebuilding search index...')
+        started = time.monotonic()
+        count = search.rebuild_index(batch_size=options['batch_size'])
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(f'Indexed {count} products in {elapsed:.2f}s'))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from app import counters
+
+
+class Command(BaseCommand):
+    help = 'Repairs drift in denormalized product view and favorite counters'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report products with drifted counters')
+
+    def handle(self, *args, **options):
+        if options['dry_run']:
+            ids = counters.drifted_ids()
+            self.stdout.write(f'Products with drifted counters: {len(ids)}')
+            return
+        fixed = counters.reconcile()
+        self.stdout.write(self.style.SUCCESS(f'Successfully reconciled counters for {fixed} products'))
@@ -0,0 +1,16 @@
+from django.utils.functional import SimpleLazyObject
+
+from .favorites import get_favorite_ids
+
+
+class FavoritesMiddleware:
+    """
+    Добавляет request.favorite_ids — множество id избранных объявлений.
+    Вычисляется при первом обращении и берётся из кэша.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.favorite_ids = SimpleLazyObject(lambda: get_favorite_ids(request.user))
+        return self.get_response(request)
@@ -0,0 +1,96 @@
+import re
+import unicodedata
+
+from django.db import migrations
+
+# Копия стеммера и схемы индекса из app.search на момент миграции: правки
+# app.search не должны менять то, что делает уже применённая миграция.
+# Индекс, построенный другой версией стеммера, пересобирается через
+# app.search.rebuild_index.
+
+SEARCH_TABLE = 'app_product_search'
+
+MIN_STEM_LENGTH = 3
+
+RU_ENDINGS = sorted([
+    'иями', 'ями', 'ами', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими', 'ией', 'иям', 'иях',
+    'ешь', 'ете', 'ишь', 'ите', 'ают', 'яют', 'ует', 'ала', 'ила', 'ать', 'ять', 'ить', 'еть',
+    'ий', 'ый', 'ой', 'ая', 'яя', 'ое', 'ее', 'ые', 'ие', 'ых', 'их', 'ую', 'юю', 'ом', 'ем',
+    'ам', 'ям', 'ах', 'ях', 'ов', 'ев', 'ей', 'ия', 'ья', 'ье', 'ию', 'ью', 'ии',
+    'а', 'я', 'о', 'е', 'ы', 'и', 'у', 'ю', 'ь', 'й',
+], key=len, reverse=True)
+
+ES_ENDINGS = sorted([
+    'amientos', 'imientos', 'amiento', 'imiento', 'aciones', 'uciones', 'idades', 'mente',
+    'acion', 'ucion', 'ables', 'ibles', 'istas', 'idad', 'able', 'ible', 'ista',
+    'osos', 'osas', 'ando', 'iendo', 'oso', 'osa', 'ado', 'ada', 'ido', 'ida',
+    'ar', 'er', 'ir', 'es', 'os', 'as', 'a', 'o', 'e', 's',
+], key=len, reverse=True)
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+CYRILLIC_RE = re.compile('[а-я]')
+
+
+def stem_word(word):
+    word = word.lower().replace('ё', 'е')
+    if CYRILLIC_RE.search(word):
+        endings = RU_ENDINGS
+    else:
+        word = ''.join(ch for ch in unicodedata.normalize('NFKD', word) if not unicodedata.combining(ch))
+        endings = ES_ENDINGS
+    for ending in endings:
+        if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM_LENGTH:
+            return word[:-len(ending)]
+    return word
+
+
+def stem_text(text):
+    return ' '.join(stem_word(word) for word in WORD_RE.findall(text or ''))
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5("
+            f"title, description, tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+        )
+        insert_sql = f"INSERT INTO {SEARCH_TABLE} (rowid, title, description) VALUES (%s, %s, %s)"
+    elif vendor == 'postgresql':
+        schema_editor.execute(
+            f"CREATE TABLE IF NOT EXISTS {SEARCH_TABLE} ("
+            f"product_id bigint PRIMARY KEY REFERENCES app_product(id) ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, "
+            f"document tsvector NOT NULL)"
+        )
+        schema_editor.execute(
+            f"CREATE INDEX IF NOT EXISTS {SEARCH_TABLE}_document_gin ON {SEARCH_TABLE} USING GIN (document)"
+        )
+        insert_sql = (
+            f"INSERT INTO {SEARCH_TABLE} (product_id, document) VALUES "
+            f"(%s, setweight(to_tsvector('simple', %s), 'A') || setweight(to_tsvector('simple', %s), 'B')) "
+            f"ON CONFLICT (product_id) DO NOTHING"
+        )
+    else:
+        return
+
+    Product = apps.get_model('app', 'Product')
+    rows = Product.objects.order_by().values_list('pk', 'title', 'description')
+    documents = [(pk, stem_text(title), stem_text(description)) for pk, title, description in rows]
+    with schema_editor.connection.cursor() as cursor:
+        cursor.executemany(insert_sql, documents)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor in ('sqlite', 'postgresql'):
+        schema_editor.execute(f"DROP TABLE IF EXISTS {SEARCH_TABLE}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0009_alter_bannerpost_image_alter_category_image'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,68 @@
+# Generated by Django 5.1.7 on 2026-10-18 17:16
+
+import django.db.models.deletion
+from collections import Counter
+
+from django.db import migrations, models
+
+# Ценовые диапазоны на момент миграции (копия app.facets.PRICE_BUCKETS):
+# правки app.facets не должны менять уже применённую миграцию
+PRICE_BUCKETS = (
+    (0, 1000),
+    (1000, 10000),
+    (10000, 50000),
+    (50000, 100000),
+    (100000, 500000),
+    (500000, None),
+)
+
+
+def price_bucket(price):
+    for index, (low, high) in enumerate(PRICE_BUCKETS):
+        if price >= low and (high is None or price < high):
+            return index
+    return 0
+
+
+def populate_facets(apps, schema_editor):
+    Product = apps.get_model('app', 'Product')
+    FacetCount = apps.get_model('app', 'FacetCount')
+    counts = Counter()
+    for category_id, city_id, currency_id, price in Product.objects.filter(status=3).order_by().values_list(
+        'category_id', 'city_id', 'currency_id', 'price'
+    ).iterator(chunk_size=2000):
+        counts[(category_id, 'price', price_bucket(price))] += 1
+        if city_id is not None:
+            counts[(category_id, 'city', city_id)] += 1
+        if currency_id is not None:
+            counts[(category_id, 'currency', currency_id)] += 1
+    FacetCount.objects.bulk_create([
+        FacetCount(category_id=category_id, facet=facet, value=value, count=count)
+        for (category_id, facet, value), count in counts.items()
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0010_product_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FacetCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('facet', models.CharField(choices=[('city', 'Город'), ('currency', 'Валюта'), ('price', 'Цена')], max_length=10, verbose_name='Фильтр')),
+                ('value', models.IntegerField(verbose_name='Значение')),
+                ('count', models.IntegerField(default=0, verbose_name='Количество')),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='facet_counts', to='app.category', verbose_name='Категория')),
+            ],
+            options={
+                'verbose_name': 'Счётчик фильтра',
+                'verbose_name_plural': 'Счётчики фильтров',
+                'unique_together': {('category', 'facet', 'value')},
+            },
+        ),
+        migrations.RunPython(populate_facets, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.1.7 on 2026-10-18 17:26
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def _count_subquery(model):
+    return Coalesce(
+        Subquery(
+            model.objects.filter(product=OuterRef('pk')).order_by()
+            .values('product').annotate(total=Count('pk')).values('total')
+        ),
+        0,
+    )
+
+
+def populate_counters(apps, schema_editor):
+    # Один UPDATE по фактическим строкам просмотров и избранного
+    apps.get_model('app', 'Product').objects.update(
+        view_count=_count_subquery(apps.get_model('app', 'ProductView')),
+        favorite_count=_count_subquery(apps.get_model('app', 'Favorite')),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0011_facetcount'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='favorite_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='В избранном'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='view_count',
+            field=models.PositiveIntegerField(db_index=True, default=0, verbose_name='Просмотры'),
+        ),
+        migrations.RunPython(populate_counters, migrations.RunPython.noop),
+    ]
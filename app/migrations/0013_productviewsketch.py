@@ -0,0 +1,30 @@
+# Generated by Django 5.1.7 on 2026-10-18 17:28
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0012_product_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductViewSketch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(blank=True, null=True, verbose_name='День')),
+                ('registers', models.BinaryField(verbose_name='Регистры')),
+                ('estimate', models.PositiveIntegerField(default=0, verbose_name='Оценка уникальных зрителей')),
+                ('product', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='view_sketches', to='app.product', verbose_name='Объявление')),
+            ],
+            options={
+                'verbose_name': 'Скетч просмотров',
+                'verbose_name_plural': 'Скетчи просмотров',
+                'indexes': [models.Index(fields=['day'], name='app_product_day_fe1bcb_idx')],
+                'constraints': [models.UniqueConstraint(condition=models.Q(('day__isnull', False), ('product__isnull', False)), fields=('product', 'day'), name='unique_product_day_sketch'), models.UniqueConstraint(condition=models.Q(('day__isnull', True)), fields=('product',), name='unique_product_total_sketch'), models.UniqueConstraint(condition=models.Q(('product__isnull', True)), fields=('day',), name='unique_site_day_sketch')],
+            },
+        ),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 5.1.7 on 2026-10-18 17:39
+
+import datetime
+import math
+
+from django.db import migrations, models
+
+# Параметры счёта на момент миграции (копия из app.trending): правки
+# app.trending не должны менять уже применённую миграцию
+HALF_LIFE = 60 * 60 * 24
+VIEW_WEIGHT = 1
+FAVORITE_WEIGHT = 5
+EPOCH = datetime.datetime(2025, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def populate_trending(apps, schema_editor):
+    Product = apps.get_model('app', 'Product')
+    scores = {}
+    for model, weight in (('ProductView', VIEW_WEIGHT), ('Favorite', FAVORITE_WEIGHT)):
+        rows = apps.get_model('app', model).objects.values_list('product_id', 'created_at')
+        for product_id, created_at in rows.iterator(chunk_size=2000):
+            exponent = (created_at - EPOCH).total_seconds() / HALF_LIFE + math.log2(weight)
+            score = scores.get(product_id)
+            if score is None:
+                scores[product_id] = exponent
+            else:
+                high, low = max(score, exponent), min(score, exponent)
+                scores[product_id] = high + math.log2(1 + 2 ** (low - high))
+    Product.objects.bulk_update(
+        [Product(pk=pk, trending_score=score) for pk, score in scores.items()],
+        ['trending_score'],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0013_productviewsketch'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='trending_score',
+            field=models.FloatField(default=0, verbose_name='Популярность'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['status', 'trending_score'], name='app_product_status_eb2b8f_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['category', 'status', 'trending_score'], name='app_product_categor_661bc3_idx'),
+        ),
+        migrations.RunPython(populate_trending, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.1.7 on 2026-10-18 17:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0014_product_trending_score'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ModerationTerm',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=100, verbose_name='Слово или фраза')),
+                ('kind', models.CharField(choices=[('block', 'Запрещено'), ('allow', 'Разрешено')], default='block', max_length=5, verbose_name='Тип')),
+                ('is_active', models.BooleanField(default=True, verbose_name='Активно')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Обновлено')),
+            ],
+            options={
+                'verbose_name': 'Слово модерации',
+                'verbose_name_plural': 'Слова модерации',
+                'ordering': ['kind', 'term'],
+                'unique_together': {('term', 'kind')},
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.7 on 2026-10-18 17:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0015_moderationterm'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='product',
+            name='status',
+            field=models.IntegerField(choices=[(0, 'Не проверено'), (1, 'Одобрено'), (2, 'Отклонено'), (3, 'Опубликовано'), (4, 'Архив'), (5, 'Ручная проверка')], db_index=True, default=0, verbose_name='Статус'),
+        ),
+    ]
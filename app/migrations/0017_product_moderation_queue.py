@@ -0,0 +1,40 @@
+# Generated by Django 5.1.7 on 2026-10-18 17:52
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def populate_queue(apps, schema_editor):
+    # Ожидающие проверки встают в очередь с момента последнего изменения
+    Product = apps.get_model('app', 'Product')
+    Product.objects.filter(status__in=(0, 5)).update(queued_at=F('updated_at'), moderation_due=F('updated_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0016_product_manual_review_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='moderated_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True, verbose_name='Проверено'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='moderation_due',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Место в очереди модерации'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='queued_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Поставлено на модерацию'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['status', 'moderation_due'], name='app_product_status_47c581_idx'),
+        ),
+        migrations.RunPython(populate_queue, migrations.RunPython.noop),
+    ]
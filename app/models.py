@@ -22,6 +22,7 @@ class Product(models.Model):
         (2, 'Отклонено'),
         (3, 'Опубликовано'),
         (4, 'Архив'),
+        (5, 'Ручная проверка'),
     ]
 
     author = models.ForeignKey(get_user_model(), on_delete=models.CASCADE, verbose_name='Автор')
@@ -38,6 +39,18 @@ class Product(models.Model):
     created_at = models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='Опубликовано')
     updated_at = models.DateTimeField(auto_now=True, verbose_name='Обновлено')
     status = models.IntegerField(choices=STATUS_CHOICES, default=0, verbose_name='Статус', db_index=True) 
+    # Денормализованные счётчики: меняются только через F() (см. app.counters)
+    view_count = models.PositiveIntegerField(default=0, db_index=True, verbose_name='Просмотры')
+    favorite_count = models.PositiveIntegerField(default=0, verbose_name='В избранном')
+    # Популярность с затуханием в логарифмической шкале (см. app.trending)
+    trending_score = models.FloatField(default=0, verbose_name='Популярность')
+    # Очередь модерации (см. app.moderation.enqueue): когда объявление встало в
+    # очередь, его место в ней с учётом приоритета и когда вышло из неё
+    queued_at = models.DateTimeField(null=True, blank=True, verbose_name='Поставлено на модерацию')
+    moderation_due = models.DateTimeField(null=True, blank=True, verbose_name='Место в очереди модерации')
+    moderated_at = models.DateTimeField(null=True, blank=True, db_index=True, verbose_name='Проверено')
+
+    COUNTER_FIELDS = ('view_count', 'favorite_count', 'trending_score')
 
     def __str__(self):
         return self.title
@@ -61,9 +74,15 @@ class Product(models.Model):
 
     def get_view_count(self):
         """Возвращает количество уникальных просмотров объявления."""
-        return self.views.count()
+        return self.view_count
             
     def save(self, *args, **kwargs):
+        # Обычное сохранение не перезаписывает счётчики устаревшими значениями
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.COUNTER_FIELDS
+            ]
         if self.image and not self.id:
             self.image = optimize_image(self.image, max_size=(800, 800))
             super().save(*args, **kwargs)
@@ -85,6 +104,9 @@ class Product(models.Model):
             models.Index(fields=['category', 'status']),  
             models.Index(fields=['price', 'status']), 
             models.Index(fields=['created_at', 'status']),  
+            models.Index(fields=['status', 'trending_score']),
+            models.Index(fields=['category', 'status', 'trending_score']),
+            models.Index(fields=['status', 'moderation_due']),
         ]
 
 
@@ -162,6 +184,31 @@ class City(models.Model):
         ordering = ['name']
 
 
+class FacetCount(models.Model):
+    """
+    Предрассчитанное количество опубликованных объявлений категории
+    по значению фильтра (город, валюта, ценовой диапазон).
+    """
+    FACET_CHOICES = [
+        ('city', 'Город'),
+        ('currency', 'Валюта'),
+        ('price', 'Цена'),
+    ]
+
+    category = models.ForeignKey('Category', on_delete=models.CASCADE, related_name='facet_counts', verbose_name='Категория')
+    facet = models.CharField(max_length=10, choices=FACET_CHOICES, verbose_name='Фильтр')
+    value = models.IntegerField(verbose_name='Значение')
+    count = models.IntegerField(default=0, verbose_name='Количество')
+
+    def __str__(self):
+        return f"{self.category} - {self.facet}={self.value}: {self.count}"
+
+    class Meta:
+        verbose_name = 'Счётчик фильтра'
+        verbose_name_plural = 'Счётчики фильтров'
+        unique_together = ('category', 'facet', 'value')
+
+
 class Favorite(models.Model):
     """
     Модель избранного объявления для пользователя.
@@ -222,8 +269,70 @@ class ProductView(models.Model):
             models.Index(fields=['ip_address']),
             models.Index(fields=['created_at']),
         ]
+
+
+class ProductViewSketch(models.Model):
+    """
+    Скетч HyperLogLog уникальных зрителей (см. app.sketches).
+    product + day — зрители объявления за день, product без day — за всё время,
+    day без product — уникальные посетители всех объявлений за день.
+    """
+    product = models.ForeignKey('Product', on_delete=models.CASCADE, null=True, blank=True, related_name='view_sketches', verbose_name='Объявление')
+    day = models.DateField(null=True, blank=True, verbose_name='День')
+    registers = models.BinaryField(verbose_name='Регистры')
+    estimate = models.PositiveIntegerField(default=0, verbose_name='Оценка уникальных зрителей')
+
+    class Meta:
+        verbose_name = 'Скетч просмотров'
+        verbose_name_plural = 'Скетчи просмотров'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['product', 'day'],
+                condition=models.Q(product__isnull=False, day__isnull=False),
+                name='unique_product_day_sketch'
+            ),
+            models.UniqueConstraint(
+                fields=['product'],
+                condition=models.Q(day__isnull=True),
+                name='unique_product_total_sketch'
+            ),
+            models.UniqueConstraint(
+                fields=['day'],
+                condition=models.Q(product__isnull=True),
+                name='unique_site_day_sketch'
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['day']),
+        ]
         
 
+class ModerationTerm(models.Model):
+    """
+    Слово или фраза предварительной модерации (см. app.utils.pre_moderate).
+    Запрещённые сразу отклоняют объявление, разрешённые только снимают
+    совпадения запрещённых внутри себя — публикует по-прежнему классификатор.
+    """
+    KIND_CHOICES = [
+        ('block', 'Запрещено'),
+        ('allow', 'Разрешено'),
+    ]
+
+    term = models.CharField(max_length=100, verbose_name='Слово или фраза')
+    kind = models.CharField(max_length=5, choices=KIND_CHOICES, default='block', verbose_name='Тип')
+    is_active = models.BooleanField(default=True, verbose_name='Активно')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Обновлено')
+
+    def __str__(self):
+        return self.term
+
+    class Meta:
+        verbose_name = 'Слово модерации'
+        verbose_name_plural = 'Слова модерации'
+        unique_together = ('term', 'kind')
+        ordering = ['kind', 'term']
+
+
 class BannerPost(models.Model):
     author = models.ForeignKey(get_user_model(), on_delete=models.CASCADE, verbose_name='Автор')
     title = models.CharField(max_length=50, verbose_name='Товар', db_index=True)
@@ -0,0 +1,448 @@
+import datetime
+import hashlib
+import logging
+import threading
+import time
+
+import httpx
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+from django_q.tasks import async_task
+from mistralai import Mistral
+
+from . import facets, indexes, trending
+from .caching import VERSION_CACHE, bump_catalog_version, lock_store
+from .utils import normalize, pre_moderate
+
+logger = logging.getLogger(__name__)
+
+MODEL = 'mistral-moderation-latest'
+# Объявление отклоняется, если оценка хотя бы одной категории выше порога
+THRESHOLD = 0.5
+
+# Сколько объявлений уходит в один запрос и сколько ждать, пока наберётся пачка
+BATCH_SIZE = getattr(settings, 'MODERATION_BATCH_SIZE', 32)
+BATCH_WINDOW = getattr(settings, 'MODERATION_BATCH_WINDOW', 2)
+# Разбор очереди укладывается в таймаут задачи django-q, остаток
+# достаётся следующей задаче
+DRAIN_BUDGET = 40
+
+LOCK_KEY = 'moderation_drain_lock'
+LOCK_TIMEOUT = 120
+METRICS_KEY = 'moderation_batches'
+METRICS_SIZE = 500
+# Состояние воркера manage.py moderation_worker, обновляется им каждые
+# несколько секунд
+WORKER_STATE_KEY = 'moderation_worker_state'
+WORKER_STATE_TTL = 60
+
+# Вердикты по тексту объявления. Модель и порог входят в ключ, поэтому при
+# их смене старые вердикты перестают использоваться сами.
+VERDICT_TTL = 60 * 60 * 24 * 30
+VERDICT_COUNTER_KEY = 'moderation_verdict_{}'
+
+# Приоритет в очереди: на сколько раньше встаёт объявление. Первое объявление
+# продавца важнее нового от опытного, новое важнее правки. Бонус ограничен,
+# поэтому давно ждущая правка всё равно обгонит свежие объявления.
+FIRST_SELLER_BOOST = datetime.timedelta(minutes=10)
+NEW_LISTING_BOOST = datetime.timedelta(minutes=5)
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """
+    Клиент Mistral, общий для процесса. Соединения в пуле httpx
+    переиспользуются между запросами, без нового TLS-рукопожатия.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = Mistral(
+                    api_key=settings.MISTRAL_API_KEY,
+                    server_url=getattr(settings, 'MISTRAL_SERVER_URL', None),
+                    client=httpx.Client(
+                        limits=httpx.Limits(max_connections=4, max_keepalive_connections=4, keepalive_expiry=120),
+                        timeout=30,
+                    ),
+                    async_client=httpx.AsyncClient(
+                        limits=httpx.Limits(max_connections=16, max_keepalive_connections=16, keepalive_expiry=120),
+                        timeout=30,
+                    ),
+                )
+    return _client
+
+
+def verdict(category_scores):
+    """True, если ни одна категория не превышает порог."""
+    return not any(score > THRESHOLD for score in category_scores.values())
+
+
+def product_text(title, description):
+    return f'{title}\n{description}'
+
+
+def verdict_key(title, description):
+    digest = hashlib.sha256(normalize(product_text(title, description)).encode()).hexdigest()
+    return f'moderation_verdict:{MODEL}:{THRESHOLD}:{digest}'
+
+
+def _count(event, n=1):
+    # Счётчики в общем кэше без вытеснения: попадания бывают и в веб-воркерах
+    if not n:
+        return
+    store = caches[VERSION_CACHE]
+    key = VERDICT_COUNTER_KEY.format(event)
+    try:
+        store.incr(key, n)
+    except ValueError:
+        if not store.add(key, n, None):
+            store.incr(key, n)
+
+
+def cached_verdict(title, description):
+    """Сохранённый вердикт для такого же текста или None."""
+    verdict = cache.get(verdict_key(title, description))
+    _count('hit' if verdict is not None else 'miss')
+    return verdict
+
+
+def local_verdict(title, description):
+    """Вердикт локальных правил (app.utils.pre_moderate) или None."""
+    verdict, reason = pre_moderate(product_text(title, description))
+    if verdict is not None:
+        _count('local')
+    return verdict
+
+
+def instant_status(title, description):
+    """
+    Статус без запроса к API: по локальным правилам или сохранённому
+    вердикту. 3 или 2, None — нужна проверка классификатором.
+    """
+    verdict = local_verdict(title, description)
+    if verdict is None:
+        verdict = cached_verdict(title, description)
+    if verdict is None:
+        return None
+    return 3 if verdict else 2
+
+
+def verdict_stats():
+    store = caches[VERSION_CACHE]
+    hits = store.get(VERDICT_COUNTER_KEY.format('hit')) or 0
+    misses = store.get(VERDICT_COUNTER_KEY.format('miss')) or 0
+    return {
+        'local': store.get(VERDICT_COUNTER_KEY.format('local')) or 0,
+        'hits': hits,
+        'misses': misses,
+        'hit_ratio': round(hits / (hits + misses), 3) if hits + misses else None,
+    }
+
+
+def classify(texts):
+    """Проверяет тексты одним запросом, возвращает вердикты в том же порядке."""
+    if not texts:
+        return []
+    response = get_client().classifiers.moderate_chat(
+        model=MODEL,
+        inputs=[[{'role': 'user', 'content': text}] for text in texts],
+    )
+    return _verdicts(texts, response)
+
+
+async def classify_async(texts):
+    """То же, что classify, для asyncio-воркера."""
+    if not texts:
+        return []
+    response = await get_client().classifiers.moderate_chat_async(
+        model=MODEL,
+        inputs=[[{'role': 'user', 'content': text}] for text in texts],
+    )
+    return _verdicts(texts, response)
+
+
+def _verdicts(texts, response):
+    if len(response.results) != len(texts):
+        raise ValueError(f"Ответ модерации на {len(texts)} текстов содержит {len(response.results)} результатов")
+    return [verdict(result.category_scores or {}) for result in response.results]
+
+
+def schedule():
+    """
+    Ставит разбор очереди в django-q. Когда запущен отдельный воркер
+    (MODERATION_WORKER), он сам забирает новые объявления из БД.
+    """
+    if not getattr(settings, 'MODERATION_WORKER', False):
+        async_task('app.tasks.moderate_pending')
+
+
+def record_batch(size, sent, approved, rejected, skipped, seconds, failed=False):
+    # Пишет только разборщик под блокировкой, поэтому get/set без гонок
+    batches = cache.get(METRICS_KEY) or []
+    batches.append({
+        'at': time.time(),
+        'size': size,
+        'sent': sent,
+        'approved': approved,
+        'rejected': rejected,
+        'skipped': skipped,
+        'ms': round(seconds * 1000, 1),
+        'failed': failed,
+    })
+    cache.set(METRICS_KEY, batches[-METRICS_SIZE:], None)
+
+
+def _percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def stats():
+    """Очередь, задержки и размеры последних пачек модерации."""
+    from .models import Product
+
+    queue = dict(Product.objects.filter(status__in=(0, 5)).values_list('status').annotate(count=Count('pk')).order_by())
+    batches = cache.get(METRICS_KEY) or []
+    ok = [batch for batch in batches if not batch['failed']]
+    # Задержка запроса к API: пачки, решённые целиком по кэшу, её не имеют
+    latencies = [batch['ms'] for batch in ok if batch.get('sent', batch['size'])]
+    return {
+        'queue': {'pending': queue.get(0, 0), 'manual_review': queue.get(5, 0)},
+        'worker': cache.get(WORKER_STATE_KEY),
+        'batches': len(batches),
+        'failed': len(batches) - len(ok),
+        'products': sum(batch['size'] for batch in ok),
+        'approved': sum(batch['approved'] for batch in ok),
+        'rejected': sum(batch['rejected'] for batch in ok),
+        'sent': sum(batch.get('sent', batch['size']) for batch in ok),
+        'avg_batch_size': round(sum(batch['size'] for batch in ok) / len(ok), 1) if ok else None,
+        'latency_ms': {
+            'p50': _percentile(latencies, 0.5),
+            'p95': _percentile(latencies, 0.95),
+            'p99': _percentile(latencies, 0.99),
+            'max': max(latencies) if latencies else None,
+        },
+        'verdict_cache': verdict_stats(),
+        'recent': batches[-20:],
+    }
+
+
+def enqueue(product, now=None):
+    """
+    Ставит объявление в очередь модерации: запоминает время и место в
+    очереди с учётом приоритета. Вызывается перед сохранением (pre_save).
+    """
+    from .models import Product
+
+    now = now or timezone.now()
+    boost = datetime.timedelta(0)
+    if product.pk is None:
+        boost += NEW_LISTING_BOOST
+    has_published = Product.objects.filter(author_id=product.author_id, status__in=(3, 4))
+    if product.pk is not None:
+        has_published = has_published.exclude(pk=product.pk)
+    if not has_published.exists():
+        boost += FIRST_SELLER_BOOST
+    product.queued_at = now
+    product.moderation_due = now - boost
+    product.moderated_at = None
+
+
+def _set_status(product_ids, status):
+    from .models import Product
+
+    if not product_ids:
+        return
+    # .update() обходит сигналы: кэш, фильтры, индексы и топ популярных
+    # обновляются здесь. Объявления уходят из очереди (статус 0), где в
+    # счётчиках фильтров, индексах и топах их не было, поэтому их меняет
+    # только публикация.
+    products = Product.objects.filter(pk__in=product_ids)
+    if status in (0, 5):
+        # Ручная проверка — та же очередь, время ожидания продолжает идти
+        products.update(status=status)
+    else:
+        products.update(status=status, moderated_at=timezone.now())
+    rows = list(products.only('category_id', 'city_id', 'currency_id', 'price', 'status'))
+    category_ids = {product.category_id for product in rows}
+    transaction.on_commit(lambda: bump_catalog_version(category_ids))
+    if status == 3:
+        facets.add_published(rows)
+        trending.invalidate_top(product_ids)
+        transaction.on_commit(indexes.products_published)
+
+
+def pending_rows(batch_size=BATCH_SIZE, exclude=()):
+    """
+    Первые в очереди непроверенные объявления: (pk, title, description,
+    updated_at). Порядок — по месту в очереди с учётом приоритета (enqueue).
+    """
+    from .models import Product
+
+    qs = Product.objects.filter(status=0)
+    if exclude:
+        qs = qs.exclude(pk__in=exclude)
+    return list(qs.order_by('moderation_due', 'pk').values_list('pk', 'title', 'description', 'updated_at')[:batch_size])
+
+
+def known_verdicts(rows):
+    """
+    Вердикты, известные без запроса: по локальным правилам и из кэша.
+    Возвращает ({pk: вердикт}, {pk: ключ} для остальных, {ключ: текст}) —
+    одинаковые тексты попадают в запрос один раз.
+    """
+    decided = {}
+    for pk, title, description, updated_at in rows:
+        verdict = local_verdict(title, description)
+        if verdict is not None:
+            decided[pk] = verdict
+    keys = {pk: verdict_key(title, description) for pk, title, description, updated_at in rows if pk not in decided}
+    cached = cache.get_many(set(keys.values()))
+    _count('hit', sum(1 for key in keys.values() if key in cached))
+    texts = {}
+    for pk, title, description, updated_at in rows:
+        if pk not in keys:
+            continue
+        if keys[pk] in cached:
+            decided[pk] = cached[keys[pk]]
+        else:
+            texts.setdefault(keys[pk], product_text(title, description))
+    remaining = {pk: key for pk, key in keys.items() if pk not in decided}
+    _count('miss', len(remaining))
+    return decided, remaining, texts
+
+
+def store_verdicts(fresh):
+    if fresh:
+        cache.set_many(fresh, VERDICT_TTL)
+
+
+def _still_pending(rows):
+    """pk объявлений, которые всё ещё ждут проверки и не менялись с момента чтения."""
+    from .models import Product
+
+    seen = {pk: updated_at for pk, title, description, updated_at in rows}
+    current = dict(
+        Product.objects.select_for_update().filter(pk__in=seen, status=0).values_list('pk', 'updated_at')
+    )
+    return [pk for pk, updated_at in seen.items() if current.get(pk) == updated_at]
+
+
+def apply_verdicts(rows, verdicts):
+    """
+    Публикует и отклоняет объявления по вердиктам {pk: вердикт}. Объявления,
+    изменённые автором за время проверки, остаются в очереди.
+    Возвращает (опубликовано, отклонено).
+    """
+    with transaction.atomic():
+        approved, rejected = [], []
+        for pk in _still_pending(rows):
+            if pk in verdicts:
+                (approved if verdicts[pk] else rejected).append(pk)
+        _set_status(approved, 3)
+        _set_status(rejected, 2)
+    return approved, rejected
+
+
+def to_manual_review(rows):
+    """Переводит объявления в очередь ручной проверки (статус 5)."""
+    with transaction.atomic():
+        product_ids = _still_pending(rows)
+        _set_status(product_ids, 5)
+    return product_ids
+
+
+def requeue(product_ids):
+    """
+    Возвращает объявления с ручной проверки в очередь (статус 5 → 0), если
+    люди их ещё не решили. Время и место в очереди сохраняются.
+    """
+    from .models import Product
+
+    with transaction.atomic():
+        product_ids = list(
+            Product.objects.select_for_update().filter(pk__in=product_ids, status=5).values_list('pk', flat=True)
+        )
+        _set_status(product_ids, 0)
+    return product_ids
+
+
+def moderate_batch(batch_size=BATCH_SIZE):
+    """
+    Проверяет до batch_size первых в очереди непроверенных объявлений.
+    Явные случаи решают локальные правила, тексты с сохранённым вердиктом тоже
+    решаются без запроса, остальные уходят одним запросом. Возвращает
+    число взятых объявлений.
+    """
+    rows = pending_rows(batch_size)
+    if not rows:
+        return 0
+
+    verdicts, keys, texts = known_verdicts(rows)
+    started = time.monotonic()
+    try:
+        fresh = dict(zip(texts, classify(list(texts.values()))))
+    except Exception:
+        record_batch(len(rows), len(texts), 0, 0, 0, time.monotonic() - started, failed=True)
+        raise
+    seconds = time.monotonic() - started
+    store_verdicts(fresh)
+    verdicts.update({pk: fresh[key] for pk, key in keys.items()})
+
+    approved, rejected = apply_verdicts(rows, verdicts)
+    log_batch(rows, texts, approved, rejected, seconds)
+    return len(rows)
+
+
+def log_batch(rows, texts, approved, rejected, seconds):
+    skipped = len(rows) - len(approved) - len(rejected)
+    record_batch(len(rows), len(texts), len(approved), len(rejected), skipped, seconds)
+    logger.info(
+        f"Модерация: {len(rows)} объявлений, в API {len(texts)} за {seconds * 1000:.0f} мс, "
+        f"опубликовано {len(approved)}, отклонено {len(rejected)}, пропущено {skipped}"
+    )
+
+
+def drain(batch_size=BATCH_SIZE, window=BATCH_WINDOW, budget=DRAIN_BUDGET):
+    """
+    Разбирает очередь непроверенных объявлений пачками. Одновременно
+    работает один разборщик: остальные задачи сразу выходят, их объявления
+    попадут в следующие пачки. Возвращает число проверенных объявлений
+    или None, если очередь уже разбирается.
+    """
+    from .models import Product
+
+    locks = lock_store()
+    if not locks.add(LOCK_KEY, True, LOCK_TIMEOUT):
+        return None
+    done = 0
+    failed = False
+    deadline = time.monotonic() + budget
+    try:
+        # Короткое окно, чтобы объявления из одной волны ушли одним запросом
+        if window and Product.objects.filter(status=0).count() < batch_size:
+            time.sleep(window)
+        while time.monotonic() < deadline:
+            taken = moderate_batch(batch_size)
+            done += taken
+            if taken < batch_size:
+                break
+    except Exception as e:
+        failed = True
+        logger.error(f"Ошибка пакетной модерации: {e}")
+    finally:
+        locks.delete(LOCK_KEY)
+
+    # Объявления, добавленные, пока очередь была занята, или не уместившиеся
+    # в отведённое время. После ошибки ждём следующего объявления.
+    if not failed and Product.objects.filter(status=0).exists():
+        async_task('app.tasks.moderate_pending')
+    return done
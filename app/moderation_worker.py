@@ -0,0 +1,294 @@
+import asyncio
+import logging
+import random
+import time
+from collections import Counter
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections
+
+from . import moderation
+
+logger = logging.getLogger(__name__)
+
+# Ответ _classify, когда запрос не отправлен: цепь разомкнута
+SHORT_CIRCUITED = object()
+
+
+class TokenBucket:
+    """
+    Ограничение частоты запросов: в среднем rate в секунду, всплеском до
+    capacity. Токены копятся со временем, каждый запрос забирает один.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        async with self._lock:
+            self._refill()
+            while self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= 1
+
+    def tokens(self):
+        self._refill()
+        return round(self._tokens, 2)
+
+
+class CircuitBreaker:
+    """
+    После failure_threshold ошибок подряд размыкается на reset_timeout
+    секунд: запросы не отправляются. Затем пропускает один пробный запрос —
+    успех замыкает цепь, ошибка снова размыкает.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=60):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = 'closed'
+        self.failures = 0
+        self._opened_at = None
+        self._probing = False
+
+    def allow(self):
+        if self.state == 'open':
+            if time.monotonic() - self._opened_at < self.reset_timeout:
+                return False
+            self.state = 'half_open'
+        if self.state == 'half_open':
+            if self._probing:
+                return False
+            self._probing = True
+        return True
+
+    def blocked_for(self):
+        """Сколько секунд новые запросы не пройдут: 0 — можно отправлять."""
+        if self.state == 'open':
+            return max(0.0, self.reset_timeout - (time.monotonic() - self._opened_at))
+        if self.state == 'half_open' and self._probing:
+            # Ждём ответа на пробный запрос
+            return 0.1
+        return 0.0
+
+    def success(self):
+        self.state = 'closed'
+        self.failures = 0
+        self._probing = False
+
+    def failure(self):
+        self.failures += 1
+        self._probing = False
+        if self.state == 'half_open' or self.failures >= self.failure_threshold:
+            if self.state != 'open':
+                logger.error(f"Модерация: API недоступно, {self.failures} ошибок подряд, пауза {self.reset_timeout} с")
+            self.state = 'open'
+            self._opened_at = time.monotonic()
+
+
+def _db(func):
+    """Синхронная функция с ORM для вызова из цикла событий."""
+    def wrapper(*args):
+        close_old_connections()
+        try:
+            return func(*args)
+        finally:
+            close_old_connections()
+    return sync_to_async(wrapper)
+
+
+class ModerationWorker:
+    """
+    Долгоживущий воркер модерации на asyncio (manage.py moderation_worker).
+
+    Забирает непроверенные объявления из БД пачками и держит в полёте до
+    concurrency запросов к API, не чаще rate_limit в секунду. Ошибки
+    повторяются с экспоненциальной задержкой со случайным разбросом.
+    При устойчивых ошибках размыкается CircuitBreaker: пока цепь разомкнута,
+    новые пачки из очереди не берутся. Пачки, которые так и не удалось
+    проверить, уходят на ручную проверку (статус 5); когда пауза кончается
+    или API снова отвечает, воркер возвращает их в очередь, если люди ещё
+    не решили. Список таких объявлений хранится в памяти и теряется при
+    перезапуске — тогда их возвращают действием в админке.
+    """
+
+    def __init__(self, concurrency=4, rate_limit=5, batch_size=moderation.BATCH_SIZE, poll_interval=1,
+                 max_retries=3, backoff_base=0.5, backoff_cap=10, request_timeout=30,
+                 failure_threshold=5, reset_timeout=60):
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.request_timeout = request_timeout
+        self.bucket = TokenBucket(rate_limit)
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self._in_flight = set()
+        self._manual_review = set()
+        self._tasks = set()
+        self._stats = Counter()
+        self._stopping = None
+        self._published_at = 0.0
+
+    def stop(self):
+        self._stopping.set()
+
+    async def run(self):
+        self._stopping = asyncio.Event()
+        slots = asyncio.Semaphore(self.concurrency)
+        while not self._stopping.is_set():
+            pause = self.breaker.blocked_for()
+            if pause:
+                # API недоступно: очередь ждёт, а не уходит целиком на ручную проверку
+                await self._publish_state()
+                try:
+                    await asyncio.wait_for(self._stopping.wait(), pause)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            if self._manual_review and self.breaker.state != 'closed':
+                # Пауза кончилась: отправленное людям возвращается в очередь и
+                # идёт пробной пачкой
+                await self._requeue()
+            await slots.acquire()
+            try:
+                rows = await _db(moderation.pending_rows)(self.batch_size, tuple(self._in_flight))
+            except Exception as e:
+                logger.error(f"Модерация: ошибка чтения очереди: {e}")
+                rows = []
+            await self._publish_state()
+            if not rows:
+                slots.release()
+                try:
+                    await asyncio.wait_for(self._stopping.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            product_ids = {row[0] for row in rows}
+            self._in_flight |= product_ids
+            task = asyncio.create_task(self._process(rows))
+            self._tasks.add(task)
+            task.add_done_callback(lambda task, product_ids=product_ids: self._done(task, product_ids, slots))
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        await self._publish_state(force=True)
+
+    def _done(self, task, product_ids, slots):
+        self._tasks.discard(task)
+        self._in_flight -= product_ids
+        slots.release()
+
+    async def _process(self, rows):
+        try:
+            verdicts, keys, texts = await _db(moderation.known_verdicts)(rows)
+            started = time.monotonic()
+            fresh = await self._classify(list(texts.values())) if texts else []
+            seconds = time.monotonic() - started
+            if fresh is SHORT_CIRCUITED:
+                # Цепь разомкнута: непроверенное ждёт в очереди конца паузы,
+                # известное применяется
+                approved, rejected = await _db(moderation.apply_verdicts)(rows, verdicts)
+            elif fresh is None:
+                # API так и не ответило: непроверенное — людям, известное применяется
+                await _db(moderation.record_batch)(len(rows), len(texts), 0, 0, 0, seconds, True)
+                unknown = [row for row in rows if row[0] in keys]
+                moved = await _db(moderation.to_manual_review)(unknown)
+                self._manual_review.update(moved)
+                self._stats['manual_review'] += len(moved)
+                approved, rejected = await _db(moderation.apply_verdicts)(rows, verdicts)
+            else:
+                fresh = dict(zip(texts, fresh))
+                await _db(moderation.store_verdicts)(fresh)
+                verdicts.update({pk: fresh[key] for pk, key in keys.items()})
+                approved, rejected = await _db(moderation.apply_verdicts)(rows, verdicts)
+                await _db(moderation.log_batch)(rows, texts, approved, rejected, seconds)
+                if texts and self._manual_review:
+                    await self._requeue()
+            self._stats['approved'] += len(approved)
+            self._stats['rejected'] += len(rejected)
+        except Exception as e:
+            self._stats['errors'] += 1
+            logger.error(f"Модерация: ошибка обработки пачки: {e}")
+
+    async def _requeue(self):
+        """API снова отвечает: отправленное на ручную проверку — обратно в очередь."""
+        product_ids, self._manual_review = self._manual_review, set()
+        try:
+            requeued = await _db(moderation.requeue)(list(product_ids))
+        except Exception as e:
+            self._manual_review |= product_ids
+            logger.error(f"Модерация: не удалось вернуть объявления в очередь: {e}")
+            return
+        self._stats['requeued'] += len(requeued)
+        logger.info(f"Модерация: API снова доступно, в очередь возвращено {len(requeued)} объявлений")
+
+    async def _classify(self, texts):
+        """
+        Вердикты с повторами, None, если API так и не ответило, или
+        SHORT_CIRCUITED, если цепь разомкнута и запрос не отправлен.
+        """
+        for attempt in range(self.max_retries + 1):
+            if not self.breaker.allow():
+                self._stats['short_circuited'] += 1
+                return SHORT_CIRCUITED
+            await self.bucket.acquire()
+            self._stats['requests'] += 1
+            try:
+                result = await asyncio.wait_for(moderation.classify_async(texts), self.request_timeout)
+            except Exception as e:
+                self.breaker.failure()
+                self._stats['failures'] += 1
+                logger.error(f"Модерация: ошибка запроса (попытка {attempt + 1}): {e!r}")
+                if attempt == self.max_retries:
+                    return None
+                self._stats['retries'] += 1
+                # Полный случайный разброс: повторы разных пачек не совпадают по времени
+                await asyncio.sleep(random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt)))
+            else:
+                self.breaker.success()
+                return result
+        return None
+
+    def state(self):
+        return {
+            'updated_at': time.time(),
+            'breaker': self.breaker.state,
+            'consecutive_failures': self.breaker.failures,
+            'in_flight': len(self._in_flight),
+            'awaiting_requeue': len(self._manual_review),
+            'tasks': len(self._tasks),
+            'tokens': self.bucket.tokens(),
+            **self._stats,
+        }
+
+    async def _publish_state(self, force=False):
+        now = time.monotonic()
+        if not force and now - self._published_at < 2:
+            return
+        self._published_at = now
+        try:
+            await _db(cache.set)(moderation.WORKER_STATE_KEY, self.state(), moderation.WORKER_STATE_TTL)
+        except Exception as e:
+            logger.error(f"Модерация: не удалось сохранить состояние воркера: {e}")
+
+
+def from_settings(**overrides):
+    options = {
+        'concurrency': getattr(settings, 'MODERATION_CONCURRENCY', 4),
+        'rate_limit': getattr(settings, 'MODERATION_RATE_LIMIT', 5),
+    }
+    options.update({name: value for name, value in overrides.items() if value is not None})
+    return ModerationWorker(**options)
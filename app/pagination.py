@@ -0,0 +1,72 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+
+from django.db.models import Q
+
+
+# Поля, по которым разрешена keyset-пагинация, и функции (де)сериализации их значений
+CURSOR_FIELDS = {
+    'created_at': (lambda value: value.isoformat(), datetime.fromisoformat),
+    'price': (int, int),
+    'search_rank': (float, float),
+}
+
+
+def encode_cursor(obj, ordering):
+    """
+    Кодирует позицию объекта в ленте в непрозрачный курсор.
+
+    Курсор содержит имя поля сортировки, его значение и id объекта,
+    поэтому следующая страница выбирается одним диапазонным запросом по индексу.
+    """
+    field = ordering.lstrip('-')
+    serialize, _ = CURSOR_FIELDS[field]
+    payload = json.dumps([field, serialize(getattr(obj, field)), obj.pk], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, ordering):
+    """
+    Декодирует курсор. Возвращает (значение, id) или None, если курсор
+    пустой, повреждён или выдан для другой сортировки.
+    """
+    if not cursor:
+        return None
+    field = ordering.lstrip('-')
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        name, value, pk = json.loads(raw)
+        if name != field:
+            return None
+        _, deserialize = CURSOR_FIELDS[field]
+        return deserialize(value), int(pk)
+    except (binascii.Error, ValueError, TypeError, KeyError):
+        return None
+
+
+def paginate_keyset(qs, ordering, cursor=None, limit=16):
+    """
+    Возвращает (объекты, следующий курсор) для страницы ленты.
+
+    Сортировка дополняется id для однозначности, наличие следующей страницы
+    определяется выборкой limit + 1 строк — без COUNT на каждую страницу.
+    """
+    field = ordering.lstrip('-')
+    descending = ordering.startswith('-')
+    qs = qs.order_by(ordering, '-pk' if descending else 'pk')
+
+    position = decode_cursor(cursor, ordering)
+    if position is not None:
+        value, pk = position
+        op = 'lt' if descending else 'gt'
+        qs = qs.filter(
+            Q(**{f'{field}__{op}': value}) | Q(**{field: value, f'pk__{op}': pk})
+        )
+
+    items = list(qs[:limit + 1])
+    has_more = len(items) > limit
+    items = items[:limit]
+    next_cursor = encode_cursor(items[-1], ordering) if has_more else None
+    return items, next_cursor
@@ -0,0 +1,231 @@
+import re
+import unicodedata
+
+from django.db import connection, transaction
+from django.db.models import Case, FloatField, Q, Value, When
+from django.db.models.functions import Coalesce
+from django.db.models.expressions import RawSQL
+
+
+SEARCH_TABLE = 'app_product_search'
+
+# Вес заголовка относительно описания при ранжировании
+TITLE_WEIGHT = 10.0
+
+MIN_STEM_LENGTH = 3
+
+# Сколько кандидатов нечёткого поиска добавлять к полнотекстовым результатам
+FUZZY_CANDIDATES = 100
+# Сколько кандидатов брать из индекса до фильтра queryset: индекс общий для
+# каталога, и в небольшой категории первых FUZZY_CANDIDATES может не оказаться
+FUZZY_SCAN = 2000
+
+# Надбавка к рангу полнотекстовых совпадений. Больше максимального сходства
+# нечёткого поиска (1.0), поэтому точные совпадения всегда выше нечётких
+EXACT_MATCH_RANK = 2.0
+
+# Окончания отсортированы по убыванию длины: отрезается самое длинное подходящее
+RU_ENDINGS = sorted([
+    'иями', 'ями', 'ами', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими', 'ией', 'иям', 'иях',
+    'ешь', 'ете', 'ишь', 'ите', 'ают', 'яют', 'ует', 'ала', 'ила', 'ать', 'ять', 'ить', 'еть',
+    'ий', 'ый', 'ой', 'ая', 'яя', 'ое', 'ее', 'ые', 'ие', 'ых', 'их', 'ую', 'юю', 'ом', 'ем',
+    'ам', 'ям', 'ах', 'ях', 'ов', 'ев', 'ей', 'ия', 'ья', 'ье', 'ию', 'ью', 'ии',
+    'а', 'я', 'о', 'е', 'ы', 'и', 'у', 'ю', 'ь', 'й',
+], key=len, reverse=True)
+
+ES_ENDINGS = sorted([
+    'amientos', 'imientos', 'amiento', 'imiento', 'aciones', 'uciones', 'idades', 'mente',
+    'acion', 'ucion', 'ables', 'ibles', 'istas', 'idad', 'able', 'ible', 'ista',
+    'osos', 'osas', 'ando', 'iendo', 'oso', 'osa', 'ado', 'ada', 'ido', 'ida',
+    'ar', 'er', 'ir', 'es', 'os', 'as', 'a', 'o', 'e', 's',
+], key=len, reverse=True)
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+CYRILLIC_RE = re.compile('[а-я]')
+
+
+def _strip_accents(word):
+    return ''.join(
+        ch for ch in unicodedata.normalize('NFKD', word)
+        if not unicodedata.combining(ch)
+    )
+
+
+def stem_word(word):
+    """
+    Упрощённый стеммер для русского и испанского языков.
+    Язык определяется по алфавиту слова, отрезается самое длинное окончание,
+    если после него остаётся не меньше MIN_STEM_LENGTH символов.
+    """
+    word = word.lower().replace('ё', 'е')
+    if CYRILLIC_RE.search(word):
+        endings = RU_ENDINGS
+    else:
+        word = _strip_accents(word)
+        endings = ES_ENDINGS
+    for ending in endings:
+        if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM_LENGTH:
+            return word[:-len(ending)]
+    return word
+
+
+def stem_terms(text):
+    """Разбивает текст на слова и возвращает список их основ."""
+    return [stem_word(word) for word in WORD_RE.findall(text or '')]
+
+
+def stem_text(text):
+    return ' '.join(stem_terms(text))
+
+
+def _vendor():
+    return connection.vendor
+
+
+def create_search_table(schema_editor):
+    """Создаёт таблицу полнотекстового индекса для текущей СУБД."""
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5("
+            f"title, description, tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+        )
+    elif vendor == 'postgresql':
+        schema_editor.execute(
+            f"CREATE TABLE IF NOT EXISTS {SEARCH_TABLE} ("
+            f"product_id bigint PRIMARY KEY REFERENCES app_product(id) ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, "
+            f"document tsvector NOT NULL)"
+        )
+        schema_editor.execute(
+            f"CREATE INDEX IF NOT EXISTS {SEARCH_TABLE}_document_gin ON {SEARCH_TABLE} USING GIN (document)"
+        )
+
+
+def drop_search_table(schema_editor):
+    if schema_editor.connection.vendor in ('sqlite', 'postgresql'):
+        schema_editor.execute(f"DROP TABLE IF EXISTS {SEARCH_TABLE}")
+
+
+def _write_documents(cursor, rows):
+    """Записывает в индекс строки (id, заголовок, описание)."""
+    vendor = _vendor()
+    documents = [(pk, stem_text(title), stem_text(description)) for pk, title, description in rows]
+    if vendor == 'sqlite':
+        cursor.executemany(f"DELETE FROM {SEARCH_TABLE} WHERE rowid = %s", [(doc[0],) for doc in documents])
+        cursor.executemany(
+            f"INSERT INTO {SEARCH_TABLE} (rowid, title, description) VALUES (%s, %s, %s)", documents
+        )
+    elif vendor == 'postgresql':
+        cursor.executemany(
+            f"INSERT INTO {SEARCH_TABLE} (product_id, document) VALUES "
+            f"(%s, setweight(to_tsvector('simple', %s), 'A') || setweight(to_tsvector('simple', %s), 'B')) "
+            f"ON CONFLICT (product_id) DO UPDATE SET document = EXCLUDED.document",
+            documents,
+        )
+
+
+def index_product(product):
+    """Добавляет или обновляет объявление в поисковом индексе."""
+    with connection.cursor() as cursor:
+        _write_documents(cursor, [(product.pk, product.title, product.description)])
+
+
+def remove_product(product_id):
+    """Удаляет объявление из поискового индекса."""
+    vendor = _vendor()
+    if vendor not in ('sqlite', 'postgresql'):
+        return
+    column = 'rowid' if vendor == 'sqlite' else 'product_id'
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {SEARCH_TABLE} WHERE {column} = %s", [product_id])
+
+
+def rebuild_index(batch_size=1000):
+    """
+    Полностью перестраивает поисковый индекс по всем объявлениям.
+    Возвращает количество проиндексированных объявлений.
+    """
+    from .models import Product
+
+    count = 0
+    with transaction.atomic(), connection.cursor() as cursor:
+        if _vendor() in ('sqlite', 'postgresql'):
+            cursor.execute(f"DELETE FROM {SEARCH_TABLE}")
+        rows = Product.objects.order_by().values_list('pk', 'title', 'description')
+        batch = []
+        for row in rows.iterator(chunk_size=batch_size):
+            batch.append(row)
+            if len(batch) >= batch_size:
+                _write_documents(cursor, batch)
+                count += len(batch)
+                batch = []
+        if batch:
+            _write_documents(cursor, batch)
+            count += len(batch)
+    return count
+
+
+def search_queryset(qs, query, fuzzy=False):
+    """
+    Фильтрует queryset объявлений по полнотекстовому запросу и добавляет
+    аннотацию search_rank (чем больше, тем релевантнее).
+
+    Индексируются все объявления независимо от статуса, поэтому смена статуса
+    не требует переиндексации — фильтр по статусу остаётся в основном запросе.
+    С fuzzy=True к результатам добавляются кандидаты из триграммного индекса,
+    устойчивого к опечаткам и смешению кириллицы и латиницы; точные
+    совпадения при этом остаются выше нечётких. Кандидаты отбираются уже
+    среди объявлений qs, поэтому фильтр по категории не оставляет выдачу
+    пустой.
+    """
+    terms = stem_terms(query)
+    if not terms:
+        return qs.annotate(search_rank=Value(0.0, output_field=FloatField()))
+
+    table = qs.model._meta.db_table
+    vendor = _vendor()
+    if vendor == 'sqlite':
+        match = ' AND '.join(f'"{term}"*' for term in terms)
+        ids_sql = f"SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s"
+        rank_sql = (
+            f"SELECT -bm25({SEARCH_TABLE}, {TITLE_WEIGHT}, 1.0) FROM {SEARCH_TABLE} "
+            f"WHERE {SEARCH_TABLE} MATCH %s AND rowid = \"{table}\".\"id\""
+        )
+    elif vendor == 'postgresql':
+        match = ' & '.join(f'{term}:*' for term in terms)
+        ids_sql = f"SELECT product_id FROM {SEARCH_TABLE} WHERE document @@ to_tsquery('simple', %s)"
+        rank_sql = (
+            f"SELECT ts_rank(document, to_tsquery('simple', %s)) FROM {SEARCH_TABLE} "
+            f"WHERE product_id = \"{table}\".\"id\" AND document @@ to_tsquery('simple', %s)"
+        )
+    else:
+        match = None
+
+    if match is None:
+        condition = Q(title__icontains=query) | Q(description__icontains=query)
+        rank = Case(When(condition, then=Value(EXACT_MATCH_RANK)), default=Value(0.0), output_field=FloatField())
+    else:
+        condition = Q(pk__in=RawSQL(ids_sql, [match]))
+        rank_params = [match] * rank_sql.count('%s')
+        # Для объявлений вне полнотекстовой выдачи подзапрос даёт NULL, и ранг 0
+        rank = Coalesce(
+            RawSQL(f"({rank_sql}) + {EXACT_MATCH_RANK}", rank_params, output_field=FloatField()), Value(0.0)
+        )
+
+    if fuzzy:
+        from .fuzzy import product_index
+
+        candidates = product_index.search(query, limit=FUZZY_SCAN)
+        if candidates:
+            # Лучшие кандидаты среди тех, что проходят фильтры qs (категория и т.п.)
+            allowed = set(qs.filter(pk__in=[pk for pk, _ in candidates]).values_list('pk', flat=True))
+            candidates = [(pk, similarity) for pk, similarity in candidates if pk in allowed][:FUZZY_CANDIDATES]
+        if candidates:
+            condition |= Q(pk__in=[pk for pk, _ in candidates])
+            rank = rank + Case(
+                *[When(pk=pk, then=Value(similarity)) for pk, similarity in candidates],
+                default=Value(0.0),
+                output_field=FloatField(),
+            )
+
+    return qs.filter(condition).annotate(search_rank=rank)
@@ -1,8 +1,17 @@
+import logging
 
-from django.db.models.signals import m2m_changed, pre_save, post_save
+from django.db import transaction
+from django.db.models.signals import m2m_changed, pre_save, post_save, post_delete
 from django.dispatch import receiver
-from .models import Product
-from .utils import moderate_goods
+from django.utils import timezone
+from .models import Product, Category, City, Currency, Favorite, ModerationTerm
+from .utils import moderate_goods, terms_changed
+from . import search, facets, favorites, counters, fragments, trending, moderation
+from .caching import bump_catalog_version
+from .fuzzy import product_index
+from .suggest import suggest_index
+
+logger = logging.getLogger(__name__)
 
 
 @receiver(post_save, sender=Product)
@@ -16,4 +25,118 @@ def product_post_save(sender, instance, created, **kwargs):
     #         instance.status = 2 
             
     #     type(instance).objects.filter(pk=instance.pk).update(status=instance.status)
-    pass
\ No newline at end of file
+    pass
+
+
+@receiver(post_save, sender=Product)
+def product_search_index_update(sender, instance, **kwargs):
+    """Обновляет поисковый индекс при сохранении объявления."""
+    try:
+        search.index_product(instance)
+    except Exception as e:
+        logger.error(f"Ошибка индексации объявления {instance.pk}: {e}")
+    product_index.update_product(instance)
+    suggest_index.update_product(instance)
+
+
+@receiver(post_delete, sender=Product)
+def product_search_index_delete(sender, instance, **kwargs):
+    """Удаляет объявление из поискового индекса."""
+    try:
+        search.remove_product(instance.pk)
+    except Exception as e:
+        logger.error(f"Ошибка удаления объявления {instance.pk} из индекса: {e}")
+    product_index.remove(instance.pk)
+    suggest_index.remove(instance.pk)
+
+
+@receiver(pre_save, sender=Product)
+def product_facets_snapshot(sender, instance, **kwargs):
+    """Запоминает вклад объявления в счётчики фильтров до сохранения."""
+    before = None
+    if instance.pk:
+        before = Product.objects.filter(pk=instance.pk).only(
+            'status', 'category', 'city', 'currency', 'price'
+        ).first()
+    instance._facets_before = facets.facet_values(before)
+    instance._category_before = before.category_id if before is not None else None
+    instance._status_before = before.status if before is not None else None
+
+
+@receiver(pre_save, sender=Product)
+def product_moderation_queue(sender, instance, **kwargs):
+    """Отмечает вход объявления в очередь модерации и выход из неё."""
+    status_before = getattr(instance, '_status_before', None)
+    if instance.status == 0 and status_before not in (0, 5):
+        moderation.enqueue(instance)
+    elif instance.status in (1, 2, 3) and (instance.pk is None or status_before in (0, 5)):
+        # Новое объявление с известным вердиктом проходит очередь мгновенно
+        now = timezone.now()
+        instance.queued_at = instance.queued_at or now
+        instance.moderated_at = now
+
+
+@receiver(post_save, sender=Product)
+def product_facets_update(sender, instance, **kwargs):
+    """Обновляет счётчики фильтров категории после сохранения объявления."""
+    facets.apply_change(getattr(instance, '_facets_before', set()), facets.facet_values(instance))
+
+
+@receiver(post_delete, sender=Product)
+def product_facets_delete(sender, instance, **kwargs):
+    facets.apply_change(facets.facet_values(instance), set())
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def category_suggest_reload(sender, instance, **kwargs):
+    """Обновляет категории в индексе подсказок."""
+    suggest_index.reload_categories()
+
+
+
+@receiver(post_save, sender=City)
+@receiver(post_delete, sender=City)
+@receiver(post_save, sender=Currency)
+@receiver(post_delete, sender=Currency)
+def product_cards_reset(sender, instance, **kwargs):
+    """Названия городов и валют закэшированы в карточках объявлений."""
+    fragments.references_changed()
+
+
+@receiver(post_save, sender=ModerationTerm)
+@receiver(post_delete, sender=ModerationTerm)
+def moderation_terms_reload(sender, instance, **kwargs):
+    """Воркеры перестроят автомат слов модерации при следующей проверке."""
+    terms_changed()
+
+
+@receiver(post_save, sender=Favorite)
+def favorite_cache_add(sender, instance, created, **kwargs):
+    if created:
+        favorites.favorites_changed(instance.user_id)
+        counters.change_favorite_count(instance.product_id, 1)
+        trending.record_favorite(instance.product_id)
+
+
+@receiver(post_delete, sender=Favorite)
+def favorite_cache_remove(sender, instance, **kwargs):
+    favorites.favorites_changed(instance.user_id)
+    counters.change_favorite_count(instance.product_id, -1)
+
+# Регистрируются последними: версия сдвигается, когда счётчики и индексы уже обновлены.
+# Сдвиг откладывается до фиксации транзакции: иначе параллельный запрос
+# увидит новую версию, прочитает ещё старые строки и закэширует их под ней.
+@receiver(post_save, sender=Product)
+def product_catalog_version_save(sender, instance, **kwargs):
+    """Сбрасывает кэш списков объявлений категории и главной страницы."""
+    category_ids = {instance.category_id}
+    if getattr(instance, '_category_before', None) is not None:
+        category_ids.add(instance._category_before)
+    transaction.on_commit(lambda: bump_catalog_version(category_ids))
+
+
+@receiver(post_delete, sender=Product)
+def product_catalog_version_delete(sender, instance, **kwargs):
+    category_ids = [instance.category_id]
+    transaction.on_commit(lambda: bump_catalog_version(category_ids))
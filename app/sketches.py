@@ -0,0 +1,152 @@
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+
+from .hll import HyperLogLog, hash64
+
+
+def enabled():
+    return getattr(settings, 'PRODUCT_VIEW_SKETCHES', False)
+
+
+def viewer_key(user_id, ip_address, session_key):
+    if user_id is not None:
+        return f'u{user_id}'
+    return f'a{ip_address}|{session_key or ""}'
+
+
+def keep_row(user_id, ip_address, session_key):
+    """
+    Сохранять ли сырую строку ProductView в режиме скетчей. Выборка по хэшу
+    зрителя, чтобы один и тот же зритель всегда попадал или не попадал в неё.
+    """
+    rate = getattr(settings, 'PRODUCT_VIEW_ROWS_SAMPLE_RATE', 1.0)
+    return hash64(viewer_key(user_id, ip_address, session_key)) % 10000 < rate * 10000
+
+
+def _seed_from_rows(product_ids):
+    """Скетчи за всё время для объявлений, которые ещё учитывались строками."""
+    from .models import ProductView
+
+    seeded = defaultdict(HyperLogLog)
+    for product_id, user_id, ip_address, session_key in ProductView.objects.filter(
+        product_id__in=product_ids
+    ).values_list('product_id', 'user_id', 'ip_address', 'session_key').iterator(chunk_size=2000):
+        seeded[product_id].add(viewer_key(user_id, ip_address, session_key))
+    return seeded
+
+
+def _merge(batch, day):
+    from .models import Product, ProductViewSketch
+
+    product_ids = [key[0] for key in batch if key[0] is not None and key[1] is not None]
+    with transaction.atomic():
+        existing = {
+            (sketch.product_id, sketch.day): sketch
+            for sketch in ProductViewSketch.objects.select_for_update().filter(
+                Q(product_id__in=product_ids, day=day)
+                | Q(product_id__in=product_ids, day__isnull=True)
+                | Q(product__isnull=True, day=day)
+            )
+        }
+        seeded = _seed_from_rows([pk for pk in product_ids if (pk, None) not in existing])
+
+        changed, created = [], []
+        for (product_id, sketch_day), hll in batch.items():
+            sketch = existing.get((product_id, sketch_day))
+            if sketch is None:
+                if product_id is not None and sketch_day is None and product_id in seeded:
+                    hll.merge(seeded[product_id])
+                sketch = ProductViewSketch(product_id=product_id, day=sketch_day)
+                created.append(sketch)
+            else:
+                hll.merge(HyperLogLog(sketch.registers))
+                changed.append(sketch)
+            sketch.registers = hll.to_bytes()
+            sketch.estimate = hll.count()
+
+        ProductViewSketch.objects.bulk_update(changed, ['registers', 'estimate'])
+        ProductViewSketch.objects.bulk_create(created)
+        # Счётчик просмотров объявления — оценка уникальных зрителей за всё время
+        Product.objects.bulk_update(
+            [
+                Product(pk=product_id, view_count=batch[(product_id, None)].count())
+                for product_id in product_ids
+            ],
+            ['view_count'],
+        )
+
+
+def record(events, day):
+    """
+    Добавляет пачку просмотров (product_id, user_id, ip_address, session_key)
+    в скетчи за день, за всё время и в общий скетч дня.
+    """
+    batch = defaultdict(HyperLogLog)
+    for product_id, user_id, ip_address, session_key in events:
+        key = viewer_key(user_id, ip_address, session_key)
+        batch[(product_id, day)].add(key)
+        batch[(product_id, None)].add(key)
+        batch[(None, day)].add(key)
+    try:
+        _merge(batch, day)
+    except IntegrityError:
+        # Другой воркер одновременно создал те же скетчи: теперь они есть, сливаем в них.
+        # Скетчи пачки уже могли вобрать сохранённые значения, но max идемпотентен.
+        _merge(batch, day)
+
+
+def ensure_totals(product_ids):
+    """
+    Создаёт скетчи за всё время по сохранённым строкам для объявлений, у
+    которых их ещё нет. Вызывается перед удалением старых строк.
+    """
+    from .models import ProductViewSketch
+
+    product_ids = set(product_ids) - set(
+        ProductViewSketch.objects.filter(product_id__in=product_ids, day__isnull=True)
+        .values_list('product_id', flat=True)
+    )
+    seeded = _seed_from_rows(product_ids)
+    ProductViewSketch.objects.bulk_create(
+        [
+            ProductViewSketch(product_id=product_id, day=None, registers=hll.to_bytes(), estimate=hll.count())
+            for product_id, hll in seeded.items()
+        ],
+        ignore_conflicts=True,
+    )
+    return len(seeded)
+
+
+def unique_viewers(product_id, start_day=None, end_day=None):
+    """Оценка уникальных зрителей объявления за период объединением дневных скетчей."""
+    from .models import ProductViewSketch
+
+    qs = ProductViewSketch.objects.filter(product_id=product_id, day__isnull=False)
+    if start_day is not None:
+        qs = qs.filter(day__gte=start_day)
+    if end_day is not None:
+        qs = qs.filter(day__lte=end_day)
+    merged = HyperLogLog()
+    for registers in qs.values_list('registers', flat=True):
+        merged.merge(HyperLogLog(registers))
+    return merged.count()
+
+
+def unique_visitors(start_date):
+    """Уникальные посетители объявлений начиная с start_date."""
+    from .models import ProductView, ProductViewSketch
+
+    if not enabled():
+        return ProductView.objects.filter(created_at__gte=start_date).values(
+            'user_id', 'ip_address', 'session_key'
+        ).distinct().count()
+    merged = HyperLogLog()
+    for registers in ProductViewSketch.objects.filter(
+        product__isnull=True, day__gte=start_date.date()
+    ).values_list('registers', flat=True):
+        merged.merge(HyperLogLog(registers))
+    return merged.count()
+
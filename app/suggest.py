@@ -0,0 +1,152 @@
+import re
+import sys
+from bisect import bisect_left, insort
+
+from .indexes import ProductMemoryIndex
+
+
+# Сколько записей индекса просматривается на один запрос — ограничивает задержку
+SCAN_LIMIT = 500
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def normalize(text):
+    return ' '.join(WORD_RE.findall((text or '').lower().replace('ё', 'е')))
+
+
+def word_suffixes(key):
+    """Хвосты фразы, начинающиеся с каждого слова: «iphone 13 pro», «13 pro», «pro»."""
+    words = key.split(' ')
+    return {' '.join(words[i:]) for i in range(len(words))}
+
+
+class SuggestIndex(ProductMemoryIndex):
+    """
+    Префиксный индекс для автодополнения поиска.
+
+    Хранит отсортированный массив пар (хвост заголовка, заголовок), поэтому
+    подсказки по префиксу находятся бинарным поиском без обращения к БД.
+    Одинаковые заголовки объединяются и ранжируются по числу объявлений.
+    Категорий немного, по ним достаточно линейного просмотра.
+    """
+
+    state_attrs = ('_entries', '_titles', '_docs', '_categories')
+
+    def _reset(self):
+        self._entries = []
+        self._titles = {}
+        self._docs = {}
+        self._categories = []
+        self._bulk = False
+
+    def size(self):
+        return len(self._entries)
+
+    def _populate(self):
+        # При полной перестройке записи сортируются один раз в конце, а не вставкой
+        self._bulk = True
+        super()._populate()
+        self._entries.sort()
+        self._bulk = False
+        self._categories = self._load_categories()
+
+    @staticmethod
+    def _load_categories():
+        from .models import Category
+
+        return [
+            (normalize(category.name), category.name, category.get_absolute_url())
+            for category in Category.objects.all()
+        ]
+
+    def reload_categories(self):
+        if self._built_at is None:
+            return
+        categories = self._load_categories()
+        with self._lock:
+            self._categories = categories
+
+    def _insert(self, pk, title):
+        key = normalize(title)
+        if not key:
+            return
+        self._docs[pk] = key
+        entry = self._titles.get(key)
+        if entry is not None:
+            entry[1] += 1
+            return
+        self._titles[key] = [title.strip(), 1]
+        for suffix in word_suffixes(key):
+            if self._bulk:
+                self._entries.append((suffix, key))
+            else:
+                insort(self._entries, (suffix, key))
+
+    def _discard(self, pk):
+        key = self._docs.pop(pk, None)
+        if key is None:
+            return
+        entry = self._titles[key]
+        entry[1] -= 1
+        if entry[1]:
+            return
+        del self._titles[key]
+        for suffix in word_suffixes(key):
+            i = bisect_left(self._entries, (suffix, key))
+            if i < len(self._entries) and self._entries[i] == (suffix, key):
+                del self._entries[i]
+
+    def suggest(self, query, limit=8):
+        """
+        Возвращает подсказки для префикса: сначала категории, затем заголовки
+        объявлений, начинающиеся с префикса с любого слова.
+        """
+        self.ensure_fresh()
+        prefix = normalize(query)
+        if not prefix:
+            return []
+        with self._lock:
+            categories = [
+                {'type': 'category', 'text': name, 'url': url}
+                for key, name, url in self._categories
+                if any(suffix.startswith(prefix) for suffix in word_suffixes(key))
+            ]
+            found = set()
+            i = bisect_left(self._entries, (prefix,))
+            end = min(len(self._entries), i + SCAN_LIMIT)
+            while i < end:
+                suffix, key = self._entries[i]
+                if not suffix.startswith(prefix):
+                    break
+                found.add(key)
+                i += 1
+            titles = [self._titles[key] for key in found]
+        titles.sort(key=lambda entry: (-entry[1], len(entry[0]), entry[0]))
+        products = [
+            {'type': 'product', 'text': text, 'count': count}
+            for text, count in titles[:max(0, limit - len(categories))]
+        ]
+        return categories[:limit] + products
+
+    def stats(self):
+        data = super().stats()
+        with self._lock:
+            approx_bytes = sys.getsizeof(self._entries) + sum(
+                sys.getsizeof(entry) + sys.getsizeof(entry[0]) for entry in self._entries
+            )
+            approx_bytes += sys.getsizeof(self._titles) + sum(
+                sys.getsizeof(key) + sys.getsizeof(entry) + sys.getsizeof(entry[0])
+                for key, entry in self._titles.items()
+            )
+            approx_bytes += sys.getsizeof(self._docs) + 28 * len(self._docs)
+            data.update({
+                'titles': len(self._titles),
+                'products': len(self._docs),
+                'categories': len(self._categories),
+                'approx_bytes': approx_bytes,
+            })
+        return data
+
+
+suggest_index = SuggestIndex()
@@ -1,8 +1,11 @@
 from datetime import timedelta
 from django.utils import timezone
-from .models import Product
+from django.conf import settings
+from django.db import transaction
+from .models import Product, ProductView
 from django_q.tasks import async_task
-from .utils import moderate_goods
+from . import facets, moderation, sketches
+from .caching import bump_catalog_version
 import logging
 
 logger = logging.getLogger(__name__)
@@ -19,25 +22,39 @@ def archive_old_products():
         status=3, 
         updated_at__lt=one_day_ago 
     )
+    category_ids = set(old_products.values_list('category_id', flat=True))
     
     count = old_products.update(status=4)
+    facets.rebuild(category_ids)
+    transaction.on_commit(lambda: bump_catalog_version(category_ids))
     
     return f"Архивировано {count} объявлений"
 
 
-def moderate_product(product_id):
-    print(f"Запущена задача для продукта с ID {product_id}")
+def prune_product_views():
     """
-    Фоновая задача: проверяет контент продукта через ИИ и сохраняет результат.
+    В режиме скетчей удаляет сырые просмотры старше
+    PRODUCT_VIEW_ROWS_RETENTION_DAYS. Уникальные зрители к этому моменту
+    уже учтены в скетчах.
     """
-    try:
-        product = Product.objects.get(pk=product_id)
-        result = moderate_goods(product.description)
-        if result:
-            product.status = 3
-        else:
-            product.status = 2 
-        product.save()
-    except Product.DoesNotExist:
-        logger.error(f"Ошибка при модерации продукта {product_id}: {str(e)}")
-        pass
\ No newline at end of file
+    days = getattr(settings, 'PRODUCT_VIEW_ROWS_RETENTION_DAYS', None)
+    if not sketches.enabled() or not days:
+        return "Хранение просмотров не ограничено"
+
+    old_views = ProductView.objects.filter(created_at__lt=timezone.now() - timedelta(days=days))
+    sketches.ensure_totals(old_views.values_list('product_id', flat=True).distinct())
+    count, _ = old_views.delete()
+
+    return f"Удалено {count} просмотров"
+
+
+def moderate_pending():
+    """
+    Фоновая задача: разбирает очередь непроверенных объявлений пачками,
+    см. app.moderation.drain.
+    """
+    done = moderation.drain()
+    if done is None:
+        return "Очередь модерации уже разбирается"
+    return f"Проверено {done} объявлений"
+
@@ -0,0 +1,32 @@
+from django import template
+
+from app.fragments import render_cards
+
+register = template.Library()
+
+
+def _favorite_ids(context):
+    # Избранное читается один раз на шаблон, даже если карточек много
+    render_context = context.render_context
+    if 'favorite_ids' not in render_context:
+        favorite_ids = context.get('favorite_products') or ()
+        if not isinstance(favorite_ids, (set, frozenset)):
+            favorite_ids = set(favorite_ids)
+        render_context['favorite_ids'] = favorite_ids
+    return render_context['favorite_ids']
+
+
+@register.simple_tag(takes_context=True)
+def product_cards(context, products):
+    """
+    Закэшированные карточки для списка объявлений:
+    {% product_cards products as cards %}{% for card in cards %}{{ card }}{% endfor %}
+    """
+    return render_cards(products, _favorite_ids(context))
+
+
+@register.simple_tag(takes_context=True)
+def product_card(context, product):
+    """Одна закэшированная карточка внутри цикла шаблона."""
+    forloop = context.get('forloop') or {}
+    return render_cards([product], _favorite_ids(context), eager_first=forloop.get('first', False))[0]
@@ -0,0 +1,68 @@
+import tempfile
+
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.test import SimpleTestCase, override_settings
+
+from app.cache_backend import INVALIDATION_ENTRY, RING_SIZE, TwoTierCache
+
+LOCMEM = 'django.core.cache.backends.locmem.LocMemCache'
+
+
+@override_settings(CACHES={
+    'default': {'BACKEND': LOCMEM, 'LOCATION': 'two-tier-tests-default'},
+    # Общий L2 без вытеснения: журнал должен ограничивать себя сам
+    'shared': {'BACKEND': LOCMEM, 'LOCATION': 'two-tier-tests-shared', 'OPTIONS': {'MAX_ENTRIES': 100000}},
+})
+class TwoTierCacheTests(SimpleTestCase):
+    """Два экземпляра с общим L2 — как два воркера с общим Redis."""
+
+    def setUp(self):
+        caches['shared'].clear()
+        self.first = self.make_cache()
+        self.second = self.make_cache()
+
+    def make_cache(self):
+        return TwoTierCache('', {'OPTIONS': {'L2': 'shared', 'CHECK_INTERVAL': 0}})
+
+    def test_write_invalidates_other_l1(self):
+        self.first.set('key', 'old')
+        self.assertEqual(self.second.get('key'), 'old')
+        self.assertEqual(self.second.l1_stats()['entries'], 1)
+
+        self.first.set('key', 'new')
+
+        self.assertEqual(self.second.get('key'), 'new')
+
+    def test_delete_invalidates_other_l1(self):
+        self.first.set_many({'a': 1, 'b': 2})
+        self.assertEqual(self.second.get_many(['a', 'b']), {'a': 1, 'b': 2})
+
+        self.first.delete('a')
+        self.first.delete_many(['b'])
+
+        self.assertIsNone(self.second.get('a'))
+        self.assertEqual(self.second.get_many(['a', 'b']), {})
+
+    def test_journal_stays_bounded(self):
+        self.second.set('watched', 'old')
+        self.assertEqual(self.second.get('watched'), 'old')
+        self.first.set('watched', 'new')
+
+        # Кольцо оборачивается дважды, пока второй экземпляр не читает журнал
+        for i in range(RING_SIZE * 2 + 10):
+            self.first.set(f'key-{i}', i)
+
+        slots = [INVALIDATION_ENTRY.format(i) for i in range(RING_SIZE * 3)]
+        self.assertEqual(len(self.first.l2.get_many(slots)), RING_SIZE)
+        # Пропущенные сообщения затёрты: второй экземпляр очищает L1 целиком
+        self.assertEqual(self.second.get('watched'), 'new')
+
+    def test_non_atomic_l2_is_refused(self):
+        location = tempfile.mkdtemp()
+        with self.settings(CACHES={
+            'default': {'BACKEND': LOCMEM},
+            'shared': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': location},
+        }):
+            with self.assertRaises(ImproperlyConfigured):
+                self.make_cache().get('key')
@@ -0,0 +1,197 @@
+import asyncio
+import threading
+import time
+from http.server import ThreadingHTTPServer
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+from django.core.cache import caches
+from django.test import TestCase, TransactionTestCase, override_settings
+
+from app import moderation
+from app.management.commands.fake_moderation_server import make_handler
+from app.models import Category, City, Currency, ModerationTerm, Product
+from app.moderation_worker import ModerationWorker
+from app.utils import moderation_rules
+from user_capybara.models import TelegramUser
+
+BLOCKED_WORD = 'запрещено'
+
+TEST_CACHES = {
+    alias: {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': f'moderation-tests-{alias}'}
+    for alias in ('default', 'shared', 'versions')
+}
+
+
+class FakeModerationServer:
+    """
+    Фейковый сервер модерации (manage.py fake_moderation_server) в потоке
+    теста на свободном порту. Считает запросы и по флагу failing отвечает 503.
+    """
+
+    def __init__(self, blocked=(BLOCKED_WORD,)):
+        self.requests = 0
+        self.failing = False
+        fake = self
+
+        class Handler(make_handler(list(blocked), 0)):
+            def do_POST(self):
+                fake.requests += 1
+                if fake.failing:
+                    self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                    self._reply(503, {'detail': 'Service unavailable'})
+                    return
+                super().do_POST()
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self._server.server_port}'
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class FakeServerMixin:
+    """Запускает фейковый сервер и направляет на него клиент модерации через MISTRAL_SERVER_URL."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = FakeModerationServer()
+        cls.server.start()
+        cls._server_settings = override_settings(
+            MISTRAL_SERVER_URL=cls.server.url,
+            MISTRAL_API_KEY='test',
+            # Без django-q: разбор очереди вызывается тестом напрямую
+            MODERATION_WORKER=True,
+            CACHES=TEST_CACHES,
+        )
+        cls._server_settings.enable()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls._server_settings.disable()
+        cls.server.stop()
+
+    def setUp(self):
+        super().setUp()
+        # Клиент общий для процесса и запоминает адрес сервера при создании
+        moderation._client = None
+        self.addCleanup(setattr, moderation, '_client', None)
+        for alias in TEST_CACHES:
+            caches[alias].clear()
+        self.server.requests = 0
+        self.server.failing = False
+        self.author = TelegramUser.objects.create(telegram_id=1, username='seller')
+        self.category = Category.objects.create(name='Разное', slug='raznoe')
+        self.city = City.objects.create(name='Москва')
+        self.currency = Currency.objects.create(name='Рубль', code='RUB')
+
+    def create_product(self, title, description='Состояние хорошее'):
+        return Product.objects.create(
+            author=self.author, category=self.category, city=self.city, currency=self.currency,
+            title=title, description=description, price=100, status=0,
+        )
+
+    def statuses(self, products):
+        return list(Product.objects.filter(pk__in=[p.pk for p in products]).order_by('pk').values_list('status', flat=True))
+
+
+class ModerateBatchTests(FakeServerMixin, TestCase):
+
+    def test_verdicts_are_mapped_back_by_position(self):
+        products = [
+            self.create_product('Велосипед'),
+            self.create_product('Товар', f'Это {BLOCKED_WORD} продавать'),
+            self.create_product('Диван'),
+            self.create_product('Ещё товар', f'Тоже {BLOCKED_WORD}'),
+        ]
+
+        self.assertEqual(moderation.moderate_batch(), 4)
+
+        self.assertEqual(self.statuses(products), [3, 2, 3, 2])
+        self.assertEqual(self.server.requests, 1)
+
+    def test_listing_edited_during_request_stays_pending(self):
+        edited = self.create_product('Велосипед')
+        other = self.create_product('Диван')
+        classify = moderation.classify
+
+        def edit_then_classify(texts):
+            product = Product.objects.get(pk=edited.pk)
+            product.description = 'Состояние отличное'
+            product.save()
+            return classify(texts)
+
+        with mock.patch.object(moderation, 'classify', side_effect=edit_then_classify):
+            moderation.moderate_batch()
+
+        self.assertEqual(self.statuses([edited, other]), [0, 3])
+
+    def test_cached_verdict_avoids_second_request(self):
+        first = self.create_product('Велосипед', 'Почти новый')
+        moderation.moderate_batch()
+        self.assertEqual(self.server.requests, 1)
+
+        # Тот же текст с другим регистром и пробелами
+        second = self.create_product('велосипед', 'Почти  новый')
+        moderation.moderate_batch()
+
+        self.assertEqual(self.server.requests, 1)
+        self.assertEqual(self.statuses([first, second]), [3, 3])
+
+    def test_block_term_rejects_without_request(self):
+        ModerationTerm.objects.create(term='казино', kind='block')
+        product = self.create_product('Лучшее Казино города')
+
+        with mock.patch.object(moderation_rules, 'check_interval', 0):
+            moderation.moderate_batch()
+
+        self.assertEqual(self.statuses([product]), [2])
+        self.assertEqual(self.server.requests, 0)
+
+
+class ModerationWorkerBreakerTests(FakeServerMixin, TransactionTestCase):
+
+    def wait_for(self, products, expected, timeout=10):
+        """Ждёт, пока все объявления получат статус expected."""
+        deadline = time.monotonic() + timeout
+
+        async def poll():
+            while time.monotonic() < deadline:
+                if set(await sync_to_async(self.statuses)(products)) == {expected}:
+                    return True
+                await asyncio.sleep(0.05)
+            return False
+
+        return poll()
+
+    def test_breaker_sends_to_manual_review_and_requeues(self):
+        products = [self.create_product(f'Товар {i}') for i in range(3)]
+        worker = ModerationWorker(
+            concurrency=1, rate_limit=100, batch_size=8, poll_interval=0.05, max_retries=0,
+            backoff_base=0.01, failure_threshold=1, reset_timeout=0.3, request_timeout=5,
+        )
+        self.server.failing = True
+
+        async def scenario():
+            task = asyncio.create_task(worker.run())
+            try:
+                self.assertTrue(await self.wait_for(products, 5))
+                self.assertEqual(worker.breaker.state, 'open')
+                self.server.failing = False
+                self.assertTrue(await self.wait_for(products, 3))
+            finally:
+                worker.stop()
+                await task
+
+        with self.assertLogs('app.moderation_worker', 'ERROR'):
+            asyncio.run(scenario())
+        self.assertEqual(worker.breaker.state, 'closed')
+        self.assertEqual(worker.state()['requeued'], 3)
+        self.assertEqual(worker.state()['awaiting_requeue'], 0)
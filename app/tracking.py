@@ -0,0 +1,115 @@
+import atexit
+import logging
+import threading
+from collections import Counter, deque
+
+from django.db import connection
+from django.utils import timezone
+
+from . import counters, sketches, trending
+
+logger = logging.getLogger(__name__)
+
+
+class ViewBuffer:
+    """
+    Буфер просмотров объявлений с отложенной записью.
+
+    Запрос только добавляет событие в очередь в памяти. Фоновый поток раз в
+    flush_interval секунд (или раньше, когда набралось flush_batch событий)
+    записывает их одним bulk_create. Повторные просмотры отбрасываются
+    уникальными ограничениями ProductView. В режиме скетчей
+    (PRODUCT_VIEW_SKETCHES) строки сохраняются выборочно, а уникальные
+    зрители считаются через HyperLogLog. При переполнении новые события
+    теряются и учитываются в счётчике dropped, при остановке процесса
+    остаток буфера записывается.
+    """
+
+    def __init__(self, max_size=10000, flush_batch=500, flush_interval=5):
+        self.max_size = max_size
+        self.flush_batch = flush_batch
+        self.flush_interval = flush_interval
+        self._events = deque()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._stats = Counter()
+
+    def record(self, product_id, user_id=None, ip_address=None, session_key=None):
+        with self._lock:
+            if len(self._events) >= self.max_size:
+                self._stats['dropped'] += 1
+                return False
+            self._events.append((product_id, user_id, ip_address, session_key))
+            self._stats['recorded'] += 1
+            pending = len(self._events)
+            if self._thread is None:
+                self._start()
+        if pending >= self.flush_batch:
+            self._wakeup.set()
+        return True
+
+    def _start(self):
+        self._thread = threading.Thread(target=self._run, name='view-buffer', daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        """Записывает накопленные просмотры, возвращает число обработанных событий."""
+        from .models import ProductView
+
+        with self._flush_lock:
+            with self._lock:
+                events = list(self._events)
+                self._events.clear()
+            if not events:
+                return 0
+            use_sketches = sketches.enabled()
+            try:
+                ProductView.objects.bulk_create(
+                    [
+                        ProductView(
+                            product_id=product_id,
+                            user_id=user_id,
+                            ip_address=ip_address,
+                            session_key=session_key,
+                        )
+                        for product_id, user_id, ip_address, session_key in events
+                        if not use_sketches or sketches.keep_row(user_id, ip_address, session_key)
+                    ],
+                    batch_size=self.flush_batch,
+                    ignore_conflicts=True,
+                )
+                if use_sketches:
+                    sketches.record(events, timezone.localdate())
+                else:
+                    counters.recount_views({event[0] for event in events})
+                trending.record_views([event[0] for event in events])
+            except Exception as e:
+                logger.error(f"Ошибка записи просмотров: {e}")
+                with self._lock:
+                    self._stats['failed'] += len(events)
+                connection.close()
+                return 0
+            with self._lock:
+                self._stats['flushed'] += len(events)
+                self._stats['batches'] += 1
+            return len(events)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'pending': len(self._events),
+                'max_size': self.max_size,
+                **{name: self._stats[name] for name in ('recorded', 'flushed', 'dropped', 'failed', 'batches')},
+            }
+
+
+view_buffer = ViewBuffer()
@@ -0,0 +1,121 @@
+import datetime
+import math
+from collections import Counter, defaultdict
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, FloatField, Value
+from django.db.models.functions import Abs, Greatest, Log, Power
+from django.utils import timezone
+
+from .caching import cache_fetch
+
+# За HALF_LIFE секунд вклад события в популярность уменьшается вдвое
+HALF_LIFE = 60 * 60 * 24
+VIEW_WEIGHT = 1
+FAVORITE_WEIGHT = 5
+
+# Счёт хранится как log2(Σ вес · 2^((t − EPOCH) / HALF_LIFE)). Затухание
+# одинаково для всех объявлений, поэтому порядок по сохранённому значению
+# совпадает с порядком по текущей популярности и пересчитывать старые
+# значения со временем не нужно. Логарифм не даёт числам переполниться.
+EPOCH = datetime.datetime(2025, 1, 1, tzinfo=datetime.timezone.utc)
+
+# Топ объявлений в кэше: глобальный (ключ с 0) и по категориям
+TOP_K = 50
+TOP_TTL = 60 * 60
+
+
+def _exponent(when, weight):
+    return (when - EPOCH).total_seconds() / HALF_LIFE + math.log2(weight)
+
+
+def _log_add(exponent):
+    """log2(2^score + 2^exponent) в БД: max + log2(1 + 2^−|разность|)."""
+    score = F('trending_score')
+    exponent = Value(exponent, output_field=FloatField())
+    return Greatest(score, exponent) + Log(
+        Value(2.0), Value(1.0) + Power(Value(2.0), -Abs(score - exponent))
+    )
+
+
+def current_score(trending_score, now=None):
+    """Популярность сейчас — сумма весов событий с учётом затухания."""
+    now = now or timezone.now()
+    if not trending_score:
+        return 0.0
+    return 2 ** (trending_score - (now - EPOCH).total_seconds() / HALF_LIFE)
+
+
+def _top_key(category_id=None):
+    return f'trending_top_ids:{category_id or 0}'
+
+
+def record(product_counts, weight, when=None):
+    """
+    Добавляет события {product_id: количество} с весом weight. Одно UPDATE
+    на каждое встречающееся количество, затем затронутые топы
+    сбрасываются.
+    """
+    from .models import Product
+
+    if not product_counts:
+        return
+    when = when or timezone.now()
+    groups = defaultdict(list)
+    for product_id, count in product_counts.items():
+        groups[count].append(product_id)
+    for count, product_ids in groups.items():
+        Product.objects.filter(pk__in=product_ids).update(
+            trending_score=_log_add(_exponent(when, weight * count))
+        )
+    invalidate_top(product_counts.keys())
+
+
+def record_views(product_ids, when=None):
+    record(Counter(product_ids), VIEW_WEIGHT, when)
+
+
+def record_favorite(product_id, when=None):
+    record({product_id: 1}, FAVORITE_WEIGHT, when)
+
+
+def invalidate_top(product_ids):
+    """
+    Сбрасывает глобальный топ и топы категорий объявлений product_ids, их
+    пересоберёт первое чтение по индексу популярности. Топы не сливаются с
+    новыми значениями на месте: чтение и запись из разных воркеров теряли
+    бы записи друг друга, а сброс от порядка не зависит. Вызывается и после
+    массовой смены статуса. Сброс ждёт фиксации транзакции, иначе чтение
+    соберёт топ из старых значений.
+    """
+    from .models import Product
+
+    category_ids = set(Product.objects.filter(pk__in=list(product_ids)).values_list('category_id', flat=True))
+    keys = [_top_key()] + [_top_key(category_id) for category_id in category_ids]
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def _build_top(category_id=None):
+    from .models import Product
+
+    qs = Product.objects.filter(status=3, trending_score__gt=0)
+    if category_id is not None:
+        qs = qs.filter(category_id=category_id)
+    return list(qs.order_by('-trending_score').values_list('pk', 'trending_score')[:TOP_K])
+
+
+def top_ids(category_id=None, limit=TOP_K):
+    top = cache_fetch(_top_key(category_id), lambda: _build_top(category_id), TOP_TTL)
+    return [pk for pk, score in top[:limit]]
+
+
+def top_products(category_id=None, limit=8):
+    """Опубликованные объявления из топа в порядке популярности."""
+    from .models import Product
+
+    ids = top_ids(category_id)
+    products = Product.objects.filter(pk__in=ids, status=3).select_related('author', 'category', 'currency', 'city')
+    by_pk = {product.pk: product for product in products}
+    return [by_pk[pk] for pk in ids if pk in by_pk][:limit]
+
@@ -2,7 +2,9 @@ from django.urls import path
 from .views import (
     ProductDetailView,  ProductDeleteView,
     FavoriteListView, toggle_favorite, change_product_status, FavoriteProductsAPIView,
-    banner_ad_info, product_list, ProductUpdateView, ProductCreateView, index, category_detail, category_product_list
+    banner_ad_info, product_list, ProductUpdateView, ProductCreateView, index, category_detail, category_product_list,
+    search_products, suggest, search_index_stats, cache_stats_view, view_buffer_stats, trending_products,
+    moderation_stats
     )   
 
 app_name = 'app'
@@ -10,11 +12,18 @@ app_name = 'app'
 urlpatterns = [
     path('', index, name='index'),
     path('product_list/', product_list, name='product_list'),
+    path('trending/', trending_products, name='trending'),
     path('product/create/', ProductCreateView.as_view(), name='product_create'),
     path('product/<int:pk>/edit/', ProductUpdateView.as_view(), name='product_edit'),
 
     path('category/<slug:category_slug>/', category_detail, name='category_detail'),
     path('category/<slug:category_slug>/products/', category_product_list, name='category_product_list'),
+    path('search/', search_products, name='search'),
+    path('api/suggest/', suggest, name='api_suggest'),
+    path('api/suggest/stats/', search_index_stats, name='api_suggest_stats'),
+    path('api/cache/stats/', cache_stats_view, name='api_cache_stats'),
+    path('api/views/stats/', view_buffer_stats, name='api_view_buffer_stats'),
+    path('api/moderation/stats/', moderation_stats, name='api_moderation_stats'),
 
 
     
@@ -1,20 +1,167 @@
-from mistralai import Mistral
-from django.conf import settings
+import logging
+import re
+import threading
+import time
+import unicodedata
+from collections import deque
+
+from .caching import bump_version, get_version
+
+logger = logging.getLogger(__name__)
+
+# Версия списка слов модерации в общем кэше версий: сдвигается при правке в
+# админке, воркеры по ней перестраивают автомат
+TERMS_VERSION_KEY = 'moderation_terms_version'
+
+# Признаки спама. Больше MAX_LINKS ссылок или MAX_PHONES телефонов — отказ,
+# меньше или повтор символа — только причина в ответе, решает классификатор
+LINK_RE = re.compile(r'(?:https?://|www\.|t\.me/)\S+|\b[\w-]+\.(?:ru|com|net|org|info|biz|io|me|рф)\b\S*')
+PHONE_RE = re.compile(r'(?<!\d)(?:\+?\d[\s()-]*){10,12}(?!\d)')
+REPEAT_RE = re.compile(r'(\S)\1{5,}')
+MAX_LINKS = 2
+MAX_PHONES = 2
+
+
+def normalize(text):
+    """Текст для сравнения: регистр, вид символов и пробелы не важны."""
+    return ' '.join(unicodedata.normalize('NFKC', text).lower().replace('ё', 'е').split())
+
+
+class TermMatcher:
+    """
+    Автомат Ахо–Корасик: все вхождения набора фраз за один проход по тексту
+    независимо от их числа. Фразы и текст сравниваются после normalize.
+    """
+
+    def __init__(self, terms):
+        # terms — пары (фраза, значение); узел: переходы, суффиксная ссылка, выходы
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [[]]
+        for term, value in terms:
+            term = normalize(term)
+            if not term:
+                continue
+            node = 0
+            for char in term:
+                nxt = self._goto[node].get(char)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[node][char] = nxt
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append([])
+                node = nxt
+            self._out[node].append((len(term), value))
+
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, nxt in self._goto[node].items():
+                queue.append(nxt)
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(char, 0)
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    def __len__(self):
+        return len(self._goto) - 1
+
+    def find(self, text):
+        """(начало, конец, значение) для вхождений целыми словами в нормализованный text."""
+        node = 0
+        for end, char in enumerate(text, 1):
+            while node and char not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(char, 0)
+            for length, value in self._out[node]:
+                start = end - length
+                if (start == 0 or not text[start - 1].isalnum()) and (end == len(text) or not text[end].isalnum()):
+                    yield start, end, value
+
+
+class ModerationRules:
+    """
+    Слова модерации из админки, собранные в TermMatcher. Автомат строится
+    один раз и перестраивается, когда версия в общем кэше меняется;
+    версия проверяется не чаще раза в check_interval секунд.
+    """
+
+    check_interval = 5
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._matcher = TermMatcher(())
+        self._version = None
+        self._checked_at = 0.0
+
+    def build(self, version=None):
+        from .models import ModerationTerm
+
+        terms = list(ModerationTerm.objects.filter(is_active=True).values_list('term', 'kind'))
+        matcher = TermMatcher(terms)
+        logger.info(f"Слова модерации: {len(terms)} фраз, {len(matcher)} узлов автомата")
+        with self._lock:
+            self._matcher = matcher
+            self._version = version
+        return matcher
+
+    def matcher(self):
+        now = time.monotonic()
+        if self._version is None or now - self._checked_at >= self.check_interval:
+            self._checked_at = now
+            version = get_version(TERMS_VERSION_KEY)
+            if version != self._version:
+                return self.build(version)
+        return self._matcher
+
+
+moderation_rules = ModerationRules()
+
+
+def terms_changed():
+    bump_version(TERMS_VERSION_KEY)
+
+
+def pre_moderate(text):
+    """
+    Быстрая проверка до запроса к API. Возвращает (вердикт, причина):
+    False — отклонить, None — решает классификатор. Публикует только
+    классификатор: одна разрешённая фраза в тексте не говорит, что
+    безобиден весь текст, поэтому разрешённые фразы лишь снимают совпадения
+    запрещённых внутри себя и попадают в причину как подсказка.
+    """
+    text = normalize(text)
+    blocked, allowed = [], []
+    for start, end, kind in moderation_rules.matcher().find(text):
+        (allowed if kind == 'allow' else blocked).append((start, end))
+    # Запрещённое слово внутри разрешённой фразы не считается
+    blocked = [
+        (start, end) for start, end in blocked
+        if not any(a_start <= start and end <= a_end for a_start, a_end in allowed)
+    ]
+    if blocked:
+        start, end = blocked[0]
+        return False, f'block:{text[start:end]}'
+
+    links = len(LINK_RE.findall(text))
+    phones = len(PHONE_RE.findall(text))
+    signals = [name for name, hit in (('links', links), ('phones', phones), ('repeat', REPEAT_RE.search(text))) if hit]
+    if links > MAX_LINKS:
+        return False, 'links'
+    if phones > MAX_PHONES:
+        return False, 'phones'
+    if signals:
+        return None, signals[0]
+    return None, 'allow' if allowed else None
+
 
 def moderate_goods(text):
-    client = Mistral(api_key=settings.MISTRAL_API_KEY)
-    
-    response = client.classifiers.moderate_chat(
-        model="mistral-moderation-latest",
-        inputs=[{"role": "user", "content": text}]
-    )
-    
-    category_scores = response.results[0].category_scores
-    
-    has_violations = any(
-        category_score > 0.5 
-        for category_score in category_scores.values()
-    )
-    
-
-    return not has_violations
+    """Проверка одного текста: локальные правила, затем общий клиент модерации."""
+    from .moderation import classify
+
+    verdict, reason = pre_moderate(text)
+    if verdict is not None:
+        return verdict
+    return classify([text])[0]
@@ -1,6 +1,5 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.views.generic import ListView, DetailView, CreateView, UpdateView, DeleteView, View
-from django.db.models import Q
 from django.urls import reverse_lazy, reverse
 from django.http import HttpResponse, JsonResponse, Http404
 from django.template.loader import render_to_string
@@ -9,23 +8,23 @@ from django.views.decorators.http import require_POST
 from django.views.decorators.cache import cache_page
 from django.utils.decorators import method_decorator
 from django.core.paginator import Paginator
-from django_q.tasks import async_task
 from django.core.cache import cache
+from django.contrib.admin.views.decorators import staff_member_required
 from functools import wraps
+from urllib.parse import urlencode
+import time
 
-from .models import Product, Category, Currency, City, Favorite, ProductView, BannerPost
+from .models import Product, Category, Currency, City, Favorite, BannerPost
 from .forms import ProductForm
+from .pagination import paginate_keyset, encode_cursor
+from .search import search_queryset
+from .suggest import suggest_index
+from .fuzzy import product_index
+from .tracking import view_buffer
+from . import facets, moderation, trending
+from .caching import get_cached, cache_fetch, cache_stats, versioned_key, versioned_cache_page, LISTING_CACHE_TTL
 
 
-# Helper to cache reference lists
-CACHE_TTL = 60 * 60  # 1 hour
-def get_cached(key, queryset):
-    data = cache.get(key)
-    if data is None:
-        data = list(queryset)
-        cache.set(key, data, CACHE_TTL)
-    return data
-
 # HTMX-aware login decorator
 def htmx_aware_login_required(view_func):
     @wraps(view_func)
@@ -39,31 +38,28 @@ def htmx_aware_login_required(view_func):
 
 
 def index(request):
-    favorite_products = set()
-    if request.user.is_authenticated:
-        favorite_products = set(
-            Favorite.objects.filter(user=request.user)
-                    .values_list('product_id', flat=True)
-        )
-    
     context = {
         'categories': get_cached('all_categories', Category.objects.all()),
         'banners': BannerPost.objects.select_related('author').all(),
-        'total_count': cache.get_or_set(
-            'products_total_count', 
+        'total_count': cache_fetch(
+            versioned_key('products_total_count'), 
             lambda: Product.objects.filter(status=3).count(), 
-            60 * 5
+            LISTING_CACHE_TTL
         ),
         # Возвращаем загрузку первых продуктов!
-        'initial_products': cache.get_or_set(
-            'initial_products',
+        'initial_products': cache_fetch(
+            versioned_key('initial_products'),
             lambda: list(Product.objects.filter(status=3)
                         .select_related('author', 'category', 'currency', 'city')
-                        .prefetch_related('favorited_by')[:8]),
-            60 * 2
+                        .prefetch_related('favorited_by')
+                        .order_by('-created_at', '-pk')[:8]),
+            LISTING_CACHE_TTL
         ),
-        'favorite_products': favorite_products,
+        'trending_products': trending.top_products(limit=4),
+        'favorite_products': request.favorite_ids,
     }
+    if context['initial_products']:
+        context['next_cursor'] = encode_cursor(context['initial_products'][-1], '-created_at')
     
     if request.headers.get("HX-Request"):
         return render(request, "app/includes/include_index.html", context)
@@ -71,6 +67,20 @@ def index(request):
 
 
 
+def trending_products(request):
+    """Лента популярных сейчас объявлений, общая или по категории (?category=slug)."""
+    category = None
+    if request.GET.get('category'):
+        category = get_object_or_404(Category, slug=request.GET['category'])
+    context = {
+        'category': category,
+        'products': trending.top_products(category.pk if category else None, limit=trending.TOP_K),
+        'favorite_products': request.favorite_ids,
+    }
+    if request.headers.get("HX-Request"):
+        return render(request, "app/includes/trending.html", context)
+    return render(request, "app/trending.html", context)
+
 
 # Mixins
 class PublishedMixin:
@@ -81,7 +91,7 @@ class SearchMixin:
     def filter_search(self, qs):
         q = self.request.GET.get('q')
         if q:
-            return qs.filter(Q(title__icontains=q) | Q(description__icontains=q))
+            return search_queryset(qs, q)
         return qs
 
 class AuthorRequiredMixin:
@@ -93,37 +103,26 @@ class AuthorRequiredMixin:
 
 
 def product_list(request):
-    page = int(request.GET.get('page', 1))
-    offset = int(request.GET.get('offset', 0))
+    cursor = request.GET.get('cursor')
+    limit = 16
     
     base_qs = Product.objects.filter(status=3)
     base_qs = base_qs.select_related('author', 'category', 'currency', 'city')
-    total = base_qs.count()
-    
-    limit = 16
-    products = base_qs.order_by('-created_at')[offset:offset+limit]
-    
-    favorite_products = set()
-    if request.user.is_authenticated:
-        favorite_products = set(
-            Favorite.objects.filter(user=request.user)
-                    .values_list('product_id', flat=True)
-        )
+    products, next_cursor = paginate_keyset(base_qs, '-created_at', cursor, limit)
     
     # Создаем объект для совместимости с шаблоном
     class ProductPage:
-        def __init__(self, products, offset, limit, total):
+        def __init__(self, products, next_cursor):
             self.object_list = products
-            self.has_next = offset + limit < total
-            self.next_offset = offset + limit if self.has_next else None
+            self.has_next = next_cursor is not None
+            self.next_cursor = next_cursor
     
-    products_page = ProductPage(products, offset, limit, total)
+    products_page = ProductPage(products, next_cursor)
     
     context = {
         'products': products_page,
-        'total_count': total,
-        'next_offset': products_page.next_offset,
-        'favorite_products': favorite_products,  # Добавляем избранные
+        'next_cursor': next_cursor,
+        'favorite_products': request.favorite_ids,
     }
     return render(request, 'app/includes/product_list.html', context)
 
@@ -148,25 +147,23 @@ class ProductDetailView(DetailView):
     def get(self, request, *args, **kwargs):
         self.object = self.get_object()
         if request.user != self.object.author:
-            ip = request.META.get('HTTP_X_FORWARDED_FOR', '').split(',')[0] or request.META.get('REMOTE_ADDR')
-            session_key = request.session.session_key or request.session.save() or request.session.session_key
-            ProductView.objects.update_or_create(
-                product=self.object,
-                defaults={'user': request.user} if request.user.is_authenticated else {
-                    'ip_address': ip,
-                    'session_key': session_key
-                }
-            )
+            # Просмотр пишется в БД фоновым потоком пачками, см. app.tracking
+            if request.user.is_authenticated:
+                view_buffer.record(self.object.pk, user_id=request.user.pk)
+            else:
+                ip = request.META.get('HTTP_X_FORWARDED_FOR', '').split(',')[0] or request.META.get('REMOTE_ADDR')
+                # Без сессии не создаём её ради просмотра: такие просмотры различаются по IP
+                view_buffer.record(self.object.pk, ip_address=ip, session_key=request.session.session_key or '')
         return self.render_to_response(self.get_context_data())
 
     def get_context_data(self, **kwargs):
         ctx = super().get_context_data(**kwargs)
-        ctx['is_favorite'] = Favorite.objects.filter(user=self.request.user, product=self.object).exists() if self.request.user.is_authenticated else False
+        ctx['is_favorite'] = self.object.pk in self.request.favorite_ids
         return ctx
 
 
 @method_decorator(login_required(login_url='user:telegram_auth'), name='dispatch')
-@method_decorator(cache_page(60 * 15), name='dispatch')
+@method_decorator(versioned_cache_page(LISTING_CACHE_TTL, category_kwarg='category_slug'), name='dispatch')
 class CategoryDetailView(PublishedMixin, SearchMixin, ListView):
     model = Product
     template_name = 'app/category_detail.html'
@@ -186,6 +183,9 @@ class CategoryDetailView(PublishedMixin, SearchMixin, ListView):
         if city and city.isdigit(): qs = qs.filter(city_id=city)
         cur = self.request.GET.get('currency')
         if cur and cur.isdigit(): qs = qs.filter(currency_id=cur)
+        price = self.request.GET.get('price')
+        if price and price.isdigit() and int(price) < len(facets.PRICE_BUCKETS):
+            qs = qs.filter(**facets.price_bucket_filter(int(price)))
         sort = self.request.GET.get('sort')
         ordering = {'price_asc':'price','price_desc':'-price','date_asc':'created_at'}.get(sort, '-created_at')
         qs = qs.order_by(ordering)
@@ -194,19 +194,22 @@ class CategoryDetailView(PublishedMixin, SearchMixin, ListView):
 
     def get_context_data(self, **kwargs):
         ctx = super().get_context_data(**kwargs)
+        category = self.get_category()
+        cities = get_cached('all_cities', City.objects.all())
+        currencies = get_cached('all_currencies', Currency.objects.all())
+        ctx.update(facets.filter_options(category.pk, cities, currencies))
         ctx.update({
-            'category': self.get_category(),
-            'cities': get_cached('all_cities', City.objects.all()),
-            'currencies': get_cached('all_currencies', Currency.objects.all()),
+            'category': category,
+            'cities': cities,
+            'currencies': currencies,
             'total_count': self.total_count,
             'has_more': self.total_count > len(ctx['products']),
             'query': self.request.GET.get('q', ''),
             'current_sort': self.request.GET.get('sort', ''),
             'current_city': self.request.GET.get('city', ''),
             'current_currency': self.request.GET.get('currency', ''),
-            'favorite_products': set(
-                Favorite.objects.filter(user=self.request.user).values_list('product_id', flat=True)
-            ) if self.request.user.is_authenticated else set(),
+            'current_price': self.request.GET.get('price', ''),
+            'favorite_products': self.request.favorite_ids,
         })
         return ctx
 
@@ -220,10 +223,13 @@ class ProductCreateView(CreateView):
 
     def form_valid(self, form):
         form.instance.author = self.request.user
-        form.instance.status = 0
+        # Явный случай или такой же текст уже проверялся — вердикт известен без очереди
+        status = moderation.instant_status(form.instance.title, form.instance.description)
+        form.instance.status = 0 if status is None else status
         response = super().form_valid(form)
 
-        async_task('app.tasks.moderate_product', self.object.id)
+        if status is None:
+            moderation.schedule()
         
         if self.request.headers.get('HX-Request'):
             return HttpResponse(
@@ -253,10 +259,16 @@ class ProductUpdateView(AuthorRequiredMixin, UpdateView):
         return Product.objects.filter(author=self.request.user)
 
     def form_valid(self, form):
-        form.instance.status = 0
+        # Модерация смотрит только на текст: при смене цены, фото или города
+        # опубликованное или отклонённое объявление сохраняет статус
+        status = form.instance.status
+        if {'title', 'description'} & set(form.changed_data) or status not in (2, 3):
+            status = moderation.instant_status(form.instance.title, form.instance.description)
+            form.instance.status = 0 if status is None else status
         response = super().form_valid(form)
 
-        async_task('app.tasks.moderate_product', self.object.id)
+        if status is None:
+            moderation.schedule()
         
         if self.request.headers.get('HX-Request'):
             return HttpResponse(
@@ -322,7 +334,9 @@ def toggle_favorite(request, pk):
     fav, created = Favorite.objects.get_or_create(user=request.user, product=product)
     if not created: fav.delete()
     if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-        return JsonResponse({'success': True, 'is_favorite': created, 'count': product.favorited_by.count()})
+        # Счётчик обновлён сигналом через F(), читаем актуальное значение
+        product.refresh_from_db(fields=['favorite_count'])
+        return JsonResponse({'success': True, 'is_favorite': created, 'count': product.favorite_count})
     return redirect('app:product_detail', pk=pk)
 
 
@@ -334,6 +348,8 @@ def change_product_status(request, pk, status):
     if request.user == product.author and status in transitions.get(product.status, []):
         product.status = status
         product.save()
+        if status == 0:
+            moderation.schedule()
     return redirect('app:product_detail', pk=pk)
 
 
@@ -341,14 +357,12 @@ class FavoriteProductsAPIView(View):
     def get(self, request, *args, **kwargs):
         if not request.user.is_authenticated:
             return JsonResponse({'error':'Требуется авторизация'},status=401)
-        offset, limit = map(int, (request.GET.get('offset',0), request.GET.get('limit',10)))
+        cursor, limit = request.GET.get('cursor'), int(request.GET.get('limit',10))
         qs = Product.objects.filter(favorited_by__user=request.user, status=3)
         qs = qs.select_related('author','category','currency','city')
-        total = qs.count()
-        items = qs.order_by('-created_at')[offset:offset+limit]
-        fav_ids = list(request.user.favorites.values_list('product_id', flat=True))
-        html = render_to_string('app/includes/product_cards_list.html', {'products':items,'favorite_products':fav_ids,'request':request})
-        return JsonResponse({'html':html,'has_more':offset+limit<total,'total_count':total,'next_offset':offset+limit if offset+limit<total else None})
+        items, next_cursor = paginate_keyset(qs, '-created_at', cursor, limit)
+        html = render_to_string('app/includes/product_cards_list.html', {'products':items,'favorite_products':request.favorite_ids,'request':request})
+        return JsonResponse({'html':html,'has_more':next_cursor is not None,'next_cursor':next_cursor})
 
 
 @login_required(login_url='user:telegram_auth')
@@ -356,62 +370,61 @@ def banner_ad_info(request):
     return render(request, 'app/includes/banner_ad_modal.html', {'admin_telegram': '@newpunknot'})
 
 
-@cache_page(60 * 5)
+@versioned_cache_page(LISTING_CACHE_TTL, category_kwarg='category_slug')
 def category_detail(request, category_slug):
     category = get_object_or_404(Category, slug=category_slug)
+    cities = get_cached('all_cities', City.objects.all())
+    currencies = get_cached('all_currencies', Currency.objects.all())
     
     context = {
         'category': category,
-        'cities': get_cached('all_cities', City.objects.all()),
-        'currencies': get_cached('all_currencies', Currency.objects.all()),
-        'total_count': cache.get_or_set(
-            f'category_{category_slug}_count',
+        'cities': cities,
+        'currencies': currencies,
+        'total_count': cache_fetch(
+            versioned_key(f'category_{category.pk}_count', category.pk),
             lambda: Product.objects.filter(status=3, category=category).count(),
-            60 * 5
+            LISTING_CACHE_TTL
         ),
     }
+    context.update(facets.filter_options(category.pk, cities, currencies))
     
     return render(request, "app/category_detail.html", context)
 
 
 def category_product_list(request, category_slug):
     category = get_object_or_404(Category, slug=category_slug)
-    offset = int(request.GET.get('offset', 0))
+    cursor = request.GET.get('cursor')
     limit = int(request.GET.get('limit', 8))
     query = request.GET.get('q', '').strip()
     sort = request.GET.get('sort', '')
     city = request.GET.get('city', '')
     currency = request.GET.get('currency', '')
+    price = request.GET.get('price', '')
     
     qs = Product.objects.filter(status=3, category=category)
     qs = qs.select_related('author', 'category', 'currency', 'city')
     
     if query:
-        qs = qs.filter(
-            Q(title__icontains=query) | Q(description__icontains=query)
-        )
+        qs = search_queryset(qs, query, fuzzy=True)
     
     if city and city.isdigit():
         qs = qs.filter(city_id=city)
 
     if currency and currency.isdigit():
         qs = qs.filter(currency_id=currency)
+
+    if price and price.isdigit() and int(price) < len(facets.PRICE_BUCKETS):
+        qs = qs.filter(**facets.price_bucket_filter(int(price)))
     
     ordering = {
         'date_desc': '-created_at',
         'date_asc': 'created_at',
         'price_asc': 'price',
         'price_desc': '-price'
-    }.get(sort, '-created_at')
+    }.get(sort, '-search_rank' if query else '-created_at')
     
-    qs = qs.order_by(ordering)
-
-    total = qs.count()
-    products = qs[offset:offset+limit]
+    products, next_cursor = paginate_keyset(qs, ordering, cursor, limit)
     
-    favorite_products = set(
-        Favorite.objects.filter(user=request.user).values_list('product_id', flat=True)
-    ) if request.user.is_authenticated else set()
     
 
     filter_params = []
@@ -423,20 +436,106 @@ def category_product_list(request, category_slug):
         filter_params.append(f'city={city}')
     if currency:
         filter_params.append(f'currency={currency}')
+    if price:
+        filter_params.append(f'price={price}')
     
     filter_string = '&'.join(filter_params)
     
     context = {
         'products': products,
         'category_slug': category_slug,
-        'has_more': offset + limit < total,
-        'next_offset': offset + limit if offset + limit < total else None,
-        'favorite_products': favorite_products,
+        'has_more': next_cursor is not None,
+        'next_cursor': next_cursor,
+        'favorite_products': request.favorite_ids,
         'query': query,
         'current_sort': sort,
         'current_city': city,
         'current_currency': currency,
+        'current_price': price,
         'filter_params': filter_string,
     }
+
+    # Первая страница выдачи заодно обновляет счётчики в фильтрах
+    if not cursor:
+        context['facets_oob'] = True
+        context.update(facets.filter_options(
+            category.pk,
+            get_cached('all_cities', City.objects.all()),
+            get_cached('all_currencies', Currency.objects.all()),
+        ))
     
     return render(request, 'app/includes/category_products_list.html', context)
+
+
+def search_products(request):
+    cursor = request.GET.get('cursor')
+    limit = int(request.GET.get('limit', 16))
+    query = request.GET.get('q', '').strip()
+
+    qs = Product.objects.filter(status=3)
+    qs = qs.select_related('author', 'category', 'currency', 'city')
+
+    ordering = '-created_at'
+    if query:
+        qs = search_queryset(qs, query, fuzzy=True)
+        ordering = '-search_rank'
+
+    products, next_cursor = paginate_keyset(qs, ordering, cursor, limit)
+
+
+    context = {
+        'products': products,
+        'has_more': next_cursor is not None,
+        'next_cursor': next_cursor,
+        'favorite_products': request.favorite_ids,
+        'query': query,
+        'filter_params': urlencode({'q': query}) if query else '',
+    }
+
+    return render(request, 'app/includes/search_results.html', context)
+
+
+def suggest(request):
+    started = time.perf_counter()
+    try:
+        limit = max(1, min(int(request.GET.get('limit', 8)), 20))
+    except ValueError:
+        limit = 8
+    suggestions = suggest_index.suggest(request.GET.get('q', ''), limit=limit)
+    search_url = reverse('app:search')
+    for item in suggestions:
+        if item['type'] == 'product':
+            item['url'] = f"{search_url}?{urlencode({'q': item['text']})}"
+    return JsonResponse({
+        'suggestions': suggestions,
+        'took_ms': round((time.perf_counter() - started) * 1000, 3),
+    })
+
+
+@staff_member_required
+def search_index_stats(request):
+    return JsonResponse({
+        'suggest': suggest_index.stats(),
+        'fuzzy': product_index.stats(),
+    })
+
+
+@staff_member_required
+def cache_stats_view(request):
+    """Счётчики кэша текущего воркера: hit, miss, stale, early, refresh, wait."""
+    data = cache_stats()
+    if hasattr(cache, 'l1_stats'):
+        data['l1'] = cache.l1_stats()
+    return JsonResponse(data)
+
+
+@staff_member_required
+def view_buffer_stats(request):
+    """Состояние буфера просмотров текущего воркера."""
+    return JsonResponse(view_buffer.stats())
+
+
+@staff_member_required
+def moderation_stats(request):
+    """Размеры и задержки последних пачек модерации."""
+    return JsonResponse(moderation.stats())
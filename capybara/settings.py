@@ -88,6 +88,7 @@ MIDDLEWARE = [
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'user_capybara.middleware.JWTAuthenticationMiddleware',  
+    'app.middleware.FavoritesMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'debug_toolbar.middleware.DebugToolbarMiddleware',
@@ -304,6 +305,16 @@ BASE_URL = os.getenv('BASE_URL')
 
 # Mistral API
 MISTRAL_API_KEY = os.getenv("MISTRAL_API_KEY") 
+# Адрес API модерации: для локальной проверки — manage.py fake_moderation_server
+MISTRAL_SERVER_URL = os.getenv("MISTRAL_SERVER_URL")
+# Пакетная модерация (app.moderation): объявлений в запросе и окно сбора пачки, секунды
+MODERATION_BATCH_SIZE = 32
+MODERATION_BATCH_WINDOW = 2
+# Отдельный asyncio-воркер модерации (manage.py moderation_worker) вместо
+# задач django-q: запросов в полёте и запросов к API в секунду
+MODERATION_WORKER = os.getenv('MODERATION_WORKER', 'False') == 'True'
+MODERATION_CONCURRENCY = 4
+MODERATION_RATE_LIMIT = 5
 
 # Пути к изображениям для бота
 PHOTO_START = os.getenv("PHOTO_START")
@@ -316,14 +327,59 @@ SAPPORT_URL = os.getenv("SAPPORT_URL")
 IMAGEKIT_CACHEFILE_DIR = 'CACHE/'
 IMAGEKIT_DEFAULT_CACHEFILE_STRATEGY = 'imagekit.cachefiles.strategies.Optimistic'
 
+# Общий кэш для нескольких воркеров и хостов
+REDIS_URL = os.getenv('REDIS_URL')
+
+# Файловый кэш, общий для воркеров одного хоста
+FILE_CACHE = {
+    'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+    'LOCATION': os.path.join(BASE_DIR, 'cache', 'default'),
+    'TIMEOUT': 300,
+    'OPTIONS': {'MAX_ENTRIES': 10000},
+}
+
 CACHES = {
+    # С Redis — небольшой LRU в памяти воркера перед общим кэшем 'shared'.
+    # Журналу инвалидаций L1 нужны атомарные add и incr, поэтому без Redis
+    # кэш по умолчанию просто файловый
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-        'LOCATION': 'unique-snowflake',
-        'TIMEOUT': 300,  
-    }
+        'BACKEND': 'app.cache_backend.TwoTierCache',
+        'TIMEOUT': 300,
+        'OPTIONS': {
+            'L2': 'shared',
+            'MAX_BYTES': 32 * 1024 * 1024,
+            'L1_TIMEOUT': 60,
+        },
+    } if REDIS_URL else FILE_CACHE,
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': REDIS_URL,
+        'TIMEOUT': 300,
+    } if REDIS_URL else FILE_CACHE,
+    # Версии каталога для инвалидации кэша списков: общие для всех воркеров.
+    # Записи не должны вытесняться — потерянная версия вернула бы ключи к
+    # устаревшим данным. В Redis incr атомарен; в файловом кэше нет, и
+    # одновременные сдвиги версии могут слиться в один.
+    'versions': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': REDIS_URL,
+        'KEY_PREFIX': 'versions',
+        'TIMEOUT': None,
+    } if REDIS_URL else {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache', 'versions'),
+        'TIMEOUT': None,
+        'OPTIONS': {'MAX_ENTRIES': 1000000},
+    },
 }
 
+# Учёт уникальных зрителей скетчами HyperLogLog (app.sketches) вместо строки
+# на каждого зрителя. Строки ProductView тогда сохраняются выборочно и
+# удаляются задачей app.tasks.prune_product_views по истечении срока.
+PRODUCT_VIEW_SKETCHES = os.getenv('PRODUCT_VIEW_SKETCHES', 'False') == 'True'
+PRODUCT_VIEW_ROWS_SAMPLE_RATE = 0.1
+PRODUCT_VIEW_ROWS_RETENTION_DAYS = 30
+
 COMPRESS_ENABLED = True
 
 COMPRESS_OFFLINE = True
@@ -0,0 +1,199 @@
+import datetime
+from collections import Counter
+
+from django.db.models import Count, Q, Sum
+from django.utils import timezone
+
+from app import sketches
+from app.caching import cache_fetch
+from app.models import Product
+from user_capybara.models import TelegramUser
+from . import rollups
+
+PERIOD_DAYS = {'day': 1, 'week': 7, 'month': 30, 'year': 365}
+
+# Текущие итоги (статусы, активные пользователи) не входят в поколение агрегатов,
+# поэтому пакет живёт недолго
+BUNDLE_TTL = 60 * 5
+
+STATUS_LABELS = ['На модерации', 'Одобрено', 'Отклонено', 'Опубликовано', 'Архив', 'Ручная проверка']
+DAYS_OF_WEEK = ['Пн', 'Вт', 'Ср', 'Чт', 'Пт', 'Сб', 'Вс']
+
+COLORS = {
+    'new_users': ('rgba(54, 162, 235, 1)', 'rgba(54, 162, 235, 0.2)'),
+    'new_products': ('rgba(255, 99, 132, 1)', 'rgba(255, 99, 132, 0.2)'),
+    'product_views': ('rgba(75, 192, 192, 1)', 'rgba(75, 192, 192, 0.2)'),
+    'favorites_added': ('rgba(153, 102, 255, 1)', 'rgba(153, 102, 255, 0.2)'),
+}
+LABELS = {
+    'new_users': 'Новые пользователи',
+    'new_products': 'Новые объявления',
+    'product_views': 'Просмотры',
+    'favorites_added': 'Добавлено в избранное',
+}
+
+
+def _dataset(metric, data):
+    border, background = COLORS[metric]
+    return {'label': LABELS[metric], 'data': data, 'borderColor': border, 'backgroundColor': background}
+
+
+def _user_totals():
+    return TelegramUser.objects.aggregate(
+        total=Count('id'),
+        active=Count('id', filter=Q(last_login__gte=timezone.now() - datetime.timedelta(days=30))),
+    )
+
+
+def _products(category_id=0, city_id=0):
+    products = Product.objects.all()
+    if category_id:
+        products = products.filter(category_id=category_id)
+    if city_id:
+        products = products.filter(city_id=city_id)
+    return products
+
+
+def _product_totals(products):
+    """Итоги, статусы и категории объявлений одним запросом с группировкой."""
+    totals = Counter()
+    status_data = [0] * len(STATUS_LABELS)
+    categories = Counter()
+    for row in products.values('status', 'category__name').annotate(
+        count=Count('id'), views=Sum('view_count'), favorites=Sum('favorite_count')
+    ).order_by():
+        totals['products'] += row['count']
+        totals['views'] += row['views'] or 0
+        totals['favorites'] += row['favorites'] or 0
+        if 0 <= row['status'] < len(STATUS_LABELS):
+            status_data[row['status']] += row['count']
+        categories[row['category__name']] += row['count']
+    return totals, status_data, categories
+
+
+def build(period, category_id=0, city_id=0):
+    """
+    Данные всех страниц статистики за период: по секции на каждый API
+    (users, products, views, dashboard) в прежнем формате. Графики берутся из
+    агрегатов одним запросом, итоги — одним запросом к каждой таблице,
+    вовлечённость по дням недели и часам — из тепловой карты.
+
+    Фильтр по категории и городу применяется к графикам, итогам и разбивкам
+    объявлений и к популярным объявлениям. Пользователи, уникальные
+    посетители и тепловая карта такой разбивки не имеют и остаются общими.
+    """
+    labels, keys = rollups.timeline(period)
+    series = rollups.series_many(list(rollups.SOURCES), period, keys, category_id, city_id)
+    users = _user_totals()
+    products = _products(category_id, city_id)
+    totals, status_data, categories = _product_totals(products)
+    popular_products = list(products.select_related('category').order_by('-view_count')[:10])
+    start_date = timezone.now() - datetime.timedelta(days=PERIOD_DAYS.get(period, 30))
+    unique_visitors = sketches.unique_visitors(start_date)
+    heatmap = rollups.heatmap()
+
+    total_users, active_users = users['total'], users['active']
+    total_products, total_views, total_favorites = totals['products'], totals['views'], totals['favorites']
+    active_products = status_data[3]
+
+    top_categories = categories.most_common(6)
+    category_labels = [name for name, count in top_categories]
+    category_data = [count for name, count in top_categories]
+    other_count = total_products - sum(category_data)
+    if other_count > 0:
+        category_labels.append('Другое')
+        category_data.append(other_count)
+
+    popular_products_data = [
+        {
+            'id': product.id,
+            'title': product.title,
+            'category_name': product.category.name,
+            'views_count': product.view_count,
+            'favorites_count': product.favorite_count,
+            'image_url': product.image.url if product.image else None,
+        }
+        for product in popular_products
+    ]
+
+    return {
+        'period': period,
+        'users': {
+            'total_users': total_users,
+            'active_users': active_users,
+            'labels': labels,
+            'datasets': [_dataset('new_users', series['new_users'])],
+            'sources': {
+                'labels': ['Прямой переход', 'Бот', 'Реферальная ссылка'],
+                'data': [int(total_users * 0.4), int(total_users * 0.5), int(total_users * 0.1)],
+            },
+            'activity': {
+                'labels': DAYS_OF_WEEK,
+                'data': [int(active_users * share) for share in (0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 0.7)],
+            },
+            'daily_active_users': int(active_users * 0.3),
+            'weekly_active_users': int(active_users * 0.6),
+            'monthly_active_users': active_users,
+        },
+        'products': {
+            'total_products': total_products,
+            'active_products': active_products,
+            'labels': labels,
+            'datasets': [_dataset('new_products', series['new_products'])],
+            'status_labels': STATUS_LABELS,
+            'status_data': status_data,
+            'category_labels': category_labels,
+            'category_data': category_data,
+        },
+        'views': {
+            'total_views': total_views,
+            'total_favorites': total_favorites,
+            'unique_visitors': unique_visitors,
+            'labels': labels,
+            'datasets': [
+                _dataset('product_views', series['product_views']),
+                _dataset('favorites_added', series['favorites_added']),
+            ],
+            'popular_products': popular_products_data,
+            'avg_views_per_product': round(total_views / max(1, total_products), 2),
+            'avg_favorites_per_product': round(total_favorites / max(1, total_products), 2),
+            'engagement_by_day': {
+                'labels': DAYS_OF_WEEK,
+                'views': [sum(hours) for hours in heatmap['product_views']],
+                'favorites': [sum(hours) for hours in heatmap['favorites_added']],
+            },
+            'heatmap': {
+                'days': DAYS_OF_WEEK,
+                'hours': list(range(24)),
+                'views': heatmap['product_views'],
+                'favorites': heatmap['favorites_added'],
+            },
+        },
+        'dashboard': {
+            'total_users': total_users,
+            'active_users': active_users,
+            'total_products': total_products,
+            'active_products': active_products,
+            'total_views': total_views,
+            'total_favorites': total_favorites,
+            'labels': labels,
+            'users_dataset': _dataset('new_users', series['new_users']),
+            'products_dataset': _dataset('new_products', series['new_products']),
+            'views_dataset': _dataset('product_views', series['product_views']),
+            'favorites_dataset': _dataset('favorites_added', series['favorites_added']),
+            'status_labels': STATUS_LABELS,
+            'status_data': status_data,
+            'popular_products': [
+                {key: item[key] for key in ('id', 'title', 'category_name', 'views_count', 'favorites_count')}
+                for item in popular_products_data[:5]
+            ],
+        },
+    }
+
+
+def get_bundle(period, category_id=0, city_id=0):
+    """Пакет из кэша по периоду, фильтру и поколению агрегатов."""
+    if period not in PERIOD_DAYS:
+        period = 'month'
+    key = f'stats_bundle:{period}:{category_id}:{city_id}:g{rollups.generation()}'
+    return cache_fetch(key, lambda: build(period, category_id, city_id), BUNDLE_TTL)
@@ -0,0 +1,110 @@
+import datetime
+import zoneinfo
+
+import numpy as np
+from django.conf import settings
+from django.db.models.functions import TruncWeek
+from django.utils import timezone
+
+from app.caching import cache_fetch
+from app.models import Product, ProductView, Favorite
+from user_capybara.models import TelegramUser
+
+# Отчёт меняется медленно: пересчитывается в фоне раз в сутки, до того
+# отдаётся предыдущий
+COHORTS_TTL = 60 * 60 * 24
+COHORT_WEEKS = 12
+
+# Источники активности: модель и поле пользователя
+ACTIVITY_SOURCES = (
+    (ProductView, 'user_id'),
+    (Favorite, 'user_id'),
+    (Product, 'author_id'),
+)
+
+
+def _week_number(day):
+    # Номер недели от 01.01.0001 (понедельник), неделя начинается с понедельника
+    return (day.toordinal() - 1) // 7
+
+
+def _weeks(queryset, user_field, time_field, start):
+    """Пары (пользователь, неделя) из БД как два массива int64 без повторов."""
+    tz = zoneinfo.ZoneInfo(settings.TIME_ZONE)
+    pairs = queryset.filter(**{f'{time_field}__gte': start, f'{user_field}__isnull': False}).annotate(
+        week=TruncWeek(time_field, tzinfo=tz)
+    ).values_list(user_field, 'week').distinct().order_by()
+    rows = list(pairs)
+    users = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+    weeks = np.fromiter((_week_number(row[1].date()) for row in rows), dtype=np.int64, count=len(rows))
+    return users, weeks
+
+
+def build(weeks=COHORT_WEEKS):
+    """
+    Удержание пользователей по недельным когортам регистрации за последние
+    weeks недель: доля когорты, проявившая активность (просмотр, избранное,
+    объявление) через 0, 1, ... недель после регистрации.
+    """
+    today = timezone.localdate()
+    current_week = _week_number(today)
+    first_week = current_week - weeks + 1
+    start = timezone.make_aware(datetime.datetime.combine(
+        datetime.date.fromordinal(first_week * 7 + 1), datetime.time.min
+    ))
+
+    user_ids, join_weeks = _weeks(TelegramUser.objects.all(), 'id', 'date_joined', start)
+    cohort_of_user = join_weeks - first_week
+    sizes = np.bincount(cohort_of_user, minlength=weeks)
+
+    event_users, event_weeks = [], []
+    for model, user_field in ACTIVITY_SOURCES:
+        users, event_week = _weeks(model.objects.all(), user_field, 'created_at', start)
+        event_users.append(users)
+        event_weeks.append(event_week)
+    event_users = np.concatenate(event_users)
+    event_weeks = np.concatenate(event_weeks)
+
+    # Неделя регистрации для каждого события через бинарный поиск по id
+    order = np.argsort(user_ids)
+    sorted_ids = user_ids[order]
+    sorted_cohorts = cohort_of_user[order]
+    position = np.searchsorted(sorted_ids, event_users)
+    position[position == len(sorted_ids)] = 0
+    known = sorted_ids[position] == event_users if len(sorted_ids) else np.zeros(len(event_users), dtype=bool)
+    event_cohort = sorted_cohorts[position[known]]
+    offset = event_weeks[known] - first_week - event_cohort
+    event_users = event_users[known]
+
+    valid = offset >= 0
+    # Пользователь учитывается в ячейке один раз, сколько бы источников ни дали активность
+    key = np.unique(event_users[valid] * weeks + offset[valid])
+    cohort_index = sorted_cohorts[np.searchsorted(sorted_ids, key // weeks)]
+    matrix = np.zeros((weeks, weeks), dtype=np.int64)
+    np.add.at(matrix, (cohort_index, key % weeks), 1)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rates = np.where(sizes[:, None] > 0, matrix / sizes[:, None], 0.0)
+    # Недели, которые для когорты ещё не наступили
+    elapsed = (weeks - 1 - np.arange(weeks))[:, None] >= np.arange(weeks)[None, :]
+
+    return {
+        'weeks': list(range(weeks)),
+        'cohorts': [
+            {
+                'start': datetime.date.fromordinal((first_week + row) * 7 + 1).strftime('%d.%m.%Y'),
+                'size': int(sizes[row]),
+                'active': [int(value) if elapsed[row, col] else None for col, value in enumerate(matrix[row])],
+                'retention': [
+                    round(float(value) * 100, 1) if elapsed[row, col] else None
+                    for col, value in enumerate(rates[row])
+                ],
+            }
+            for row in range(weeks)
+        ],
+        'generated_at': timezone.localtime().strftime('%d.%m.%Y %H:%M'),
+    }
+
+
+def get_cohorts(weeks=COHORT_WEEKS):
+    return cache_fetch(f'stats_cohorts:{weeks}', lambda: build(weeks), COHORTS_TTL)
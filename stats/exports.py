@@ -0,0 +1,135 @@
+import csv
+import datetime
+import ipaddress
+import json
+import zlib
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from django.utils.crypto import salted_hmac
+
+from app.models import ProductView, Favorite
+from .models import DailyStats, StatsRollup
+
+# Набор данных: модель, поле времени для фильтра по датам и выгружаемые поля
+DATASETS = {
+    'daily': (DailyStats, 'date', ['date', 'new_users', 'new_products', 'product_views', 'favorites_added']),
+    'rollups': (StatsRollup, 'bucket', ['granularity', 'bucket', 'metric', 'category_id', 'city_id', 'value']),
+    'views': (ProductView, 'created_at', ['id', 'product_id', 'user_id', 'ip_address', 'session_key', 'created_at']),
+    'favorites': (Favorite, 'created_at', ['id', 'user_id', 'product_id', 'created_at']),
+}
+FORMATS = ('csv', 'jsonl')
+
+# Длина префикса сети, до которой обрезается IP зрителя
+IPV4_PREFIX = 24
+IPV6_PREFIX = 48
+
+CHUNK_SIZE = 2000
+# Строки склеиваются в куски примерно такого размера перед отправкой
+WRITE_SIZE = 64 * 1024
+
+
+def queryset(dataset, date_from=None, date_to=None, **filters):
+    """
+    Строки набора данных за [date_from, date_to] включительно по местному
+    времени. Условия на поле времени — диапазоны, чтобы работали индексы.
+    """
+    model, time_field, fields = DATASETS[dataset]
+    qs = model.objects.filter(**filters)
+    if time_field == 'date':
+        if date_from:
+            qs = qs.filter(date__gte=date_from)
+        if date_to:
+            qs = qs.filter(date__lte=date_to)
+    else:
+        if date_from:
+            start = timezone.make_aware(datetime.datetime.combine(date_from, datetime.time.min))
+            qs = qs.filter(**{f'{time_field}__gte': start})
+        if date_to:
+            end = timezone.make_aware(datetime.datetime.combine(date_to + datetime.timedelta(days=1), datetime.time.min))
+            qs = qs.filter(**{f'{time_field}__lt': end})
+    # Порядок по индексированному полю не требует сортировки в БД
+    return qs.order_by('date' if time_field == 'date' else 'pk').values_list(*fields)
+
+
+def _ip_network(ip_address):
+    if not ip_address:
+        return ''
+    ip = ipaddress.ip_address(ip_address)
+    prefix = IPV4_PREFIX if ip.version == 4 else IPV6_PREFIX
+    return str(ipaddress.ip_network(f'{ip}/{prefix}', strict=False))
+
+
+def _session_hash(session_key):
+    # Одинаковые сессии дают одинаковый хэш, но по нему сессию не восстановить
+    if not session_key:
+        return ''
+    return salted_hmac('stats.exports.session', session_key).hexdigest()[:16]
+
+
+def _anonymize_view(row):
+    pk, product_id, user_id, ip_address, session_key, created_at = row
+    return pk, product_id, user_id, _ip_network(ip_address), _session_hash(session_key), created_at
+
+
+# Ключ сессии — действующий токен входа, IP — персональные данные: вместо них
+# выгружаются хэш сессии и сеть зрителя. Набор данных: (поля выгрузки, обработка строки)
+ANONYMIZED = {
+    'views': (['id', 'product_id', 'user_id', 'ip_network', 'session_hash', 'created_at'], _anonymize_view),
+}
+
+
+class _Echo:
+    """Буфер для csv.writer, который возвращает записанную строку."""
+
+    def write(self, value):
+        return value
+
+
+def _csv_lines(fields, rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(fields)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def _jsonl_lines(fields, rows):
+    for row in rows:
+        yield json.dumps(dict(zip(fields, row)), cls=DjangoJSONEncoder, ensure_ascii=False) + '\n'
+
+
+def _batched(lines):
+    batch, size = [], 0
+    for line in lines:
+        batch.append(line)
+        size += len(line)
+        if size >= WRITE_SIZE:
+            yield ''.join(batch).encode()
+            batch, size = [], 0
+    if batch:
+        yield ''.join(batch).encode()
+
+
+def _gzipped(chunks):
+    # wbits=31 — формат gzip с заголовком и контрольной суммой
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def stream(dataset, fmt='csv', gzip=False, **kwargs):
+    """
+    Генератор байтов выгрузки. Строки читаются из БД курсором порциями по
+    CHUNK_SIZE, поэтому память не зависит от размера выгрузки.
+    """
+    fields = DATASETS[dataset][2]
+    rows = queryset(dataset, **kwargs).iterator(chunk_size=CHUNK_SIZE)
+    if dataset in ANONYMIZED:
+        fields, anonymize = ANONYMIZED[dataset]
+        rows = map(anonymize, rows)
+    lines = _csv_lines(fields, rows) if fmt == 'csv' else _jsonl_lines(fields, rows)
+    chunks = _batched(lines)
+    return _gzipped(chunks) if gzip else chunks
@@ -0,0 +1,55 @@
+import datetime
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.utils import timezone
+
+from stats.tasks import count_days_stats, save_daily_stats
+
+
+def _init_worker():
+    # При запуске через spawn дочернему процессу нужно заново настроить Django
+    django.setup()
+
+
+class Command(BaseCommand):
+    help = 'Recomputes DailyStats for a date range, counting chunks of days in parallel worker processes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='date_from', type=datetime.date.fromisoformat, required=True,
+                            help='First day to recompute (YYYY-MM-DD)')
+        parser.add_argument('--to', dest='date_to', type=datetime.date.fromisoformat,
+                            help='Last day to recompute (YYYY-MM-DD), today by default')
+        parser.add_argument('--workers', type=int, default=4, help='Number of worker processes')
+        parser.add_argument('--chunk-days', type=int, default=7, help='Days per worker task')
+
+    def handle(self, *args, **options):
+        date_from = options['date_from']
+        date_to = options['date_to'] or timezone.localdate()
+        if date_from > date_to:
+            raise CommandError('--from must not be later than --to')
+
+        days = [date_from + datetime.timedelta(days=n) for n in range((date_to - date_from).days + 1)]
+        chunk_days = max(1, options['chunk_days'])
+        chunks = [days[i:i + chunk_days] for i in range(0, len(days), chunk_days)]
+        self.stdout.write(f'Recomputing {len(days)} days in {len(chunks)} chunks...')
+
+        done = 0
+        if options['workers'] <= 1:
+            for chunk in chunks:
+                save_daily_stats(count_days_stats(chunk))
+                done += len(chunk)
+        else:
+            # Рабочие процессы открывают свои соединения, унаследованные использовать нельзя
+            connections.close_all()
+            with ProcessPoolExecutor(max_workers=options['workers'], initializer=_init_worker) as pool:
+                futures = [pool.submit(count_days_stats, chunk) for chunk in chunks]
+                for future in as_completed(futures):
+                    results = future.result()
+                    save_daily_stats(results)
+                    done += len(results)
+                    self.stdout.write(f'  {done}/{len(days)} days')
+
+        self.stdout.write(self.style.SUCCESS(f'Successfully recomputed stats for {done} days'))
@@ -0,0 +1,44 @@
+# Generated by Django 5.1.7 on 2026-10-18 17:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stats', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RollupWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('metric', models.CharField(max_length=20, unique=True, verbose_name='Метрика')),
+                ('last_id', models.BigIntegerField(default=0, verbose_name='Последний id')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Обновлено')),
+            ],
+            options={
+                'verbose_name': 'Позиция агрегации',
+                'verbose_name_plural': 'Позиции агрегации',
+            },
+        ),
+        migrations.CreateModel(
+            name='StatsRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('granularity', models.CharField(choices=[('hour', 'Час'), ('day', 'День')], max_length=4, verbose_name='Интервал')),
+                ('bucket', models.DateTimeField(verbose_name='Начало интервала')),
+                ('metric', models.CharField(choices=[('new_users', 'Новые пользователи'), ('new_products', 'Новые объявления'), ('product_views', 'Просмотры'), ('favorites_added', 'Добавлено в избранное')], max_length=20, verbose_name='Метрика')),
+                ('category_id', models.PositiveIntegerField(default=0, verbose_name='Категория')),
+                ('city_id', models.PositiveIntegerField(default=0, verbose_name='Город')),
+                ('value', models.PositiveIntegerField(default=0, verbose_name='Значение')),
+            ],
+            options={
+                'verbose_name': 'Агрегат статистики',
+                'verbose_name_plural': 'Агрегаты статистики',
+                'indexes': [models.Index(fields=['metric', 'granularity', 'bucket'], name='stats_stats_metric_1cbf5d_idx')],
+                'unique_together': {('granularity', 'bucket', 'metric', 'category_id', 'city_id')},
+            },
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 5.1.7 on 2026-10-18 17:34
+
+import zoneinfo
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import ExtractHour, ExtractWeekDay
+
+
+def populate_heatmap(apps, schema_editor):
+    # Раскладывает по дню недели и часу строки, уже учтённые в агрегатах (до
+    # сохранённой позиции); дальше карту ведёт stats.rollups.update_metric
+    EngagementHeatmap = apps.get_model('stats', 'EngagementHeatmap')
+    RollupWatermark = apps.get_model('stats', 'RollupWatermark')
+    tz = zoneinfo.ZoneInfo(settings.TIME_ZONE)
+    positions = dict(RollupWatermark.objects.values_list('metric', 'last_id'))
+    for metric, model_name in (('product_views', 'ProductView'), ('favorites_added', 'Favorite')):
+        weight = 1
+        # В режиме скетчей строки просмотров сохраняются выборочно
+        if metric == 'product_views' and getattr(settings, 'PRODUCT_VIEW_SKETCHES', False):
+            weight = 1 / getattr(settings, 'PRODUCT_VIEW_ROWS_SAMPLE_RATE', 1.0)
+        cells = apps.get_model('app', model_name).objects.filter(pk__lte=positions.get(metric, 0)).annotate(
+            weekday=ExtractWeekDay('created_at', tzinfo=tz),
+            hour=ExtractHour('created_at', tzinfo=tz),
+        ).values_list('weekday', 'hour').annotate(count=Count('pk')).order_by()
+        EngagementHeatmap.objects.bulk_create([
+            # ExtractWeekDay считает с воскресенья (1), в карте неделя начинается с понедельника
+            EngagementHeatmap(metric=metric, weekday=(weekday + 5) % 7, hour=hour, value=int(round(count * weight)))
+            for weekday, hour, count in cells
+        ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stats', '0002_rollups'),
+        ('app', '0013_productviewsketch'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EngagementHeatmap',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('metric', models.CharField(choices=[('product_views', 'Просмотры'), ('favorites_added', 'Добавлено в избранное')], max_length=20, verbose_name='Метрика')),
+                ('weekday', models.PositiveSmallIntegerField(verbose_name='День недели')),
+                ('hour', models.PositiveSmallIntegerField(verbose_name='Час')),
+                ('value', models.PositiveIntegerField(default=0, verbose_name='Значение')),
+            ],
+            options={
+                'verbose_name': 'Ячейка тепловой карты',
+                'verbose_name_plural': 'Тепловая карта вовлечённости',
+                'unique_together': {('metric', 'weekday', 'hour')},
+            },
+        ),
+        migrations.RunPython(populate_heatmap, migrations.RunPython.noop),
+    ]
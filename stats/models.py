@@ -13,4 +13,77 @@ class DailyStats(models.Model):
         ordering = ['-date']
     
     def __str__(self):
-        return f"Статистика за {self.date}"
\ No newline at end of file
+        return f"Статистика за {self.date}"
+
+class StatsRollup(models.Model):
+    """
+    Счётчик событий за час или день в разрезе категории и города
+    (см. stats.rollups). 0 в category_id/city_id — без разбивки.
+    """
+    GRANULARITY_CHOICES = [
+        ('hour', 'Час'),
+        ('day', 'День'),
+    ]
+    METRIC_CHOICES = [
+        ('new_users', 'Новые пользователи'),
+        ('new_products', 'Новые объявления'),
+        ('product_views', 'Просмотры'),
+        ('favorites_added', 'Добавлено в избранное'),
+    ]
+
+    granularity = models.CharField(max_length=4, choices=GRANULARITY_CHOICES, verbose_name='Интервал')
+    bucket = models.DateTimeField(verbose_name='Начало интервала')
+    metric = models.CharField(max_length=20, choices=METRIC_CHOICES, verbose_name='Метрика')
+    category_id = models.PositiveIntegerField(default=0, verbose_name='Категория')
+    city_id = models.PositiveIntegerField(default=0, verbose_name='Город')
+    value = models.PositiveIntegerField(default=0, verbose_name='Значение')
+
+    class Meta:
+        verbose_name = 'Агрегат статистики'
+        verbose_name_plural = 'Агрегаты статистики'
+        unique_together = ('granularity', 'bucket', 'metric', 'category_id', 'city_id')
+        indexes = [
+            models.Index(fields=['metric', 'granularity', 'bucket']),
+        ]
+
+    def __str__(self):
+        return f"{self.metric} {self.granularity} {self.bucket}: {self.value}"
+
+
+class RollupWatermark(models.Model):
+    """Последняя учтённая в агрегатах строка источника метрики."""
+    metric = models.CharField(max_length=20, unique=True, verbose_name='Метрика')
+    last_id = models.BigIntegerField(default=0, verbose_name='Последний id')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Обновлено')
+
+    class Meta:
+        verbose_name = 'Позиция агрегации'
+        verbose_name_plural = 'Позиции агрегации'
+
+    def __str__(self):
+        return f"{self.metric}: {self.last_id}"
+
+
+
+class EngagementHeatmap(models.Model):
+    """
+    Просмотры и добавления в избранное за всё время по дню недели и часу
+    (по местному времени TIME_ZONE): 7×24 ячейки на метрику.
+    """
+    METRIC_CHOICES = [
+        ('product_views', 'Просмотры'),
+        ('favorites_added', 'Добавлено в избранное'),
+    ]
+
+    metric = models.CharField(max_length=20, choices=METRIC_CHOICES, verbose_name='Метрика')
+    weekday = models.PositiveSmallIntegerField(verbose_name='День недели')  # 0 — понедельник
+    hour = models.PositiveSmallIntegerField(verbose_name='Час')
+    value = models.PositiveIntegerField(default=0, verbose_name='Значение')
+
+    class Meta:
+        verbose_name = 'Ячейка тепловой карты'
+        verbose_name_plural = 'Тепловая карта вовлечённости'
+        unique_together = ('metric', 'weekday', 'hour')
+
+    def __str__(self):
+        return f"{self.metric} {self.weekday} {self.hour}:00: {self.value}"
@@ -0,0 +1,70 @@
+import datetime
+
+import numpy as np
+from django.db.models import Count
+from django.utils import timezone
+
+from app.caching import cache_fetch
+from app.models import Product
+
+# Очередь меняется быстро, отчёт пересчитывается раз в минуту
+MODERATION_TTL = 60
+WINDOW_DAYS = 14
+
+
+def _percentiles(seconds):
+    if not len(seconds):
+        return {'p50': None, 'p95': None}
+    p50, p95 = np.percentile(seconds, [50, 95])
+    return {'p50': round(float(p50)), 'p95': round(float(p95))}
+
+
+def build(days=WINDOW_DAYS):
+    """
+    Очередь модерации сейчас и время до публикации за последние days дней.
+    Читаются только ожидающие объявления (индекс по статусу) и проверенные
+    за окно (индекс по moderated_at), а не вся таблица.
+    """
+    now = timezone.now()
+    queue = Product.objects.filter(status__in=(0, 5))
+    backlog = dict(queue.values_list('status').annotate(count=Count('pk')).order_by())
+    queued_at = [row for row in queue.values_list('queued_at', flat=True) if row is not None]
+    waiting = np.array([(now - moment).total_seconds() for moment in queued_at], dtype=np.float64)
+
+    start = timezone.localtime(now).replace(hour=0, minute=0, second=0, microsecond=0) - datetime.timedelta(days=days - 1)
+    rows = list(
+        Product.objects.filter(moderated_at__gte=start, queued_at__isnull=False)
+        .values_list('status', 'queued_at', 'moderated_at')
+    )
+    published = [(moderated_at, (moderated_at - queued).total_seconds()) for status, queued, moderated_at in rows if status in (3, 4)]
+    seconds = np.array([value for moment, value in published], dtype=np.float64)
+
+    by_day = {}
+    for moment, value in published:
+        by_day.setdefault(timezone.localtime(moment).date(), []).append(value)
+    daily = []
+    for offset in range(days):
+        day = (start + datetime.timedelta(days=offset)).date()
+        values = np.array(by_day.get(day, []), dtype=np.float64)
+        daily.append({'date': day.strftime('%d.%m'), 'published': len(values), **_percentiles(values)})
+
+    return {
+        'backlog': {
+            'pending': backlog.get(0, 0),
+            'manual_review': backlog.get(5, 0),
+            'oldest_seconds': round(float(waiting.max())) if len(waiting) else None,
+            'waiting': _percentiles(waiting),
+        },
+        'time_to_publish': {
+            'days': days,
+            'published': len(published),
+            'rejected': sum(1 for status, queued, moderated_at in rows if status == 2),
+            **_percentiles(seconds),
+        },
+        'daily': daily,
+        'generated_at': timezone.localtime(now).strftime('%d.%m.%Y %H:%M'),
+    }
+
+
+def get_moderation_stats(days=WINDOW_DAYS):
+    return cache_fetch(f'stats_moderation:{days}', lambda: build(days), MODERATION_TTL)
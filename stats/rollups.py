@@ -0,0 +1,238 @@
+import datetime
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from app import sketches
+from app.caching import get_version, bump_version
+from app.models import Product, ProductView, Favorite
+from user_capybara.models import TelegramUser
+from .models import StatsRollup, RollupWatermark, EngagementHeatmap
+
+
+# Источник метрики: модель, поле времени и путь до объявления (для разбивки
+# по категории и городу) или None, если разбивки нет
+SOURCES = {
+    'new_users': (TelegramUser, 'date_joined', None),
+    'new_products': (Product, 'created_at', ''),
+    'product_views': (ProductView, 'created_at', 'product__'),
+    'favorites_added': (Favorite, 'created_at', 'product__'),
+}
+
+# Метрики, которые также раскладываются по дню недели и часу
+HEATMAP_METRICS = ('product_views', 'favorites_added')
+
+BATCH_SIZE = 5000
+
+# Позиция агрегации — id строки, но на PostgreSQL строка с меньшим id может
+# зафиксироваться позже строки с большим и оказаться позади позиции. Поэтому
+# строки моложе COMMIT_LAG ждут следующего прохода: за это время транзакции,
+# начатые раньше, успевают завершиться.
+COMMIT_LAG = datetime.timedelta(minutes=2)
+
+# Поколение агрегатов: меняется, когда в них попадают новые строки
+GENERATION_KEY = 'stats_generation'
+
+
+def _weight(metric):
+    # В режиме скетчей строки просмотров сохраняются выборочно
+    if metric == 'product_views' and sketches.enabled():
+        return 1 / getattr(settings, 'PRODUCT_VIEW_ROWS_SAMPLE_RATE', 1.0)
+    return 1
+
+
+def _apply(metric, counts):
+    """Прибавляет пачку приращений к агрегатам одним чтением и двумя записями."""
+    existing = {
+        (rollup.granularity, rollup.bucket, rollup.category_id, rollup.city_id): rollup
+        for rollup in StatsRollup.objects.select_for_update().filter(
+            metric=metric, bucket__in={key[1] for key in counts}
+        )
+    }
+    changed, created = [], []
+    for (granularity, bucket, category_id, city_id), value in counts.items():
+        value = int(round(value))
+        rollup = existing.get((granularity, bucket, category_id, city_id))
+        if rollup is None:
+            created.append(StatsRollup(
+                granularity=granularity, bucket=bucket, metric=metric,
+                category_id=category_id, city_id=city_id, value=value,
+            ))
+        else:
+            rollup.value += value
+            changed.append(rollup)
+    StatsRollup.objects.bulk_update(changed, ['value'], batch_size=1000)
+    StatsRollup.objects.bulk_create(created, batch_size=1000)
+
+
+def _apply_heatmap(metric, cells):
+    """
+    Прибавляет пачку к ячейкам тепловой карты. Вызывается под блокировкой
+    позиции метрики, поэтому недостающие ячейки создаёт только один проход.
+    """
+    existing = {
+        (cell.weekday, cell.hour): cell
+        for cell in EngagementHeatmap.objects.select_for_update().filter(metric=metric)
+    }
+    changed, created = [], []
+    for (weekday, hour), value in cells.items():
+        value = int(round(value))
+        cell = existing.get((weekday, hour))
+        if cell is None:
+            created.append(EngagementHeatmap(metric=metric, weekday=weekday, hour=hour, value=value))
+        else:
+            cell.value += value
+            changed.append(cell)
+    EngagementHeatmap.objects.bulk_update(changed, ['value'])
+    EngagementHeatmap.objects.bulk_create(created)
+
+
+def _count(rows, product_path, weight):
+    """Приращения агрегатов и тепловой карты для пачки строк источника."""
+    counts = Counter()
+    cells = Counter()
+    for row in rows:
+        hour = timezone.localtime(row[1]).replace(minute=0, second=0, microsecond=0)
+        day = hour.replace(hour=0)
+        category_id, city_id = (row[2] or 0, row[3] or 0) if product_path is not None else (0, 0)
+        for dimensions in {(category_id, city_id), (category_id, 0), (0, city_id), (0, 0)}:
+            counts[('hour', hour) + dimensions] += weight
+            counts[('day', day) + dimensions] += weight
+        cells[(hour.weekday(), hour.hour)] += weight
+    return counts, cells
+
+
+def update_metric(metric, batch_size=BATCH_SIZE):
+    """
+    Учитывает в агрегатах строки источника с id больше сохранённой позиции,
+    кроме созданных за последние COMMIT_LAG. Каждое событие попадает в часовой и дневной интервал, в свою пару
+    категория/город и в итоги по категории, по городу и общий.
+
+    Проход запускают несколько задач django-q и кнопка в админке, поэтому
+    позиция читается и сдвигается под блокировкой строки в той же
+    транзакции, что и агрегаты: параллельный проход ждёт и продолжает уже
+    с новой позиции, а не учитывает те же строки второй раз.
+    """
+    model, time_field, product_path = SOURCES[metric]
+    fields = ['pk', time_field]
+    if product_path is not None:
+        fields += [f'{product_path}category_id', f'{product_path}city_id']
+    weight = _weight(metric)
+
+    RollupWatermark.objects.get_or_create(metric=metric)
+    processed = 0
+    cutoff = timezone.now() - COMMIT_LAG
+    while True:
+        with transaction.atomic():
+            watermark = RollupWatermark.objects.select_for_update().get(metric=metric)
+            rows = list(model.objects.filter(pk__gt=watermark.last_id).order_by('pk').values_list(*fields)[:batch_size])
+            # Позиция не проходит дальше первой слишком свежей строки
+            held = next((index for index, row in enumerate(rows) if row[1] > cutoff), None)
+            if held is not None:
+                rows = rows[:held]
+            if rows:
+                counts, cells = _count(rows, product_path, weight)
+                _apply(metric, counts)
+                if metric in HEATMAP_METRICS:
+                    _apply_heatmap(metric, cells)
+                watermark.last_id = rows[-1][0]
+                watermark.save(update_fields=['last_id', 'updated_at'])
+        processed += len(rows)
+        if not rows or held is not None:
+            break
+    return processed
+
+
+def update_all():
+    processed = {metric: update_metric(metric) for metric in SOURCES}
+    if any(processed.values()):
+        bump_version(GENERATION_KEY)
+    return processed
+
+
+def heatmap():
+    """Тепловая карта: {metric: [[значение по часам] × 7 дней]} одним запросом."""
+    grid = {metric: [[0] * 24 for _ in range(7)] for metric in HEATMAP_METRICS}
+    for metric, weekday, hour, value in EngagementHeatmap.objects.values_list('metric', 'weekday', 'hour', 'value'):
+        grid[metric][weekday][hour] = value
+    return grid
+
+
+def generation():
+    return get_version(GENERATION_KEY)
+
+
+def timeline(period):
+    """
+    Подписи и ключи точек графика за период: часы за сутки, дни за неделю
+    или месяц, месяцы за год.
+    """
+    now = timezone.localtime()
+    labels, keys = [], []
+    if period == 'day':
+        current = (now - datetime.timedelta(days=1)).replace(minute=0, second=0, microsecond=0)
+        while current <= now:
+            labels.append(current.strftime('%H:%M'))
+            keys.append(current)
+            current += datetime.timedelta(hours=1)
+    elif period == 'year':
+        current = (now - datetime.timedelta(days=365)).date().replace(day=1)
+        while current <= now.date():
+            labels.append(current.strftime('%b %Y'))
+            keys.append(current)
+            current = (current + datetime.timedelta(days=32)).replace(day=1)
+    else:
+        days = 7 if period == 'week' else 30
+        current = (now - datetime.timedelta(days=days)).date()
+        while current <= now.date():
+            labels.append(current.strftime('%d.%m'))
+            keys.append(current)
+            current += datetime.timedelta(days=1)
+    return labels, keys
+
+
+def series_many(metrics, period, keys, category_id=0, city_id=0):
+    """
+    Значения нескольких метрик для точек timeline одним запросом:
+    {metric: [value, ...]}. Читаются только агрегаты. Метрики без разбивки
+    по категории и городу берутся целиком.
+    """
+    if period == 'day':
+        granularity, start = 'hour', keys[0]
+    else:
+        granularity = 'day'
+        start = timezone.make_aware(datetime.datetime.combine(keys[0], datetime.time.min))
+    split = [metric for metric in metrics if SOURCES[metric][2] is not None]
+    whole = [metric for metric in metrics if SOURCES[metric][2] is None]
+    totals = {metric: defaultdict(int) for metric in metrics}
+    for metric, bucket, value in StatsRollup.objects.filter(
+        Q(metric__in=split, category_id=category_id, city_id=city_id)
+        | Q(metric__in=whole, category_id=0, city_id=0),
+        granularity=granularity, bucket__gte=start,
+    ).values_list('metric', 'bucket', 'value'):
+        bucket = timezone.localtime(bucket)
+        if period == 'year':
+            key = bucket.date().replace(day=1)
+        elif period == 'day':
+            key = bucket
+        else:
+            key = bucket.date()
+        totals[metric][key] += value
+    return {metric: [totals[metric].get(key, 0) for key in keys] for metric in metrics}
+
+
+def series(metric, period, keys, category_id=0, city_id=0):
+    """Значения метрики для точек timeline: читаются только агрегаты."""
+    return series_many([metric], period, keys, category_id, city_id)[metric]
+
+
+def total(metric, day):
+    """Значение метрики за день без разбивки."""
+    bucket = timezone.make_aware(datetime.datetime.combine(day, datetime.time.min))
+    rollup = StatsRollup.objects.filter(
+        metric=metric, granularity='day', bucket=bucket, category_id=0, city_id=0
+    ).first()
+    return rollup.value if rollup else 0
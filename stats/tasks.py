@@ -1,53 +1,84 @@
 # stats/tasks.py
 from django.utils import timezone
-from django.db.models import Count
-from datetime import timedelta
+from datetime import datetime, time, timedelta
 from django_q.tasks import async_task, schedule
 from django_q.models import Schedule
 
 from app.models import Product, ProductView, Favorite
+from app import sketches
 from user_capybara.models import TelegramUser
+from . import rollups
 from .models import DailyStats
 
+DAILY_FIELDS = ['new_users', 'new_products', 'product_views', 'favorites_added']
+
+def count_day_stats(day):
+    """
+    Считает показатели дня по исходным таблицам. Условия вида
+    [начало дня, начало следующего) используют индексы по времени создания.
+    """
+    start = timezone.make_aware(datetime.combine(day, time.min))
+    end = timezone.make_aware(datetime.combine(day + timedelta(days=1), time.min))
+    
+    if sketches.enabled():
+        # Строки просмотров хранятся выборочно и удаляются, агрегаты — нет
+        product_views = rollups.total('product_views', day)
+    else:
+        product_views = ProductView.objects.filter(created_at__gte=start, created_at__lt=end).count()
+    
+    return {
+        'new_users': TelegramUser.objects.filter(date_joined__gte=start, date_joined__lt=end).count(),
+        'new_products': Product.objects.filter(created_at__gte=start, created_at__lt=end).count(),
+        'product_views': product_views,
+        'favorites_added': Favorite.objects.filter(created_at__gte=start, created_at__lt=end).count(),
+    }
+
+def count_days_stats(days):
+    """Показатели нескольких дней: [(день, {поле: значение}), ...]."""
+    return [(day, count_day_stats(day)) for day in days]
+
+def save_daily_stats(results):
+    """Записывает показатели дней, перезаписывая существующие строки."""
+    DailyStats.objects.bulk_create(
+        [DailyStats(date=day, **values) for day, values in results],
+        update_conflicts=True,
+        unique_fields=['date'],
+        update_fields=DAILY_FIELDS,
+    )
+
+def update_rollups():
+    """
+    Догоняет часовые и дневные агрегаты по новым строкам.
+    Эта функция вызывается каждые 5 минут через Django Q.
+    """
+    return rollups.update_all()
+
+
 def aggregate_daily_stats():
     """
     Агрегирует статистику за предыдущий день.
     Эта функция вызывается ежедневно через Django Q.
     """
-    yesterday = timezone.now().date() - timedelta(days=1)
+    yesterday = timezone.localdate() - timedelta(days=1)
     
-    # Проверяем, не агрегировали ли мы уже статистику за этот день
-    if DailyStats.objects.filter(date=yesterday).exists():
-        return
+    # Строку за вчера уже создавало ежечасное обновление без последнего часа,
+    # поэтому она пересчитывается, а не пропускается. Пропуски за прошлые дни
+    # заполняет команда backfill_stats.
     
-    # Считаем новых пользователей
-    new_users = TelegramUser.objects.filter(
-        date_joined__date=yesterday
-    ).count()
-    
-    # Считаем новые объявления
-    new_products = Product.objects.filter(
-        created_at__date=yesterday
-    ).count()
-    
-    # Считаем просмотры
-    product_views = ProductView.objects.filter(
-        created_at__date=yesterday
-    ).count()
-    
-    # Считаем добавления в избранное
-    favorites_added = Favorite.objects.filter(
-        created_at__date=yesterday
-    ).count()
+    # Берём значения из агрегатов, предварительно догнав их
+    rollups.update_all()
+    new_users = rollups.total('new_users', yesterday)
+    new_products = rollups.total('new_products', yesterday)
+    product_views = rollups.total('product_views', yesterday)
+    favorites_added = rollups.total('favorites_added', yesterday)
     
     # Сохраняем статистику
-    DailyStats.objects.create(
-        date=yesterday,
-        new_users=new_users,
-        new_products=new_products,
-        product_views=product_views,
-        favorites_added=favorites_added
-    )
+    save_daily_stats([(yesterday, {
+        'new_users': new_users,
+        'new_products': new_products,
+        'product_views': product_views,
+        'favorites_added': favorites_added
+    })])
     
     return {
         'date': yesterday.strftime('%Y-%m-%d'),
@@ -62,30 +93,17 @@ def update_current_day_stats():
     Обновляет статистику за текущий день.
     Эта функция вызывается каждый час через Django Q.
     """
-    today = timezone.now().date()
+    today = timezone.localdate()
     
     # Получаем или создаем запись статистики за сегодня
     daily_stat, created = DailyStats.objects.get_or_create(date=today)
     
-    # Получаем количество новых пользователей за сегодня
-    new_users = TelegramUser.objects.filter(
-        date_joined__date=today
-    ).count()
-    
-    # Получаем количество новых объявлений за сегодня
-    new_products = Product.objects.filter(
-        created_at__date=today
-    ).count()
-    
-    # Получаем количество просмотров за сегодня
-    product_views = ProductView.objects.filter(
-        created_at__date=today
-    ).count()
-    
-    # Получаем количество добавлений в избранное за сегодня
-    favorites_added = Favorite.objects.filter(
-        created_at__date=today
-    ).count()
+    # Берём значения за сегодня из агрегатов, предварительно догнав их
+    rollups.update_all()
+    new_users = rollups.total('new_users', today)
+    new_products = rollups.total('new_products', today)
+    product_views = rollups.total('product_views', today)
+    favorites_added = rollups.total('favorites_added', today)
     
     # Обновляем статистику
     daily_stat.new_users = new_users
@@ -108,7 +126,15 @@ def schedule_stats_tasks():
     Эта функция должна вызываться при запуске приложения.
     """
     # Удаляем существующие задачи с такими же именами
-    Schedule.objects.filter(name__in=['aggregate_daily_stats', 'update_current_day_stats']).delete()
+    Schedule.objects.filter(name__in=['update_rollups', 'aggregate_daily_stats', 'update_current_day_stats']).delete()
+    
+    # Создаем задачу для обновления агрегатов (каждые 5 минут)
+    schedule(
+        'stats.tasks.update_rollups',
+        schedule_type=Schedule.MINUTES,
+        minutes=5,
+        name='update_rollups'
+    )
     
     # Создаем задачу для агрегации статистики за предыдущий день (каждый день в 00:05)
     schedule(
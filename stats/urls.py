@@ -9,14 +9,22 @@ urlpatterns = [
     path('user_stats/', views.user_stats, name='user_stats'),
     path('product_stats/', views.product_stats, name='product_stats'),
     path('views_stats/', views.views_stats, name='views_stats'),
+    path('cohort_stats/', views.cohort_stats, name='cohort_stats'),
+    path('moderation_stats/', views.moderation_stats, name='moderation_stats'),
     
     # API для получения данных
     path('api/users/', views.api_users_stats, name='api_users_stats'),
     path('api/products/', views.api_products_stats, name='api_products_stats'),
     path('api/views/', views.api_views_stats, name='api_views_stats'),
     path('api/dashboard/', views.api_dashboard_stats, name='api_dashboard_stats'),
+    path('api/bundle/', views.api_bundle_stats, name='api_bundle_stats'),
+    path('api/cohorts/', views.api_cohorts_stats, name='api_cohorts_stats'),
+    path('api/moderation/', views.api_moderation_stats, name='api_moderation_stats'),
     path('api/daily/', views.api_daily_stats, name='api_daily_stats'),
     
+    # Выгрузка данных
+    path('export/<str:dataset>/', views.export_stats, name='export_stats'),
+    
     # Обновление ежедневной статистики
     path('update_daily_stats/', views.update_daily_stats, name='update_daily_stats'),
 ]